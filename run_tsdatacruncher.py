@@ -14,57 +14,733 @@ TO DO
 """
 
 
-import pandas as pd
-from obspy import UTCDateTime
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from obspy import UTCDateTime, Stream
+from obspy.core.util.misc import get_window_times
 
 import tsdatacruncher.utils.input as tsinput
 import tsdatacruncher.utils.tsdata as tsdata
-from tsdatacruncher.utils import msg
+from tsdatacruncher.utils import availability, metrics, msg
 from tsdatacruncher.packages.ffrsam import ffrsam as ffrsam_utils
-from tsdatacruncher.utils.logs import setup_logger
+from tsdatacruncher.packages.ffrsam.cache import DayFileCache
+from tsdatacruncher.packages.ffrsam.coverage import get_coverage_index
+from tsdatacruncher.packages.ffrsam.realtime import RealtimeRSAM, load_state, save_state
+from tsdatacruncher.packages.print_stream_info.inventory import get_inventory
+from tsdatacruncher.utils.wavecache import get_cached_client
+from tsdatacruncher.utils.backfill import BackfillManifest
+from tsdatacruncher.utils.logs import setup_logger, setup_worker_logger, start_queue_listener
 
 
-def main(client, station_ids, t1, t2, freq=[None], tload=1440.0, tproc=10.0, tstep=10.0,
-         verbose=True, log_file=None, log_level="INFO", config={}):
-    """Main processing function."""
+def process_stream(st, windows, freq=[None], archive="./", mode="filter", cache=None, overwrite=True, pyramid=None,
+                   precision=None, logger=None):
+    """
+    Runs the processing step on every (start, stop) processing window of a load chunk, with RSAM samples on the
+    grid of the window start. Logs one summary line per window (details per channel and band at DEBUG). Returns
+    the number of failures (see archive_ffrsam).
+    """
 
-    logger = setup_logger("tsdatacruncher", log_level, log_file, console_output=verbose)
+    failed = 0
+    for start, stop in windows:
+        st_proc = st.slice(start, stop)
+        if not st_proc:
+            continue  # no data in this window (e.g., large gap)
+        tproc1 = min([tmp.stats.starttime for tmp in st_proc])
+        tproc2 = max([tmp.stats.endtime for tmp in st_proc])
+        if logger:
+            logger.debug(f"- Processing {tproc1} to {tproc2}")
+        t0 = time.perf_counter()
 
-    msg.welcome(logger=logger)
+        # APPLY PROCESSING - YOUR CODE HERE!
+        counts = ffrsam_utils.archive_ffrsam(st_proc, freq=freq, archive=archive, mode=mode,
+                                             cache=cache, overwrite=overwrite, pyramid=pyramid, precision=precision,
+                                             origin=start, logger=logger)
+
+        if logger:
+            logger.info(f"- Processed {tproc1} to {tproc2}: {counts['channels']} channels, {len(freq)} bands "
+                        f"({counts['computed']} RSAM traces"
+                        + (f", {counts['archived']} channels already archived" if counts["archived"] else "")
+                        + (f", {counts['failed']} failed" if counts["failed"] else "")
+                        + f") in {time.perf_counter() - t0:.2f} s")
+        failed += counts["failed"]
+    return failed
+
+
+def process_worker(st, windows, freq=[None], archive="./", mode="filter", cache_mb=256, overwrite=True,
+                   pyramid=None, precision=None, collect_metrics=False):
+    """
+    Runs process_stream in a worker process on a subset of the stations of a load chunk. Returns the number of
+    failures (including day files that could not be written) and, with collect_metrics, the timers and counters of
+    the task (see utils.metrics).
+    """
+
+    logger = logging.getLogger("tsdatacruncher")  # forwards to the parent process (see logs.setup_worker_logger)
+    if collect_metrics:
+        metrics.start()
+    cache = DayFileCache(max_bytes=cache_mb * 1024 ** 2, logger=logger) if cache_mb > 0 else None
+    try:
+        failed = process_stream(st, windows, freq=freq, archive=archive, mode=mode, cache=cache, overwrite=overwrite,
+                                pyramid=pyramid, precision=precision, logger=logger)
+    finally:
+        if cache is not None:
+            cache.flush()
+    return failed + (cache.failed if cache is not None else 0), metrics.stop() if collect_metrics else None
+
+
+def process_incremental(st, realtime, logger=None):
+    """Feeds every trace of a load chunk to the incremental RSAM (realtime), continuing the filters of each channel."""
+
+    t0 = time.perf_counter()
+    for tr in sorted(st, key=lambda x: x.stats.starttime):
+        if logger:
+            logger.debug(f"- Processing {tr.id} {tr.stats.starttime} to {tr.stats.endtime}")
+        realtime.on_data(tr)
+    if logger and len(st):
+        logger.info(f"- Processed {min(tr.stats.starttime for tr in st)} to {max(tr.stats.endtime for tr in st)}: "
+                    f"{len(set(tr.id for tr in st))} channels, {len(realtime.freq)} bands (incremental) "
+                    f"in {time.perf_counter() - t0:.2f} s")
+
+
+def incremental_worker(st, states, freq=[None], archive="./", cache_mb=256, pyramid=None, collect_metrics=False):
+    """
+    Runs process_incremental in a worker process; returns the updated channel states, the number of day files that
+    could not be written and, with collect_metrics, the timers and counters of the task (see utils.metrics).
+    """
+
+    logger = logging.getLogger("tsdatacruncher")  # forwards to the parent process (see logs.setup_worker_logger)
+    if collect_metrics:
+        metrics.start()
+    realtime = RealtimeRSAM(freq=freq, archive=archive, flush_interval=None,
+                            cache=DayFileCache(max_bytes=cache_mb * 1024 ** 2, logger=logger), pyramid=pyramid,
+                            logger=logger)
+    realtime.set_states(states)
+    try:
+        process_incremental(st, realtime, logger=logger)
+    finally:
+        realtime.flush()
+    return realtime.get_states(), realtime.cache.failed, metrics.stop() if collect_metrics else None
+
+
+def load_starts(t1, t2, tload):
+    """
+    Yields the start of every load chunk: every tload minutes from midnight of the day of t1 up to and including
+    midnight of the day of t2 (the same as pandas.date_range(t1.date, t2.date, freq=tload), without pandas).
+    """
+
+    start = UTCDateTime(t1.date)
+    end = UTCDateTime(t2.date)
+    k = 0
+    while start + k * tload * 60 <= end:
+        yield start + k * tload * 60
+        k += 1
+
+
+def missing_ids(station_ids, t1, t2, freq=[None], archive="./", tproc=None, tstep=None):
+    """
+    Returns the station IDs that lack RSAM samples between t1 and t2 in any band, and the time range (start, end)
+    spanned by all missing samples (see ffrsam.coverage). IDs with wildcards are always considered missing.
+
+    With tproc and tstep (minutes), the range ends with the last whole processing window that starts at the first
+    missing sample and before the last one; only whole windows are processed (see main). A rest shorter than tproc
+    at t2 is left to a later run with a later t2, so repeated runs with the same t2 do nothing.
+
+    The coverage indexes are reloaded first, since worker processes (or other runs) may have updated them on disk.
+    """
+
+    indexes = [get_coverage_index(archive, ffrsam_utils.freq2str(f)) for f in freq]
+    for index in indexes:
+        index.reload()
+
+    missing = dict()
+    for id in station_ids:
+        intervals = [iv for index in indexes for iv in index.missing(id.replace("--", ""), t1, t2)]
+        if intervals:
+            missing[id] = intervals
+    if not missing:
+        return [], None, None
+    start = min(a for intervals in missing.values() for a, b in intervals)
+    end = max(b for intervals in missing.values() for a, b in intervals)
+
+    if tproc:
+        windows = [(a, b) for a, b in get_window_times(UTCDateTime(start), t2, tproc * 60, (tstep or tproc) * 60, 0,
+                                                       False) if a.timestamp < end]
+        if not windows:
+            return [], None, None
+        end = windows[-1][1].timestamp
+        missing = {id: intervals for id, intervals in missing.items() if any(a < end for a, b in intervals)}
+    return list(missing), UTCDateTime(start), UTCDateTime(end)
+
+
+# Memory per raw sample while a part of a load chunk is processed: the downloaded samples, the float64 working copy
+# (see ffrsam.preprocess), one filtered band, and merges and copies made along the way. The low-allocation path
+# (precision) needs less (see bytes_per_sample_precision)
+bytes_per_sample = 32
+bytes_per_sample_precision = {"float64": 24, "float32": 16}
+
+
+def memory_parts(station_ids, tA, tB, memory_mb, sampling_rate=100.0, tstep=10.0, pad=0.0,
+                 sample_bytes=bytes_per_sample):
+    """
+    Splits a load chunk into parts (station_ids, start, end) whose raw data fit into memory_mb, at sample_bytes per
+    sample (see bytes_per_sample).
+
+    Stations are grouped so that a group's samples over the whole chunk fit. If a single station does not fit, the
+    chunk is also split in time, into sub-chunks of whole tstep windows (at least one) that fit with pad seconds of
+    extra data (the overlap of the last processing window). Parts are returned in time order (all groups of a
+    sub-chunk before the next sub-chunk).
+    """
+
+    samples = memory_mb * 1024 ** 2 / sample_bytes  # samples that fit into the budget
+    per_station = sampling_rate * (tB - tA)
+    if per_station <= samples:
+        n, seconds = max(1, int(samples // per_station)), tB - tA
+    else:
+        n, seconds = 1, max(1, int((samples / sampling_rate - pad) // (tstep * 60))) * tstep * 60
+
+    parts = []
+    for k in range(math.ceil((tB - tA) / seconds)):
+        sA = tA + k * seconds
+        sB = min(tB, sA + seconds)
+        parts += [(station_ids[i:i + n], sA, sB) for i in range(0, len(station_ids), n)]
+    return parts
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory (MB) of this process and of its largest finished child process"""
+
+    divisor = 1024 ** 2 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, kB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor)
+
+
+def split_stream(st, n):
+    """Splits a Stream into at most n Streams of whole channels (by id), balanced by number of samples."""
+
+    ids = {}
+    for tr in st:
+        ids.setdefault(tr.id, Stream()).append(tr)
+
+    groups = [Stream() for _ in range(min(n, len(ids)))]
+    sizes = [0] * len(groups)
+    for st_id in sorted(ids.values(), key=lambda x: -sum(tr.stats.npts for tr in x)):
+        k = sizes.index(min(sizes))  # largest channels first, each to the least loaded group
+        groups[k] += st_id
+        sizes[k] += sum(tr.stats.npts for tr in st_id)
+    return groups
+
+
+# Worker process pool kept between runs of a resident process (see get_pool)
+pools = {}
+
+
+def get_pool(workers, logger, log_level):
+    """
+    Returns a pool of worker processes whose log records reach the handlers of logger (see logs.setup_worker_logger).
+
+    The pool of an earlier call is reused if it has the same number of workers, log level and handlers (e.g., in
+    every cycle of the daemon) and is not broken (a worker died); otherwise it is shut down and a new one started.
+    """
+
+    key = (workers, log_level, tuple(logger.handlers))
+    if pools.get("key") != key or pools["pool"]._broken:
+        shutdown_pool()
+        log_queue = multiprocessing.Queue()
+        pools["listener"] = start_queue_listener(logger, log_queue)
+        pools["pool"] = ProcessPoolExecutor(max_workers=workers, initializer=setup_worker_logger,
+                                            initargs=("tsdatacruncher", log_level, log_queue))
+        pools["key"] = key
+        logger.info(f"Processing with {workers} worker processes")
+    return pools["pool"]
+
+
+def shutdown_pool():
+    """Stops the worker processes of get_pool and writes the log records they sent"""
+
+    if pools:
+        pools.pop("pool").shutdown()
+        pools.pop("listener").stop()
+        pools.clear()
+
+
+def main(client, station_ids, t1, t2, freq=[None], tload=1440.0, tproc=10.0, tstep=10.0, mode="filter",
+         cache_mb=256, workers=1, fetch_workers=8, timeout=120, retries=2,
+         raw_cache=None, raw_cache_mb=None, raw_cache_days=None, state_file=None, overwrite=False, pyramid=None,
+         memory_mb=None, precision=None, verbose=True, log_file=None, log_level="INFO", log_options=None,
+         metrics_file=None, prometheus_file=None, welcome=True, keep_pool=False, config={}):
+    """
+    Main processing function. Returns the number of errors (failed downloads, processing errors, RSAM that could
+    not be computed and day files that could not be written).
+
+    With metrics_file and/or prometheus_file, stages are timed and counted (see utils.metrics), and the report of
+    the run is written to them at the end (JSON, Prometheus textfile).
+
+    With keep_pool, the worker processes (workers > 1) are kept for the next call (see get_pool); the caller stops
+    them with shutdown_pool.
+    """
+
+    logger = setup_logger("tsdatacruncher", log_level, log_file, console_output=verbose, **(log_options or {}))
+
+    # Run report - timers and counters (off unless requested; see utils.metrics)
+    collect_metrics = bool(metrics_file or prometheus_file)
+    if collect_metrics:
+        metrics.start()
+    run_start = time.time()
+
+    if welcome:
+        msg.welcome(logger=logger)
+
+    # Create an ObsPy client (reused if main is called again in the same process, e.g. in daemon mode)
+    client = tsdata.get_client(client, timeout=timeout)
+
+    # Optional local cache of raw waveforms - only intervals not fetched before are requested from the client
+    if raw_cache:
+        client = get_cached_client(client, raw_cache,
+                                   max_bytes=raw_cache_mb * 1024 ** 2 if raw_cache_mb else None,
+                                   max_age=raw_cache_days * 86400 if raw_cache_days else None,
+                                   logger=logger)
+
+    # Collect RSAM in memory and write each day file once per load chunk (or day boundary, or memory budget)
+    cache = DayFileCache(max_bytes=cache_mb * 1024 ** 2, logger=logger) if cache_mb > 0 else None
+
+    # Incremental mode: filter states and partial RSAM periods carry over between windows, load chunks and runs
+    realtime = None
+    if mode == "incremental":
+        realtime = RealtimeRSAM(freq=freq, archive=config['archive'], flush_interval=None,
+                                cache=cache if cache is not None else DayFileCache(max_bytes=0, logger=logger),
+                                pyramid=pyramid, logger=logger)
+        saved_states = load_state(state_file) if state_file else dict()
+        if state_file:
+            restored = realtime.set_states(saved_states, t1, t2)
+            logger.info(f"Incremental mode: continuing {restored} channels from {state_file}")
+
+    # Process pool - each worker processes whole channels, so every output file has exactly one writer. With
+    # keep_pool, the workers stay up for the next run (e.g., the next daemon cycle; see shutdown_pool)
+    pool = get_pool(workers, logger, log_level) if workers > 1 else None
 
-    # Create an ObsPy client
-    client = tsdata.create_client(client)
+    errors = 0
+    sampling_rate = None  # highest sampling rate seen (memory_parts assumes 100 Hz until data have been seen)
 
     # Download and process data in a single try/except block per time range
     # - time load defines the *maximum* amount of time to load, but tA and tB can be less if the amount of requested
     #   data is less than tload
-    for start_load in pd.date_range(start=t1.date.isoformat(), end=t2.date.isoformat(), freq=pd.Timedelta(minutes=tload)):
-        tA = UTCDateTime(start_load)  # Earliest *possible* time to load data (UTCDateTime)
-        tA = max(tA, t1)  # Earliest load time - Don't load anything earlier than original t1
-        tB = min(t2, tA + tload * 60)  # Latest load time - Don't load anything later than original t2
-        logger.info(f"Downloading {tA} to {tB}")
+    try:
+        for start_load in load_starts(t1, t2, tload):
+            tA = start_load  # Earliest *possible* time to load data (UTCDateTime)
+            tA = max(tA, t1)  # Earliest load time - Don't load anything earlier than original t1
+            tB = min(t2, tA + tload * 60)  # Latest load time - Don't load anything later than original t2
+            if tA >= tB:
+                continue  # e.g., t2 at midnight - nothing left to load
 
-        # Get the waveform data (includes a try/except statement)
-        st = tsdata.get_waveforms(client, station_ids, tA, tB, logger=logger)
+            # Only download stations (and the part of the chunk) without RSAM in the archive
+            ids = station_ids
+            if not overwrite and mode != "incremental":
+                ids, tA_missing, tB_missing = missing_ids(station_ids, tA, tB, freq=freq, archive=config['archive'],
+                                                          tproc=tproc, tstep=tstep)
+                if not ids:
+                    logger.info(f"Already archived: {tA} to {tB} (use --overwrite to recompute)")
+                    continue
+                tA, tB = tA_missing, tB_missing
 
+            # With a memory budget, download and process the chunk in parts (station groups and/or sub-chunks)
+            if memory_mb:
+                parts = memory_parts(ids, tA, tB, memory_mb, sampling_rate=sampling_rate or 100.0, tstep=tstep,
+                                     pad=0 if mode == "incremental" else max(0, tproc - tstep) * 60,
+                                     sample_bytes=bytes_per_sample_precision.get(precision, bytes_per_sample))
+            else:
+                parts = [(ids, tA, tB)]
+
+            try:
+                for ids_part, sA, sB in parts:
+
+                    # Sub-chunks include the overlap of the last processing window that starts in them
+                    sB_load = sB if mode == "incremental" or len(parts) == 1 \
+                        else min(tB, sB + max(0, tproc - tstep) * 60)
+                    logger.info(f"Downloading {sA} to {sB_load}"
+                                + (f" ({len(ids_part)} of {len(ids)} stations)" if len(parts) > 1 else ""))
+
+                    # Get the waveform data (includes a try/except statement)
+                    failed = []
+                    st = tsdata.get_waveforms(client, ids_part, sA, sB_load, logger=logger, max_workers=fetch_workers,
+                                              retries=retries, failed=failed)
+                    if failed:
+                        errors += len(failed)
+                        logger.info(f"-- Download failed: {', '.join(failed)}")
+                    if len(st) > 0:
+                        sampling_rate = max([sampling_rate or 0] + [tr.stats.sampling_rate for tr in st])
+
+                    try:
+
+                        if len(st) > 0 and realtime is not None:
+                            # Contiguous data are processed exactly once, without tapers (no processing windows)
+                            if pool is not None:
+                                groups = split_stream(st, workers)
+                                st = None  # workers have their own copies
+                                futures = [pool.submit(incremental_worker, st_group,
+                                                       {id: s for id, s in realtime.get_states().items()
+                                                        if id in {tr.id for tr in st_group}},
+                                                       freq=freq, archive=config['archive'], cache_mb=cache_mb,
+                                                       pyramid=pyramid, collect_metrics=collect_metrics)
+                                           for st_group in groups]
+                                for future in futures:
+                                    try:
+                                        states, failed_writes, worker_metrics = future.result()
+                                        realtime.set_states(states)
+                                        errors += failed_writes
+                                        metrics.merge(worker_metrics)
+                                    except Exception as e:
+                                        errors += 1
+                                        logger.info(f"-- Error during processing: {e}")
+                            else:
+                                process_incremental(st, realtime, logger=logger)
+                        elif len(st) > 0:
+                            # Processing windows start at the start of the load chunk (the same windows for every
+                            # worker); parts of a chunk use the windows of the chunk that start in them, so RSAM is the
+                            # same with or without a memory budget
+                            windows = [(start, stop) for start, stop in
+                                       get_window_times(tA, max([tr.stats.endtime for tr in st]),
+                                                        tproc * 60, tstep * 60, 0, False)
+                                       if sA <= start < sB]
+                            if pool is not None:
+                                futures = [pool.submit(process_worker, st_group, windows, freq=freq,
+                                                       archive=config['archive'], mode=mode, cache_mb=cache_mb,
+                                                       overwrite=overwrite, pyramid=pyramid, precision=precision,
+                                                       collect_metrics=collect_metrics)
+                                           for st_group in split_stream(st, workers)]
+                                st = None  # workers have their own copies
+                                for future in futures:
+                                    try:
+                                        failed_rsam, worker_metrics = future.result()
+                                        errors += failed_rsam
+                                        metrics.merge(worker_metrics)
+                                    except Exception as e:
+                                        errors += 1
+                                        logger.info(f"-- Error during processing: {e}")
+                            else:
+                                errors += process_stream(st, windows, freq=freq, archive=config['archive'], mode=mode,
+                                                         cache=cache, overwrite=overwrite, pyramid=pyramid,
+                                                         precision=precision, logger=logger)
+                        else:
+                            logger.info(f"- No streams to porcess.")
+
+                    except Exception as e:
+                        errors += 1
+                        logger.info(f"-- Error during processing: {e}")
+                        continue  # Continue with the next part or time range
+
+                    finally:
+                        st = None  # release the raw data before the next part is downloaded
+
+            finally:
+                if cache is not None:
+                    cache.flush()  # end of load chunk
+                if realtime is not None:
+                    realtime.flush()
+                    if state_file:
+                        save_state(dict(saved_states, **realtime.get_states()), state_file)  # keeps other channels
+    finally:
+        if pool is not None and not keep_pool:
+            shutdown_pool()  # also after an error, so no worker processes or log listener are left running
+
+    # Day files that could not be written (their RSAM is not covered, so the next run computes it again)
+    day_files = realtime.cache if realtime is not None else cache
+    if day_files is not None:
+        errors += day_files.failed
+
+    rss, rss_workers = peak_rss_mb()  # (of finished workers)
+    logger.info(f"Done. Peak memory (RSS): {rss:.0f} MB"
+                + (f", workers {rss_workers:.0f} MB" if pool is not None and not keep_pool else ""))
+
+    if collect_metrics:
+        report = metrics.summary(metrics.stop(), t1=str(t1), t2=str(t2), mode=mode, stations=len(station_ids),
+                                 workers=workers, errors=errors, seconds=time.time() - run_start,
+                                 end_timestamp=time.time(), peak_rss_mb=max(rss, rss_workers))
+        logger.info(f"Stage times: {metrics.format_stages(report)}")
         try:
+            if metrics_file:
+                metrics.write_json(report, metrics_file)
+            if prometheus_file:
+                metrics.write_prometheus(report, prometheus_file)
+        except OSError as e:
+            logger.info(f"Run report NOT written: {e}")
+    return errors
+
+
+def logger_options(config):
+    """Returns the logging options of the configuration (asynchronous logging, rotation, format; see setup_logger)"""
+
+    return dict(async_logging=config["log_async"], rotate=config["log_rotate"], backups=config["log_backups"],
+                log_format=config["log_format"])
+
+
+def run_config(config, t1, t2, welcome=True, station_ids=None):
+    """Runs main with the parsed configuration (see tsinput.load_config_and_cli) for t1 to t2 (and station_ids)."""
+
+    return main(config["client"],
+                config["id"] if station_ids is None else station_ids,
+                t1,
+                t2,
+                freq = config["freq"],
+                tload = config["tload"],
+                tproc = config["tproc"],
+                tstep = config["tstep"],
+                mode = config["mode"],
+                cache_mb = config["cache_mb"],
+                workers = config["workers"],
+                fetch_workers = config["fetch_workers"],
+                timeout = config["timeout"],
+                retries = config["retries"],
+                raw_cache = config["raw_cache"],
+                raw_cache_mb = config["raw_cache_mb"],
+                raw_cache_days = config["raw_cache_days"],
+                state_file = config["state_file"],
+                overwrite = config["overwrite"],
+                pyramid = config["pyramid"],
+                memory_mb = config["memory_mb"],
+                precision = config["precision"],
+                verbose = config["no-console-log"],
+                log_file = config["log_file"],
+                log_level=config["log_level"],
+                log_options = logger_options(config),
+                metrics_file = config["metrics_file"],
+                prometheus_file = config["prometheus_file"],
+                welcome = welcome,
+                keep_pool = config["daemon"] or bool(config["backfill"]),
+                config = config,
+                )
+
+
+def run_when_available(config, t1, t2, welcome=True):
+    """
+    Runs t1 to t2 (see run_config) for each station as soon as its data are in, instead of waiting 'latency' seconds
+    for all of them.
+
+    The datasource is probed every 'poll' seconds (see utils.availability). Stations whose data reach t2 are
+    processed right away; all others when 'latency' seconds after t2 have passed (stations that cannot be probed,
+    e.g., from a SeedLink client, always wait until then). Stations whose data were still incomplete are probed
+    for another 'late_window' and processed again as soon as their data are complete; only their missing RSAM is
+    computed (see missing_ids). Returns the number of errors.
+    """
+
+    logger = setup_logger("tsdatacruncher", config["log_level"], config["log_file"],
+                          console_output=config["no-console-log"], **logger_options(config))
+    if welcome:
+        msg.welcome(logger=logger)
+
+    client = tsdata.get_client(config["client"], timeout=config["timeout"])
+    deadline = t2 + config["latency"]
+    late_deadline = deadline + config["late_window"] * 60
+    pending = list(config["id"])
+    late = []  # processed before their data were complete
+    errors = 0
+    logger.info(f"Waiting for data up to {t2} ({len(pending)} stations, at most until {deadline})")
+    while True:
+        ends = availability.data_ends(client, pending + late, t1, t2, logger=logger)
+        complete = {id for id, end in ends.items() if end is not None and end >= t2}
+
+        ready = [id for id in pending if id in complete or UTCDateTime.now() >= deadline]
+        if ready:
+            incomplete = [id for id in ready if id not in complete]
+            logger.info(f"Data complete: {len(ready) - len(incomplete)} stations"
+                        + (f"; processing {len(incomplete)} stations with incomplete data: {', '.join(incomplete)}"
+                           if incomplete else ""))
+            errors += run_config(config, t1, t2, welcome=False, station_ids=ready)
+            pending = [id for id in pending if id not in ready]
+            late += [id for id in incomplete if id in ends]  # (only stations that can be probed again)
+
+        arrived = [id for id in late if id in complete]
+        if arrived:
+            logger.info(f"Late data complete: {', '.join(arrived)}")
+            errors += run_config(config, t1, t2, welcome=False, station_ids=arrived)
+            late = [id for id in late if id not in arrived]
+
+        if not pending and (not late or UTCDateTime.now() >= late_deadline):
+            break
+        logger.debug(f"Waiting for data: {len(pending)} stations pending, {len(late)} late")
+        time.sleep(max(0.0, min(config["poll"], (deadline if pending else late_deadline) - UTCDateTime.now())))
+
+    if late:
+        logger.info(f"Data still incomplete after the late window: {', '.join(late)}")
+    return errors
+
 
-            if len(st) > 0:
-                for st_proc in st.slide(window_length=tproc * 60, step=tstep * 60):
-                    tproc1 = min([tmp.stats.starttime for tmp in st_proc])
-                    tproc2 = max([tmp.stats.endtime for tmp in st_proc])
-                    logger.info(f"- Processing {tproc1} to {tproc2}")
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
 
-                    # APPLY PROCESSING - YOUR CODE HERE!
-                    ffrsam_utils.archive_ffrsam(st_proc, freq=freq, archive=config['archive'], logger=logger)
+
+def daemon(config):
+    """
+    Stays resident and processes the latest data on every wall-clock tstep boundary, station by station as their
+    data arrive (for at most latency seconds, see run_when_available).
+
+    Clients, caches and worker processes stay warm between cycles. The configuration (and station ID file) is
+    reloaded when it changes on disk, and changed log settings are applied (see logs.setup_logger). After a stall
+    (e.g., a slow cycle or a suspended host), every missed processing window is caught up, going back at most
+    'catchup'. A cycle that fails (e.g., the datasource cannot be reached) is logged with its traceback and caught
+    up with the next one.
+    """
+
+    logger = setup_logger("tsdatacruncher", config["log_level"], config["log_file"],
+                          console_output=config["no-console-log"], **logger_options(config))
+    msg.welcome(logger=logger)
+
+    # Exit cleanly (write caches, stop workers) on SIGTERM, e.g. from systemd
+    signal.signal(signal.SIGTERM, _terminate)
+
+    mtimes = tsinput.config_mtimes(config)
+    tstep = config["tstep"] * 60
+    next_t2 = UTCDateTime(UTCDateTime.now().timestamp // tstep * tstep)
+    processed_until = next_t2 - tstep  # end of the last processed window (the first cycle starts from here)
+    logger.info(f"Daemon mode: processing every {config['tstep']} minutes (waiting at most {config['latency']} s "
+                f"for data)")
+
+    try:
+        while True:
+
+            # Wait until the next boundary (run_when_available then waits for the data)
+            time.sleep(max(0.0, next_t2 - UTCDateTime.now()))
+
+            # Reload configuration if it changed on disk
+            if tsinput.config_mtimes(config) != mtimes:
+                try:
+                    config = tsinput.reload_config(config)
+                    mtimes = tsinput.config_mtimes(config)
+                    tstep = config["tstep"] * 60
+                    logger = setup_logger("tsdatacruncher", config["log_level"], config["log_file"],
+                                          console_output=config["no-console-log"], **logger_options(config))
+                    logger.info(f"Configuration reloaded: {config['config_file']}")
+                except (Exception, SystemExit) as e:
+                    mtimes = tsinput.config_mtimes(config)
+                    logger.info(f"Configuration NOT reloaded (keeping previous configuration): {e}")
+
+            # Process the window ending at the boundary, plus any windows missed since the last cycle
+            t2 = next_t2
+            t1 = t2 - config["tproc"] * 60
+            if processed_until + tstep < t2:
+                t1 = max(processed_until + tstep - config["tproc"] * 60, t2 - config["catchup"] * 60)
+                logger.info(f"Catching up from {t1}")
+            try:
+                run_when_available(config, t1, t2, welcome=False)
+                processed_until = t2
+            except Exception:
+                # e.g., a datasource that is down - the daemon stays up, and this window is caught up next cycle
+                logger.exception(f"Cycle {t1} to {t2} failed")
+
+            # Next boundary - skip ahead (and catch up next cycle) if this cycle took longer than tstep
+            latest_t2 = UTCDateTime(UTCDateTime.now().timestamp // tstep * tstep)
+            next_t2 = max(t2 + tstep, latest_t2)
+
+    except KeyboardInterrupt:
+        logger.info("Daemon stopped.")
+    finally:
+        shutdown_pool()
+
+
+def backfill(config):
+    """
+    Processes t1 to t2 as a resumable backfill (see utils.backfill.BackfillManifest).
+
+    Work units (one per station and day) are recorded in a manifest in the 'backfill' directory. Any number of
+    processes, on any number of hosts with access to that directory, can run the same backfill; each claims units
+    (up to 'backfill_batch' stations of the same day at a time) and records them as done when they were processed
+    without errors. Completed units are skipped, so an interrupted backfill continues where it stopped.
+
+    When the client is a local SDS archive, station-days without raw data are left out of a new manifest (see
+    print_stream_info.inventory.SDSInventory; its index is kept in the 'backfill' directory).
+    """
+
+    logger = setup_logger("tsdatacruncher", config["log_level"], config["log_file"],
+                          console_output=config["no-console-log"], **logger_options(config))
+    msg.welcome(logger=logger)
+
+    if config["mode"] == "incremental":
+        raise ValueError("Incremental mode cannot be used for backfills: units are processed independently")
+
+    manifest = BackfillManifest(config["backfill"], logger=logger)
+    available = None
+    raw_sds = tsdata.sds_root(config["client"])
+    if raw_sds and not manifest.exists():
+        os.makedirs(config["backfill"], exist_ok=True)
+        inventory = get_inventory(raw_sds, index_file=os.path.join(config["backfill"], "inventory.json"),
+                                  logger=logger)
+        inventory.update()
+        available = inventory.has_data
+    if manifest.create(config["id"], config["t1"], config["t2"],
+                       parameters=dict(freq=config["freq"], mode=config["mode"]), available=available):
+        logger.info(f"Backfill manifest created: {config['backfill']} ({len(manifest.units)} units)")
+    else:
+        logger.info(f"Resuming backfill: {config['backfill']} ({manifest.n_done()}/{len(manifest.units)} units done)")
+
+    signal.signal(signal.SIGTERM, _terminate)
+    done_at_start = manifest.n_done()
+    tstart = time.monotonic()
+    tried = set()  # units this process gave up on (errors) - retried on the next run
+    try:
+        while True:
+            units = manifest.claim(config["backfill_batch"], skip=tried)
+            if not units:
+                break
+            tunit = time.monotonic()
+            try:
+                errors = run_config(config, UTCDateTime(units[0]["t1"]), UTCDateTime(units[0]["t2"]), welcome=False,
+                                    station_ids=[unit["id"] for unit in units])
+            except BaseException:
+                manifest.release(units)
+                raise
+            if errors:
+                manifest.release(units)
+                tried.update(unit["key"] for unit in units)
+                logger.info(f"Backfill: {len(units)} units released after {errors} errors")
             else:
-                logger.info(f"- No streams to porcess.")
+                manifest.complete(units, elapsed=time.monotonic() - tunit)
+
+            # Progress of all workers
+            n_done = manifest.n_done()
+            rate = (n_done - done_at_start) / (time.monotonic() - tstart)  # units per second
+            remaining = len(manifest.units) - n_done
+            eta = f"{remaining / rate / 3600:.1f} h" if rate > 0 else "unknown"
+            logger.info(f"Backfill: {n_done}/{len(manifest.units)} units done, {rate * 3600:.1f} units/h, ETA {eta}")
+    except KeyboardInterrupt:
+        logger.info("Backfill stopped.")
+        return
+    finally:
+        shutdown_pool()
+
+    logger.info(f"Backfill finished: {manifest.n_done()}/{len(manifest.units)} units done"
+                + (f", {len(tried)} units failed (run again to retry)" if tried else ""))
+
+
+def stream(config):
+    """
+    Streams data from a SeedLink server and computes RSAM incrementally as packets arrive (see ffrsam.realtime).
+
+    Each RSAM sample is computed as soon as its period is complete; the archive is updated every tstep.
+    """
+
+    logger = setup_logger("tsdatacruncher", config["log_level"], config["log_file"],
+                          console_output=config["no-console-log"], **logger_options(config))
+    msg.welcome(logger=logger)
 
-        except Exception as e:
-            logger.info(f"-- Error during processing: {e}")
-            continue  # Continue with the next time range
+    protocol, server = config["client"].split("://", 1) if "://" in config["client"] else ("", config["client"])
+    if protocol != "seedlink":
+        raise ValueError(f"Streaming requires a SeedLink client (seedlink://host:port): {config['client']}")
+    if ":" not in server:
+        server = f"{server}:18000"
 
-    logger.info("Done.")
+    realtime = RealtimeRSAM(freq=config["freq"], archive=config["archive"], flush_interval=config["tstep"] * 60,
+                            pyramid=config["pyramid"], logger=logger)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        realtime.run_seedlink(server, config["id"])
+    except KeyboardInterrupt:
+        logger.info("Streaming stopped.")
 
 
 if __name__ == "__main__":
@@ -72,17 +748,13 @@ if __name__ == "__main__":
     # Parses config file and command line arguments
     config = tsinput.load_config_and_cli()
 
-    # Run main function
-    main(config["client"],
-         config["id"],
-         config["t1"],
-         config["t2"],
-         freq = config["freq"],
-         tload = config["tload"],
-         tproc = config["tproc"],
-         tstep = config["tstep"],
-         verbose = config["no-console-log"],
-         log_file = config["log_file"],
-         log_level=config["log_level"],
-         config = config,
-    )
\ No newline at end of file
+    if config["stream"]:
+        stream(config)
+    elif config["backfill"]:
+        backfill(config)
+    elif config["daemon"]:
+        daemon(config)
+    elif config["latency"] > 0 or config["late_window"] > 0:
+        run_when_available(config, config["t1"], config["t2"])
+    else:
+        run_config(config, config["t1"], config["t2"])
@@ -0,0 +1,59 @@
+"""
+Compacts the day files of an RSAM archive (SDS_ffrsam), or reports how fragmented they are (--dry-run).
+
+$ python ./scripts/compact_ffrsam.py ./results/SDS_ffrsam --dry-run
+$ python ./scripts/compact_ffrsam.py ./results/SDS_ffrsam --workers 8
+"""
+
+import argparse
+import os
+
+from tsdatacruncher.packages.ffrsam.compact import compact_archive
+from tsdatacruncher.utils.logs import setup_logger
+
+
+def print_report(archive, reports):
+    """Prints totals per tree (band or aggregate level directory)"""
+
+    trees = dict()
+    for filename, report in reports.items():
+        tree = os.path.relpath(filename, archive).split(os.sep)[:-5]
+        totals = trees.setdefault(os.sep.join(tree) or ".", dict(files=0, fragmented=0, compacted=0, failed=0,
+                                                                   size=0, compact_size=0, records=0,
+                                                                   compact_records=0))
+        totals["files"] += 1
+        if "size" not in report:
+            totals["failed"] += 1
+            continue
+        totals["fragmented"] += report["needs_compaction"]
+        totals["compacted"] += report["status"] == "compacted"
+        totals["failed"] += report["status"].startswith(("skipped", "failed"))
+        for key in ("size", "compact_size", "records", "compact_records"):
+            totals[key] += report[key]
+
+    print(f"{'tree':<22} {'files':>7} {'fragmented':>10} {'compacted':>9} {'skipped':>7} {'records':>9} "
+          f"{'compact':>9} {'MB':>9} {'compact MB':>10}")
+    for tree, t in sorted(trees.items()):
+        print(f"{tree:<22} {t['files']:>7} {t['fragmented']:>10} {t['compacted']:>9} {t['failed']:>7} "
+              f"{t['records']:>9} {t['compact_records']:>9} {t['size'] / 1024 ** 2:>9.1f} "
+              f"{t['compact_size'] / 1024 ** 2:>10.1f}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compact the day files of an RSAM archive (SDS_ffrsam)")
+    parser.add_argument("archive", type=str, help="RSAM archive (all bands and aggregate levels are compacted)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report sizes and fragmentation")
+    parser.add_argument("--workers", type=int, help="Parallel processes (default: all CPUs)")
+    parser.add_argument("--encoding", type=str, default="FLOAT64", help="MiniSEED encoding (default: FLOAT64)")
+    parser.add_argument("--reclen", type=int, default=4096, help="Record length in bytes (default: 4096)")
+    args = parser.parse_args()
+
+    logger = setup_logger("compact_ffrsam")
+    reports = compact_archive(args.archive, encoding=args.encoding, reclen=args.reclen, dry_run=args.dry_run,
+                              max_workers=args.workers, logger=logger)
+    print_report(args.archive, reports)
+
+
+if __name__ == "__main__":
+    main()
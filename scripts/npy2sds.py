@@ -0,0 +1,32 @@
+"""
+Exports a fixed-grid RSAM archive (npy://) to the SDS MiniSEED layout.
+
+$ python ./scripts/npy2sds.py npy:///data/rsam_npy ./results/SDS_ffrsam --t1 2025-01-01 --t2 2025-02-01
+"""
+
+import argparse
+
+from tsdatacruncher.packages.ffrsam.npystore import export_sds
+from tsdatacruncher.utils.input import parse_pyramid
+from tsdatacruncher.utils.logs import setup_logger
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Export a fixed-grid RSAM archive (npy://) to SDS MiniSEED")
+    parser.add_argument("archive", type=str, help="Fixed-grid archive (npy:///path)")
+    parser.add_argument("sds", type=str, help="SDS archive to write to (merged into existing day files)")
+    parser.add_argument("--t1", type=str, help="Start time (default: all data)")
+    parser.add_argument("--t2", type=str, help="End time (default: all data)")
+    parser.add_argument("--freq", type=str, help="Only export one band (e.g., 0100-0500)")
+    parser.add_argument("--pyramid", type=str, default="10min,1h,1D",
+                        help='Aggregate levels to update in the SDS archive (e.g., "10min,1h,1D"; None for no levels)')
+    args = parser.parse_args()
+
+    logger = setup_logger("npy2sds")
+    export_sds(args.archive, args.sds, t1=args.t1, t2=args.t2, freq_str=args.freq,
+               pyramid=parse_pyramid(args.pyramid), logger=logger)
+
+
+if __name__ == "__main__":
+    main()
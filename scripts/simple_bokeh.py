@@ -1,6 +1,6 @@
 import sys, os, time
 from obspy.core import UTCDateTime
-from tsdatacruncher.packages.ffrsam import ffrsam as ffrsam_utils
+from tsdatacruncher.packages.ffrsam import query as ffrsam_query
 
 ffrsam_sds = "/VDAP-NAS/jwellik/DATA/AVO/SDS_ffrsam"
 output_filepath = "./avo_rsam.html"
@@ -21,7 +21,7 @@ networks = [
     },
 ]
 
-rsam_period = 10  # (minutes) interpolate 1' RSAM archive to this sample rate
+rsam_period = 10  # (minutes) read the 10' RSAM level of the archive (1' RSAM if the archive has no such level)
 
 
 def main():
@@ -44,12 +44,9 @@ def main():
     # Loop through each page in html_configuration
     for net in networks:
 
-        data = ffrsam_utils.get_ffrsam(ffrsam_sds, net["id"], ltt1, t2, freq=[None, [1, 5]])
-
-        stLT = data["0100-0500"]
-        stLT = stLT.merge(fill_value=0.0).interpolate((1 / (60 * rsam_period)))  # what does interpolate do? sum, average, st-else?
-        st = stLT.copy()
-        st = st.slice(t1, t2)
+        # 1-5 Hz RSAM of every station on one time grid (NaN in gaps)
+        times, data, columns = ffrsam_query.get_ffrsam_array(ffrsam_sds, net["id"], ltt1, t2, freq=[[1, 5]],
+                                                              resolution=60 * rsam_period)
 
 
         TITLE = "{} ({} minute RSAM)".format(net["name"], rsam_period)
@@ -74,26 +71,12 @@ def main():
         )
 
         # Plot data to main panel
-        i = 0
-        for tr in stLT:
+        for i, (id, freq_str) in enumerate(columns):
             clr = Colorblind8[i]
-
-            # times = [t.datetime for t in tr.times("utcdatetime").data[~tr.times("utcdatetime").mask]]
-            # data  = tr.data.data[~tr.data.mask] * rsam_period
-            times = [t.datetime for t in tr.times("utcdatetime")]
-            data = tr.data * rsam_period
-            # select.scatter(times, data, color=clr, line_color="black", alpha=0.9, size=10)
-            # select.circle(times, data, color=clr, line_color="black", alpha=0.9, size=10)
-            select.line(times, data, color=clr, line_width=2)
-
-            tmp = tr.slice(ltt1, t2)
-            # times = [t.datetime for t in tmp.times("utcdatetime").data[~tmp.times("utcdatetime").mask]]
-            # data  = tmp.data.data[~tmp.data.mask] * rsam_period
-            times = [t.datetime for t in tr.times("utcdatetime")]
-            data = tr.data * rsam_period
-            # p.scatter(times, data, color=clr, line_color="black", alpha=0.9, size=10, legend_label=tr.id)
-            p.line(times, data, color=clr, line_width=2, legend_label=tr.id)
-            i += 1
+            # select.scatter(times, data[:, i] * rsam_period, color=clr, line_color="black", alpha=0.9, size=10)
+            select.line(times, data[:, i] * rsam_period, color=clr, line_width=2)
+            # p.scatter(times, data[:, i] * rsam_period, color=clr, line_color="black", alpha=0.9, size=10, legend_label=id)
+            p.line(times, data[:, i] * rsam_period, color=clr, line_width=2, legend_label=id)
 
         # ax[0].set_title("{} (1-5 Hz)".format(net["name"]))
         # ax[0].set_xlim(t1.matplotlib_date, t2.matplotlib_date)
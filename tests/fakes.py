@@ -0,0 +1,154 @@
+"""
+Local stand-ins for remote datasources, served on 127.0.0.1 from background threads:
+- FakeWaveServer: an Earthworm/Winston wave server (GETSCNLRAW and MENU requests, TRACEBUF2 packets)
+- FakeFDSNServer: an FDSN dataselect web service (GET and bulk POST queries, MiniSEED answers)
+"""
+
+import io
+import socketserver
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from obspy import Stream, UTCDateTime
+
+
+class FakeWaveServer:
+    """
+    Serves Traces (int32 data, gaps in the data allowed) as an Earthworm wave server would.
+
+    Each answer holds the TRACEBUF2 packets (packet_size samples each) that overlap the requested time range.
+    Every request is recorded in requests as (time.monotonic(), "net.sta.loc.cha", start, end). A request for
+    which drop(start, end) is True is answered by closing the connection, like a dropped connection.
+    """
+
+    def __init__(self, traces=(), packet_size=100, drop=None):
+        self.packet_size = packet_size
+        self.drop = drop
+        self.requests = []
+        self._tanks = dict()  # (sta, cha, net, loc) -> [(start, end, rate, data)]
+        for tr in traces:
+            self.add(tr)
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._handle(self.rfile.readline().decode().split(), self.wfile)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def add(self, tr):
+        """Adds the packets of a Trace"""
+
+        s = tr.stats
+        key = (s.station, s.channel, s.network, s.location or "--")
+        data = np.asarray(tr.data, dtype="<i4")
+        for i in range(0, s.npts, self.packet_size):
+            chunk = data[i:i + self.packet_size]
+            start = (s.starttime + i * s.delta).timestamp
+            self._tanks.setdefault(key, []).append((start, start + (len(chunk) - 1) * s.delta, s.sampling_rate,
+                                                    chunk))
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, tokens, wfile):
+        if not tokens:
+            return
+        if tokens[0] == "MENU:":
+            entries = [f"{i} {sta} {cha} {net} {loc} {min(p[0] for p in packets):.6f} "
+                       f"{max(p[1] for p in packets):.6f} i4"
+                       for i, ((sta, cha, net, loc), packets) in enumerate(sorted(self._tanks.items()))]
+            wfile.write((f"{tokens[1]} " + " ".join(entries) + "\n").encode())
+            return
+
+        # GETSCNLRAW: <request id> <sta> <cha> <net> <loc> <start> <end>
+        rid, sta, cha, net, loc = tokens[1:6]
+        start, end = float(tokens[6]), float(tokens[7])
+        self.requests.append((time.monotonic(), f"{net}.{sta}.{loc.replace('--', '')}.{cha}", start, end))
+        if self.drop and self.drop(start, end):
+            return  # close the connection without an answer
+
+        packets = [p for p in self._tanks.get((sta, cha, net, loc), []) if p[1] >= start and p[0] <= end]
+        if not packets:
+            wfile.write(f"{rid} 0 {sta} {cha} {net} {loc} FG i4\n".encode())
+            return
+        body = b"".join(struct.pack("<2i3d7s9s4s3s2s3s2s2s", 0, len(data), a, b, rate, sta.encode(), net.encode(),
+                                    cha.encode(), loc.encode(), b"20", b"i4", b"\0\0", b"\0\0") + data.tobytes()
+                        for a, b, rate, data in packets)
+        wfile.write(f"{rid} 0 {sta} {cha} {net} {loc} F i4 {packets[0][0]:.6f} {packets[-1][1]:.6f} "
+                    f"{len(body)}\n".encode() + body)
+
+
+class FakeFDSNServer:
+    """
+    Serves Traces from an FDSN dataselect service at base_url (/fdsnws/dataselect/1/query).
+
+    Requests without data are answered with no_data_code (204, or 404 as with nodata=404). The first 'failures'
+    requests are answered with error_code (e.g., 500) instead. Every request is recorded in requests as (method,
+    [(net, sta, loc, cha), ...]).
+    """
+
+    def __init__(self, traces=(), no_data_code=204, failures=0, error_code=500):
+        self.stream = Stream(list(traces))
+        self.no_data_code = no_data_code
+        self.failures = failures
+        self.error_code = error_code
+        self.requests = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                get = lambda key: query.get(key, [""])[0]
+                server._answer(self, "GET", [(get("network"), get("station"), get("location"), get("channel"),
+                                              get("starttime"), get("endtime"))])
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                lines = [line.split() for line in body.splitlines() if line.strip() and "=" not in line]
+                server._answer(self, "POST", lines)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _answer(self, handler, method, lines):
+        with self._lock:
+            self.requests.append((method, [tuple(line[:4]) for line in lines]))
+            fail = self.failures > 0
+            self.failures -= fail
+
+        st = Stream()
+        if not fail:
+            for net, sta, loc, cha, start, end in lines:
+                st += self.stream.select(network=net, station=sta, location=loc.replace("--", ""),
+                                         channel=cha).slice(UTCDateTime(start), UTCDateTime(end))
+        code = self.error_code if fail else 200 if len(st) else self.no_data_code
+        body = b""
+        if code == 200:
+            buf = io.BytesIO()
+            st.write(buf, format="MSEED")
+            body = buf.getvalue()
+        handler.send_response(code)
+        handler.send_header("Content-Type", "application/vnd.fdsn.mseed" if code == 200 else "text/plain")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
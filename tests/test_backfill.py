@@ -0,0 +1,51 @@
+"""
+Backfill manifest (utils.backfill): claims, completion records shared by several workers, and progress counts.
+"""
+
+import os
+
+from obspy import UTCDateTime
+
+from tsdatacruncher.utils.backfill import BackfillManifest
+
+t1 = UTCDateTime("2025-01-01T00:00:00")
+ids = ["XX.AAA..HHZ", "XX.BBB..HHZ", "XX.CCC..HHZ"]
+
+
+def test_workers_share_units(tmp_path):
+    first, second = BackfillManifest(tmp_path), BackfillManifest(tmp_path)
+    assert first.create(ids, t1, t1 + 3 * 86400)
+    assert not second.create(ids, t1, t1 + 3 * 86400)
+    assert len(first.units) == 9 and first.n_done() == 0
+
+    a = first.claim(2)
+    b = second.claim(2)
+    assert [u["key"] for u in a] == ["XX.AAA..HHZ.2025.001", "XX.BBB..HHZ.2025.001"]
+    assert [u["key"] for u in b] == ["XX.CCC..HHZ.2025.001"]  # only units of the same day
+
+    first.complete(a)
+    second.release(b)
+    assert first.n_done() == 2
+    assert [u["key"] for u in second.claim(2)] == ["XX.CCC..HHZ.2025.001"]  # sees the other worker's records
+    assert second.n_done() == 2
+
+
+def test_claims_skip_done_units_and_resume(tmp_path):
+    manifest = BackfillManifest(tmp_path)
+    manifest.create(ids, t1, t1 + 2 * 86400)
+    done = []
+    while True:
+        units = manifest.claim(3, skip={"XX.BBB..HHZ.2025.002"})
+        if not units:
+            break
+        manifest.complete(units)
+        done += [u["key"] for u in units]
+    assert len(done) == 5 and "XX.BBB..HHZ.2025.002" not in done
+    assert manifest.n_done() == 5
+    assert not any(".tmp" in f for f in os.listdir(tmp_path / "done"))
+
+    restarted = BackfillManifest(tmp_path)
+    restarted.create(ids, t1, t1 + 2 * 86400)
+    assert restarted.n_done() == 5
+    assert [u["key"] for u in restarted.claim(3)] == ["XX.BBB..HHZ.2025.002"]
+    assert not restarted.claim(3)  # (claimed)
@@ -0,0 +1,40 @@
+"""
+RSAM day file write cache (ffrsam.cache.DayFileCache): failures to write day files and coverage indexes are counted
+instead of stopping the run.
+"""
+
+import numpy as np
+from obspy import Trace, UTCDateTime, read
+
+from tsdatacruncher.packages.ffrsam.cache import DayFileCache
+from tsdatacruncher.packages.ffrsam.coverage import CoverageIndex
+
+
+def rsam_trace(minutes=10):
+    return Trace(data=np.arange(minutes, dtype="float64"),
+                 header=dict(network="XX", station="TEST", channel="HHZ", delta=60.0,
+                             starttime=UTCDateTime("2025-01-01T00:00:00")))
+
+
+def test_flush_writes_day_file_and_coverage(tmp_path):
+    index = CoverageIndex(str(tmp_path / "tree"))
+    filename = str(tmp_path / "tree" / "XX.TEST..HHZ.D.2025.001")
+    cache = DayFileCache()
+    cache.add(filename, rsam_trace(), coverage=index)
+
+    assert cache.flush() == 0
+    assert len(read(filename)[0]) == 10
+    assert CoverageIndex(index.tree).covers("XX.TEST..HHZ", UTCDateTime("2025-01-01"),
+                                             UTCDateTime("2025-01-01T00:10:00"))
+
+
+def test_coverage_index_failure_is_counted(tmp_path):
+    index = CoverageIndex(str(tmp_path / "tree"))
+    (tmp_path / "tree" / "coverage.json").mkdir(parents=True)  # cannot be replaced by a file
+    filename = str(tmp_path / "tree" / "XX.TEST..HHZ.D.2025.001")
+    cache = DayFileCache()
+    cache.add(filename, rsam_trace(), coverage=index)
+
+    assert cache.flush() == 1
+    assert cache.failed == 1
+    assert len(read(filename)[0]) == 10  # the day file is written
@@ -0,0 +1,71 @@
+"""
+Daemon mode (run_tsdatacruncher.daemon): cycles on tstep boundaries, and failed cycles do not stop the daemon.
+"""
+
+import pytest
+from obspy import UTCDateTime
+
+import run_tsdatacruncher as rt
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {"log_level": "INFO", "log_file": None, "no-console-log": False, "log_async": False, "log_rotate": None,
+            "log_backups": 7, "log_format": "text", "config_file": None, "id_file": None,
+            "tstep": 10, "tproc": 10, "latency": 0, "catchup": 1440}
+
+
+def test_failed_cycle_does_not_stop_daemon(config, monkeypatch):
+    cycles = []
+
+    def run_when_available(config, t1, t2, welcome=True):
+        cycles.append((t1, t2))
+        if len(cycles) == 1:
+            raise ConnectionError("datasource down")
+        if len(cycles) == 3:
+            raise KeyboardInterrupt  # stop the daemon
+        return 0
+
+    now = [UTCDateTime("2025-01-01T00:05:00")]
+
+    def sleep(seconds):
+        now[0] += max(seconds, 1.0)
+
+    monkeypatch.setattr(rt, "run_when_available", run_when_available)
+    monkeypatch.setattr(rt.time, "sleep", sleep)
+    monkeypatch.setattr(rt.UTCDateTime, "now", staticmethod(lambda: now[0]))
+
+    rt.daemon(config)
+
+    t = UTCDateTime("2025-01-01T00:00:00")
+    assert cycles[0] == (t - 600, t)
+    assert cycles[1] == (t - 600, t + 600)  # the failed window is caught up
+    assert cycles[2] == (t + 600, t + 1200)
+
+
+def test_changed_log_settings_rebuild_logger(tmp_path):
+    from tsdatacruncher.utils.logs import setup_logger
+
+    first = tmp_path / "first.log"
+    logger = setup_logger("test_daemon_logs", "INFO", str(first), console_output=False)
+    assert setup_logger("test_daemon_logs", "INFO", str(first), console_output=False) is logger
+    handlers = list(logger.handlers)
+
+    second = tmp_path / "second.log"
+    logger = setup_logger("test_daemon_logs", "DEBUG", str(second), console_output=False)
+    logger.debug("after reload")
+    assert logger.handlers != handlers and len(logger.handlers) == 1
+    assert "after reload" in second.read_text() and "after reload" not in first.read_text()
+
+
+def test_worker_pool_is_kept_between_runs():
+    import logging
+
+    logger = logging.getLogger("test_daemon_pool")
+    try:
+        pool = rt.get_pool(2, logger, "INFO")
+        assert rt.get_pool(2, logger, "INFO") is pool
+        assert rt.get_pool(2, logger, "DEBUG") is not pool  # (restarted with the new level)
+    finally:
+        rt.shutdown_pool()
+    assert rt.pools == {}
@@ -0,0 +1,63 @@
+"""
+Batch runs (run_tsdatacruncher.main) on a local SDS archive with worker processes: coverage written by the workers
+is seen by the next run, and the workers are stopped when a run fails.
+"""
+
+import numpy as np
+import pytest
+from obspy import Trace, UTCDateTime
+
+import run_tsdatacruncher as rt
+from tsdatacruncher.packages.ffrsam import coverage
+from tsdatacruncher.utils import tsdata
+
+t1 = UTCDateTime("2025-01-01T00:00:00")
+t2 = t1 + 3600
+ids = ["XX.AAA..HHZ", "XX.BBB..HHZ"]
+
+
+@pytest.fixture
+def sds(tmp_path):
+    rng = np.random.default_rng(0)
+    for id in ids:
+        net, sta, loc, cha = id.split(".")
+        tr = Trace(data=rng.integers(-1000, 1000, size=36000).astype("int32"),
+                   header=dict(network=net, station=sta, location=loc, channel=cha, sampling_rate=10.0,
+                               starttime=t1))
+        path = tmp_path / "raw" / "2025" / net / sta / f"{cha}.D"
+        path.mkdir(parents=True)
+        tr.write(str(path / f"{id}.D.2025.001"), format="MSEED")
+    coverage.coverage_indexes.clear()
+    yield str(tmp_path / "raw"), str(tmp_path / "rsam")
+    coverage.coverage_indexes.clear()
+
+
+def run(raw, archive, **kwargs):
+    return rt.main(raw, ids, t1, t2, freq=[None, [1.0, 4.0]], tproc=10, tstep=10, workers=2, verbose=False,
+                   welcome=False, config={"archive": archive}, **kwargs)
+
+
+def test_coverage_written_by_workers_is_reloaded(sds, monkeypatch):
+    raw, archive = sds
+    downloads = []
+    get_waveforms = tsdata.get_waveforms
+    monkeypatch.setattr(tsdata, "get_waveforms", lambda client, ids, *args, **kwargs:
+                        downloads.append(list(ids)) or get_waveforms(client, ids, *args, **kwargs))
+
+    assert run(raw, archive) == 0
+    assert len(downloads) == 1
+
+    assert run(raw, archive) == 0  # the parent's coverage indexes (read before the workers wrote) are reloaded
+    assert len(downloads) == 1
+
+
+def test_workers_are_stopped_after_an_error(sds, monkeypatch):
+    raw, archive = sds
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("datasource down")
+
+    monkeypatch.setattr(tsdata, "get_waveforms", fail)
+    with pytest.raises(RuntimeError):
+        run(raw, archive)
+    assert rt.pools == {}
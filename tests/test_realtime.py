@@ -0,0 +1,174 @@
+"""
+Incremental RSAM (ffrsam.realtime) does not depend on how the data are split into packets: packets of any length,
+overlapping packets, gaps, and states saved and restored between runs give the same RSAM as one contiguous packet.
+"""
+
+import json
+
+import numpy as np
+import pytest
+from obspy import Stream, Trace, UTCDateTime, read
+
+from tsdatacruncher.packages.ffrsam.ffrsam import rsam as batch_rsam
+from tsdatacruncher.packages.ffrsam.realtime import IncrementalRSAM, RealtimeRSAM
+
+freq = [None, [1.0, 5.0], [0.5, 2.0]]
+sampling_rate = 50.0
+t0 = UTCDateTime("2025-01-01T23:40:00")  # crosses midnight
+
+
+def make_trace(minutes=30.5, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * sampling_rate)
+    data = (1000 * rng.normal(size=n) + 300 * np.sin(np.arange(n) / 3.0) + 5000).astype("int32")
+    return Trace(data=data, header=dict(network="XX", station="TEST", channel="HHZ", sampling_rate=sampling_rate,
+                                        starttime=t0))
+
+
+def piece(tr, a, b):
+    """Samples a to b of tr as a new Trace"""
+
+    return Trace(data=tr.data[a:b].copy(), header=dict(tr.stats, starttime=tr.stats.starttime + a * tr.stats.delta,
+                                                       npts=b - a))
+
+
+def packets(tr, lengths, overlap=0):
+    """Splits tr into packets of the given (cycled) lengths; each packet repeats the last overlap samples"""
+
+    out = []
+    a, k = 0, 0
+    while a < tr.stats.npts:
+        b = min(tr.stats.npts, a + lengths[k % len(lengths)])
+        out.append(piece(tr, max(0, a - overlap), b))
+        a, k = b, k + 1
+    return out
+
+
+def rsam(pieces, state=None):
+    """Feeds pieces to an IncrementalRSAM; returns {band index: {RSAM sample time (ns): value}} and the channel"""
+
+    channel = state or IncrementalRSAM("XX", "TEST", "", "HHZ", sampling_rate, freq=freq)
+    result = {i: dict() for i in range(len(freq))}
+    for tr in pieces:
+        for f, rsam_tr in channel.process(tr):
+            for j, value in enumerate(rsam_tr.data):
+                result[freq.index(f)][(rsam_tr.stats.starttime + j * rsam_tr.stats.delta).ns] = value
+    return result, channel
+
+
+def assert_same(result, expected):
+    for i in expected:
+        assert sorted(result[i]) == sorted(expected[i])
+        np.testing.assert_allclose([result[i][t] for t in sorted(result[i])],
+                                   [expected[i][t] for t in sorted(expected[i])], rtol=1e-9)
+
+
+@pytest.mark.parametrize("lengths, minutes", [([512], 30.5), ([1], 3.5), ([37, 1000, 3001], 30.5),
+                                             ([60 * 50 * 7 + 13], 30.5)])
+def test_packets_equal_one_contiguous_packet(lengths, minutes):
+    tr = make_trace(minutes)
+    expected, _ = rsam([tr])
+    assert len(expected[0]) == int(minutes)  # the last half minute is incomplete
+
+    result, _ = rsam(packets(tr, lengths))
+    assert_same(result, expected)
+
+
+def test_overlapping_packets_are_skipped():
+    tr = make_trace()
+    expected, _ = rsam([tr])
+    result, _ = rsam(packets(tr, [400, 1250], overlap=150))
+    assert_same(result, expected)
+
+
+def test_gap_restarts_filters():
+    tr = make_trace()
+    gap = (int(10.5 * 60 * sampling_rate), int(12.2 * 60 * sampling_rate))
+    before, after = piece(tr, 0, gap[0]), piece(tr, gap[1], tr.stats.npts)
+
+    expected, _ = rsam([before])
+    expected_after, _ = rsam([after])
+    for i in expected:
+        expected[i].update(expected_after[i])
+
+    result, _ = rsam(packets(before, [333]) + packets(after, [777]))
+    assert_same(result, expected)
+    # The windows around the gap are incomplete
+    assert (t0 + 10 * 60).ns not in result[0] and (t0 + 12 * 60).ns not in result[0]
+
+
+def test_state_survives_get_and_set_state():
+    tr = make_trace()
+    expected, _ = rsam([tr])
+
+    split = int(13.3 * 60 * sampling_rate)  # in the middle of an RSAM window
+    first, channel = rsam(packets(piece(tr, 0, split), [500]))
+    state = json.loads(json.dumps(channel.get_state()))  # (as saved in the state file)
+
+    restored = IncrementalRSAM("XX", "TEST", "", "HHZ", sampling_rate, freq=freq)
+    restored.set_state(state)
+    second, _ = rsam(packets(piece(tr, split, tr.stats.npts), [500]), state=restored)
+    for i in first:
+        first[i].update(second[i])
+    assert_same(first, expected)
+
+
+def test_state_with_other_parameters_is_rejected():
+    _, channel = rsam([make_trace(minutes=2)])
+    other = IncrementalRSAM("XX", "TEST", "", "HHZ", sampling_rate, freq=[None])
+    with pytest.raises(ValueError):
+        other.set_state(channel.get_state())
+
+
+def read_archive(archive):
+    """Returns {path below archive: [(starttime, data) of every Trace]} of every RSAM day file"""
+
+    return {str(p.relative_to(archive)): [(tr.stats.starttime, tr.data) for tr in read(str(p)).sort()]
+            for p in sorted(archive.rglob("*.D.*"))}
+
+
+def test_realtime_states_and_archive(tmp_path):
+    tr = make_trace(seed=1)
+    tr.data[20000:20400] = -2 ** 31  # Winston gap values are gaps
+
+    contiguous = RealtimeRSAM(freq=freq, archive=str(tmp_path / "contiguous"), flush_interval=None)
+    contiguous.replay(Stream([tr]), packet_length=10 ** 9)
+
+    # Two runs, in packets, with the states saved and restored in between (see RealtimeRSAM.set_states)
+    split = int(17.5 * 60 * sampling_rate)
+    first = RealtimeRSAM(freq=freq, archive=str(tmp_path / "packets"), flush_interval=None)
+    first.replay(Stream([piece(tr, 0, split)]), packet_length=256)
+    states = json.loads(json.dumps(first.get_states()))
+
+    second = RealtimeRSAM(freq=freq, archive=str(tmp_path / "packets"), flush_interval=None)
+    assert second.set_states(states, t0, t0 + 3600) == 1
+    assert second.set_states(states, t0 + 3600, t0 + 7200) == 0  # does not continue that time range
+    second.set_states(states, t0, t0 + 3600)
+    second.replay(Stream([piece(tr, split, tr.stats.npts)]), packet_length=700)
+
+    expected = read_archive(tmp_path / "contiguous")
+    result = read_archive(tmp_path / "packets")
+    assert sorted(result) == sorted(expected) and len(expected) == 2 * len(freq)  # two days per band
+    assert len(expected[min(expected)]) == 2  # the day with the gap
+    for path in expected:
+        assert [t for t, _ in result[path]] == [t for t, _ in expected[path]]
+        for (_, data), (_, expected_data) in zip(result[path], expected[path]):
+            np.testing.assert_allclose(data, expected_data, rtol=1e-6)  # (written as float32)
+
+
+@pytest.mark.parametrize("offset, noise", [(5000, 1000), (2e7, 3)])
+def test_incremental_matches_batch_rsam(offset, noise):
+    """Within a fraction of a percent of ffrsam.rsam (away from the taper), also for a large DC offset"""
+
+    rng = np.random.default_rng(2)
+    n = int(30 * 60 * sampling_rate)
+    data = np.round(offset + noise * rng.normal(size=n)).astype("int32")
+    tr = Trace(data=data, header=dict(network="XX", station="TEST", channel="HHZ", sampling_rate=sampling_rate,
+                                      starttime=t0))
+
+    result, _ = rsam(packets(tr, [1000]))
+    for i, f in enumerate(freq):
+        expected = batch_rsam(tr, freq=f)
+        times = [(expected.stats.starttime + k * 60).ns for k in range(expected.stats.npts)]
+        interior = slice(2, -2)  # (tapered in the batch)
+        np.testing.assert_allclose([result[i][t] for t in times[interior]], expected.data[interior], rtol=5e-3)
@@ -0,0 +1,124 @@
+"""
+RSAM computed with the vectorized windowed RMS (utils.window_rms) equals RSAM computed with the original
+Stream.slide loop.
+"""
+
+import numpy as np
+import pytest
+from obspy import Stream, Trace, UTCDateTime, read
+
+from tsdatacruncher.packages.ffrsam import coverage
+from tsdatacruncher.packages.ffrsam.ffrsam import archive_ffrsam, rsam, rsam_bank, spectral_rsam_bank
+from tsdatacruncher.packages.ffrsam.utils import window_rms
+
+
+def slide_rsam(tr, freq=None, period=60, taper_percentage=0.01, fill_value=0):
+    """RSAM as computed before window_rms (Stream.slide over the preprocessed Trace)"""
+
+    tmp = Stream(tr.copy().split())
+    for m in range(len(tmp)):
+        tmp[m].data = np.where(tmp[m].data == -2 ** 31, 0, tmp[m].data)
+    tmp.detrend("demean")
+    tmp.taper(max_percentage=taper_percentage)
+    tmp.merge(fill_value=fill_value)
+    if freq:
+        tmp.filter("bandpass", freqmin=freq[0], freqmax=freq[1])
+
+    rsam = []
+    for st_window in tmp.slide(window_length=period, step=period):
+        y = [np.sqrt(np.mean(np.square(tr.data))) for tr in st_window]
+        rsam.append(y[0])
+    rsam = np.array(rsam)
+
+    stats = tmp[0].stats
+    stats["delta"] = period
+    stats["npts"] = len(rsam)
+    return Trace(data=rsam, header=stats)
+
+
+def make_trace(npts, sampling_rate=100.0, gap=None, sentinels=None, seed=0):
+    """Random int32 Trace; gap (a, b) is masked and sentinels (a, b) is set to the Winston gap value"""
+
+    rng = np.random.default_rng(seed)
+    data = (1000 * rng.normal(size=npts) + 500 * np.sin(np.arange(npts) / 7.0)).astype("int32")
+    if sentinels:
+        data[sentinels[0]:sentinels[1]] = -2 ** 31
+    if gap:
+        mask = np.zeros(npts, dtype=bool)
+        mask[gap[0]:gap[1]] = True
+        data = np.ma.masked_array(data, mask=mask)
+    return Trace(data=data, header=dict(network="XX", station="TEST", channel="HHZ", sampling_rate=sampling_rate,
+                                        starttime=UTCDateTime("2025-01-01T00:10:00")))
+
+
+traces = {
+    "full": dict(npts=10 * 6000 + 1),
+    "partial": dict(npts=10 * 6000 + 1237),  # not a multiple of the window
+    "almost_full": dict(npts=10 * 6000 - 3),  # last window just above the 99.9% rule
+    "masked_gap": dict(npts=10 * 6000 + 1237, gap=(15000, 21000)),
+    "winston": dict(npts=10 * 6000 + 1237, sentinels=(33000, 33450)),
+    "gap_and_winston": dict(npts=7 * 6000 + 17, gap=(100, 8000), sentinels=(20000, 20500)),
+}
+
+
+@pytest.mark.parametrize("freq", [None, [1.0, 5.0]])
+@pytest.mark.parametrize("name", sorted(traces))
+def test_rsam_matches_slide(name, freq):
+    tr = make_trace(**traces[name])
+    expected = slide_rsam(tr, freq=freq)
+    result = rsam(tr, freq=freq)
+
+    assert result.stats.npts == expected.stats.npts
+    assert result.stats.starttime == expected.stats.starttime
+    assert result.stats.delta == expected.stats.delta
+    np.testing.assert_allclose(result.data, expected.data, rtol=1e-9)
+
+
+@pytest.mark.parametrize("name", sorted(traces))
+def test_spectral_unfiltered_band_matches_filter(name):
+    tr = make_trace(**traces[name])
+    (_, expected), _ = rsam_bank(tr, freq=[None, [1.0, 5.0]])
+    (_, result), (_, band) = spectral_rsam_bank(tr, freq=[None, [1.0, 5.0]])
+
+    assert result.stats.starttime == expected.stats.starttime
+    np.testing.assert_array_equal(result.data, expected.data)
+    assert band.stats.npts == expected.stats.npts
+
+
+@pytest.mark.parametrize("npts", [1, 599, 600, 601, 1799, 1800, 1801, 2399])
+def test_window_rms_matches_slide(npts):
+    tr = make_trace(npts, sampling_rate=10.0)
+    tr.data = tr.data.astype("float64")
+    expected = [np.sqrt(np.mean(np.square(w[0].data))) for w in Stream([tr]).slide(window_length=60, step=60)]
+    np.testing.assert_allclose(window_rms(tr.data, 600), expected, rtol=1e-12)
+    np.testing.assert_allclose(window_rms(tr.data.copy(), 600, overwrite=True), expected, rtol=1e-12)
+
+
+def test_window_rms_masked():
+    data = np.ma.masked_array(np.arange(31, dtype="float64"), mask=np.zeros(31, dtype=bool))
+    data.mask[3:7] = True
+    data.mask[10:21] = True  # the second window (and its endpoint) is empty
+    result = window_rms(data, 10)
+
+    assert result.mask.tolist() == [False, True, False]
+    expected = [np.sqrt(np.mean(np.square(data[a:a + 11].compressed()))) for a in (0, 20)]
+    np.testing.assert_allclose(result.compressed(), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("late", [0, 0.004, 17.0])
+def test_archive_ffrsam_origin_grid(tmp_path, late):
+    """RSAM samples start on the grid of the origin, also when the data start late (within a sample: on time)"""
+
+    coverage.coverage_indexes.clear()
+    tr = make_trace(10 * 6000 + 1)
+    origin = tr.stats.starttime - late
+    archive_ffrsam(Stream([tr]), freq=[None], archive=str(tmp_path), origin=origin)
+
+    result = read(str(next(tmp_path.rglob("*.D.*"))))
+    assert len(result) == 1
+    if late > tr.stats.delta:
+        assert result[0].stats.starttime == origin + 60
+        assert result[0].stats.npts == 9
+    else:
+        assert result[0].stats.starttime == tr.stats.starttime
+        assert result[0].stats.npts == 10
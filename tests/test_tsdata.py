@@ -0,0 +1,131 @@
+"""
+Concurrent waveform requests (tsdata.get_waveforms) against a local FDSN web service (see fakes.FakeFDSNServer):
+bulk grouping, retries with backoff, no retries for 'no data', and failed requests.
+"""
+
+import numpy as np
+import pytest
+from obspy import Stream, Trace, UTCDateTime
+from obspy.clients.fdsn.header import FDSNException, FDSNNoDataException
+
+from fakes import FakeFDSNServer
+from tsdatacruncher.utils import tsdata
+from tsdatacruncher.utils.tsdata import fdsn_client, get_waveforms, is_no_data, request_with_retry
+
+t1 = UTCDateTime("2025-01-01T00:00:00")
+t2 = t1 + 600
+ids = [f"XX.S{i:02d}..HHZ" for i in range(5)]
+
+
+def make_stream(ids):
+    rng = np.random.default_rng(0)
+    return Stream([Trace(data=rng.integers(-1000, 1000, size=6001).astype("int32"),
+                         header=dict(network=net, station=sta, location=loc, channel=cha, sampling_rate=10.0,
+                                     starttime=t1))
+                   for net, sta, loc, cha in (id.split(".") for id in ids)])
+
+
+@pytest.fixture
+def fdsn():
+    servers = []
+
+    def start(*args, **kwargs):
+        servers.append(FakeFDSNServer(*args, **kwargs))
+        return servers[-1], fdsn_client(servers[-1].base_url, _discover_services=False)
+
+    yield start
+    for s in servers:
+        s.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records backoff pauses instead of sleeping"""
+
+    pauses = []
+    monkeypatch.setattr(tsdata.time, "sleep", pauses.append)
+    return pauses
+
+
+def test_bulk_requests_are_grouped(fdsn):
+    expected = make_stream(ids)
+    server, client = fdsn(expected)
+
+    st = get_waveforms(client, ids, t1, t2, bulk_size=2)
+
+    assert [method for method, _ in server.requests] == ["POST"] * 3
+    assert sorted(len(channels) for _, channels in server.requests) == [1, 2, 2]
+    assert sorted(sta for _, channels in server.requests for _, sta, _, _ in channels) == \
+        sorted(id.split(".")[1] for id in ids)
+    assert sorted(tr.id for tr in st) == sorted(ids)
+    for tr in st:
+        np.testing.assert_array_equal(tr.data, expected.select(id=tr.id)[0].data)
+
+
+def test_failed_requests_are_retried_with_backoff(fdsn, sleeps):
+    server, client = fdsn(make_stream(ids), failures=2)
+    failed = []
+
+    st = get_waveforms(client, ids, t1, t2, bulk_size=10, retries=2, backoff=0.5, failed=failed)
+
+    assert len(server.requests) == 3
+    assert sleeps == [0.5, 1.0]
+    assert len(st) == len(ids) and failed == []
+
+
+@pytest.mark.parametrize("no_data_code", [204, 404])
+def test_no_data_is_not_retried(fdsn, sleeps, no_data_code):
+    server, client = fdsn(make_stream(ids[:2]), no_data_code=no_data_code)
+    failed = []
+
+    st = get_waveforms(client, ids, t1, t2, bulk_size=2, retries=2, failed=failed)
+
+    assert len(server.requests) == 3  # one per group, no retries
+    assert sleeps == []
+    assert sorted(tr.id for tr in st) == ids[:2]
+    assert failed == []
+
+
+def test_failed_ids_are_reported(fdsn, sleeps):
+    server, client = fdsn(make_stream(ids), failures=100)
+    failed = []
+
+    st = get_waveforms(client, ids, t1, t2, bulk_size=2, retries=1, failed=failed)
+
+    assert len(st) == 0
+    assert len(server.requests) == 6  # 3 groups, 2 attempts each
+    assert sorted(failed) == ids
+
+
+def test_single_requests_without_bulk(fdsn):
+    server, client = fdsn(make_stream(ids[:3]))
+
+    st = get_waveforms(client, ids[:3], t1, t2, bulk_size=0)
+
+    assert [method for method, _ in server.requests] == ["GET"] * 3
+    assert sorted(tr.id for tr in st) == ids[:3]
+
+
+def test_request_with_retry():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise FDSNException("Service responds: Internal server error")
+        return "data"
+
+    assert request_with_retry(flaky, retries=2, backoff=0) == "data"
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(FDSNException):
+        request_with_retry(flaky, retries=1, backoff=0)
+    assert len(calls) == 2
+
+
+def test_is_no_data():
+    assert is_no_data(FDSNNoDataException("No data available for request."))
+    assert is_no_data(FDSNException("Unknown HTTP code: 404", ""))
+    assert not is_no_data(FDSNException("Service responds: Internal server error", ""))
+    assert not is_no_data(OSError("connection reset"))
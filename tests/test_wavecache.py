@@ -0,0 +1,74 @@
+"""
+Raw waveform cache (utils.wavecache.CachedClient) around a local SDS archive: only missing intervals are fetched,
+and day files are evicted by the sizes recorded when they were written.
+"""
+
+import os
+
+import numpy as np
+from obspy import Trace, UTCDateTime
+from obspy.clients.filesystem.sds import Client as SDSClient
+
+from tsdatacruncher.utils.wavecache import CachedClient
+
+t1 = UTCDateTime("2025-01-01T00:00:00")
+
+
+class CountingClient:
+    """Remote client stand-in that records its requests"""
+
+    def __init__(self, root):
+        self.client = SDSClient(root)
+        self.requests = []
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime, **kwargs):
+        self.requests.append((station, starttime, endtime))
+        return self.client.get_waveforms(network, station, location, channel, starttime, endtime)
+
+
+def make_archive(root, days=3):
+    rng = np.random.default_rng(0)
+    for day in range(days):
+        start = t1 + day * 86400
+        tr = Trace(data=rng.integers(-1000, 1000, size=8640).astype("int32"),
+                   header=dict(network="XX", station="AAA", channel="HHZ", sampling_rate=0.1, starttime=start))
+        path = root / str(start.year) / "XX" / "AAA" / "HHZ.D"
+        path.mkdir(parents=True, exist_ok=True)
+        tr.write(str(path / f"XX.AAA..HHZ.D.{start.year}.{start.julday:03d}"), format="MSEED")
+
+
+def test_only_missing_intervals_are_fetched(tmp_path):
+    make_archive(tmp_path / "raw")
+    remote = CountingClient(str(tmp_path / "raw"))
+    client = CachedClient(remote, str(tmp_path / "cache"), settle=0)
+
+    st = client.get_waveforms("XX", "AAA", "", "HHZ", t1, t1 + 43200)
+    assert len(remote.requests) == 1 and sum(tr.stats.npts for tr in st) == 4321
+    st = client.get_waveforms("XX", "AAA", "", "HHZ", t1 + 3600, t1 + 86400 - 10)
+    assert len(remote.requests) == 2  # only 12:00 to the end of the day
+    assert remote.requests[-1][1] == t1 + 43200
+    assert sum(tr.stats.npts for tr in st) == 8280
+
+
+def test_eviction_uses_recorded_sizes(tmp_path, monkeypatch):
+    make_archive(tmp_path / "raw")
+    remote = CountingClient(str(tmp_path / "raw"))
+    client = CachedClient(remote, str(tmp_path / "cache"), settle=0)
+    client.get_waveforms("XX", "AAA", "", "HHZ", t1, t1 + 86400 - 10)
+    size = os.path.getsize(tmp_path / "cache" / "2025" / "XX" / "AAA" / "HHZ.D" / "XX.AAA..HHZ.D.2025.001")
+    assert client._index["2025/XX/AAA/HHZ.D/XX.AAA..HHZ.D.2025.001"]["size"] == size
+
+    client.get_waveforms("XX", "AAA", "", "HHZ", t1 + 86400, t1 + 2 * 86400 - 10)
+    client.get_waveforms("XX", "AAA", "", "HHZ", t1 + 2 * 86400, t1 + 3 * 86400 - 10)
+
+    # Room for two day files: the least recently used one is evicted, without looking at the files
+    client.max_bytes = 2 * size
+    stats = []
+    getsize = os.path.getsize
+    monkeypatch.setattr(os.path, "getsize", lambda path: stats.append(path) or getsize(path))
+    client._accessed([])
+
+    assert stats == []
+    assert sorted(client._index) == ["2025/XX/AAA/HHZ.D/XX.AAA..HHZ.D.2025.002",
+                                     "2025/XX/AAA/HHZ.D/XX.AAA..HHZ.D.2025.003"]
+    assert not os.path.exists(tmp_path / "cache" / "2025" / "XX" / "AAA" / "HHZ.D" / "XX.AAA..HHZ.D.2025.001")
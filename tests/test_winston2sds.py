@@ -0,0 +1,121 @@
+"""
+winston2sds against a local fake wave server (see fakes.FakeWaveServer): copying, Winston gap values, resuming and
+rate limiting.
+"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+from obspy import Trace, UTCDateTime
+from obspy.clients.earthworm import Client as EWClient
+from obspy.clients.filesystem.sds import Client as SDSClient
+
+from fakes import FakeWaveServer
+from tsdatacruncher.packages.winston2sds.winston2sds import mirror, RateLimiter, winston_gap
+
+t1 = UTCDateTime("2025-01-01T00:00:00")
+
+
+def make_trace(station, hours=2, sampling_rate=10.0, sentinels=None, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(-1000, 1000, size=int(hours * 3600 * sampling_rate)).astype("int32")
+    if sentinels:
+        data[sentinels[0]:sentinels[1]] = winston_gap
+    return Trace(data=data, header=dict(network="XX", station=station, channel="HHZ", sampling_rate=sampling_rate,
+                                        starttime=t1))
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(*args, **kwargs):
+        servers.append(FakeWaveServer(*args, **kwargs))
+        return servers[-1], EWClient("127.0.0.1", servers[-1].port, timeout=5)
+
+    yield start
+    for s in servers:
+        s.close()
+
+
+def test_mirror_copies_data_and_removes_gap_sentinels(server, tmp_path):
+    tr = make_trace("AAA", sentinels=(20000, 20350))
+    fake, client = server([tr])
+
+    failed = mirror(client, ["XX.AAA..HHZ"], t1, t1 + 7200, tmp_path, chunk=1800, max_workers=2)
+    assert failed == 0
+
+    st = SDSClient(str(tmp_path)).get_waveforms("XX", "AAA", "", "HHZ", t1, t1 + 7200)
+    assert len(st) == 2  # split at the run of gap values
+    assert not any((t.data == winston_gap).any() for t in st)
+    st.sort()
+    assert st[0].stats.endtime == t1 + 19999 * tr.stats.delta
+    assert st[1].stats.starttime == t1 + 20350 * tr.stats.delta
+    np.testing.assert_array_equal(st[0].data, tr.data[:20000])
+    np.testing.assert_array_equal(st[1].data, tr.data[20350:])
+
+
+def test_mirror_resumes_missing_chunks(server, tmp_path):
+    dropped = t1 + 3600  # the second hour is lost (dropped connection) in the first run
+    drop = {dropped.timestamp}
+    fake, client = server([make_trace("AAA"), make_trace("BBB", seed=1)], drop=lambda a, b: a in drop)
+    ids = ["XX.AAA..HHZ", "XX.BBB..HHZ", "XX.CCC..HHZ"]  # no data for CCC
+
+    mirror(client, ids, t1, t1 + 7200, tmp_path, chunk=3600)
+    assert len(fake.requests) == 6
+
+    # Only the dropped hours and the station without data are requested again
+    drop.clear()
+    fake.requests.clear()
+    mirror(client, ids, t1, t1 + 7200, tmp_path, chunk=3600)
+    assert sorted((id, UTCDateTime(a)) for _, id, a, b in fake.requests) == \
+        [("XX.AAA..HHZ", dropped), ("XX.BBB..HHZ", dropped), ("XX.CCC..HHZ", t1), ("XX.CCC..HHZ", dropped)]
+
+    sds = SDSClient(str(tmp_path))
+    for sta in ("AAA", "BBB"):
+        st = sds.get_waveforms("XX", sta, "", "HHZ", t1, t1 + 7200)
+        st.merge()
+        assert len(st) == 1 and st[0].stats.npts == 72000
+
+    # Complete station-days are not requested at all
+    fake.requests.clear()
+    mirror(client, ids[:2], t1, t1 + 7200, tmp_path, chunk=3600)
+    assert fake.requests == []
+
+
+def test_mirror_rate_limit(server, tmp_path):
+    fake, client = server([make_trace("AAA", hours=1)])
+    mirror(client, ["XX.AAA..HHZ"], t1, t1 + 3600, tmp_path, chunk=300, max_workers=4, rate=20)
+
+    times = sorted(t for t, _, _, _ in fake.requests)
+    assert len(times) == 12
+    assert times[-1] - times[0] >= 11 / 20 * 0.95
+    assert min(np.diff(times)) >= 1 / 20 * 0.5  # (thread scheduling jitter)
+
+
+def test_rate_limiter_spaces_calls_across_threads():
+    limiter = RateLimiter(50)
+    times = []
+
+    def work():
+        for _ in range(5):
+            limiter.wait()
+            times.append(time.monotonic())
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    times.sort()
+    assert times[-1] - times[0] >= 19 / 50 * 0.95
+
+
+def test_rate_limiter_without_rate_does_not_wait():
+    limiter = RateLimiter(None)
+    t0 = time.monotonic()
+    for _ in range(1000):
+        limiter.wait()
+    assert time.monotonic() - t0 < 0.5
@@ -0,0 +1,337 @@
+"""
+Benchmarks the RSAM pipeline on a synthetic raw SDS archive (see synthetic.py): each stage separately and main()
+end to end. Results are saved as JSON and can be compared with an earlier run.
+
+$ python -m tsdatacruncher.packages.benchmark.benchmark --stations 8 --days 1 --output bench.json
+$ python -m tsdatacruncher.packages.benchmark.benchmark --stations 8 --days 1 --compare bench.json
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tsdatacruncher.packages.benchmark.startup import root
+from tsdatacruncher.packages.benchmark.synthetic import make_sds
+
+# Stages in the order they run (get_ffrsam reads the archive written by archive_ffrsam)
+stages = ["get_waveforms", "rsam", "archive_ffrsam", "get_ffrsam", "main"]
+
+default_freq = [None, [0.1, 1.0], [1.0, 5.0], [5.0, 10.0]]
+
+
+def count_file_opens(roots):
+    """
+    Counts the files opened below roots from now on (Python audit hook); returns a dict that is kept up to date:
+    number of opens for reading ("read") and writing ("write"), the size of the distinct files opened for reading
+    ("read_bytes", when first opened) and the distinct files written ("written", a set of paths; files renamed
+    into place are followed). ObsPy memory-maps MiniSEED files, so the bytes actually read are not visible to read
+    counters. Only this process is counted (not worker processes).
+
+    Audit hooks cannot be removed, so this is only used in the benchmark's own stage processes.
+    """
+
+    roots = tuple(os.path.abspath(r) + os.sep for r in roots)
+    counts = {"read": 0, "write": 0, "read_bytes": 0, "written": set()}
+    seen = set()
+    write_flags = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT
+
+    def hook(event, args):
+        if event not in ("open", "os.rename") or not isinstance(args[0], (str, bytes)):
+            return
+        path = os.path.abspath(os.fsdecode(args[0]))
+        if not path.startswith(roots):
+            return
+        if event == "os.rename":  # (also raised by os.replace)
+            if path in counts["written"]:
+                counts["written"].discard(path)
+                counts["written"].add(os.path.abspath(os.fsdecode(args[1])))
+            return
+        mode, flags = args[1], args[2]
+        write = any(c in mode for c in "wax+") if mode else bool(flags & write_flags)
+        counts["write" if write else "read"] += 1
+        if write:
+            counts["written"].add(path)
+        if not write and path not in seen:
+            seen.add(path)
+            try:
+                counts["read_bytes"] += os.path.getsize(path)
+            except OSError:
+                pass
+
+    sys.addaudithook(hook)
+    return counts
+
+
+def peak_rss_mb():
+    """
+    Returns the peak RSS of this process in MB.
+
+    On Linux this is VmHWM, which starts from zero in a new process (ru_maxrss keeps the peak of the parent
+    process that started it) and can be reset (see reset_peak_rss).
+    """
+
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) / 1024
+    except (OSError, StopIteration):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+def reset_peak_rss():
+    """Resets the peak RSS of this process to its current RSS (Linux); returns False where not supported"""
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def run_stage(stage, info, workdir, options):
+    """
+    Runs one stage in this (fresh) process; returns its metrics.
+
+    Inputs are prepared before the clock starts (e.g., the raw Stream for rsam, the RSAM archive for get_ffrsam).
+    The stage is timed, its file opens below the raw and output archives are counted (see count_file_opens) with
+    the size of the files read and written. peak_rss_mb is the peak RSS while the stage ran (including its inputs)
+    where the peak can be reset, otherwise of the whole process (peak_rss_reset tells which).
+    """
+
+    from obspy import UTCDateTime
+
+    from tsdatacruncher.packages.ffrsam import ffrsam
+    from tsdatacruncher.packages.ffrsam.cache import DayFileCache
+    from tsdatacruncher.utils import tsdata
+
+    t1, t2 = UTCDateTime(info["t1"]), UTCDateTime(info["t2"])
+    freq = options["freq"]
+    datasource = f"sds://{info['root']}"
+    archive = os.path.join(workdir, "rsam")
+
+    def fetch():
+        return tsdata.get_waveforms(tsdata.get_client(datasource), info["ids"], t1, t2,
+                                    max_workers=options["fetch_workers"])
+
+    def archive_rsam(st):
+        cache = DayFileCache(max_bytes=256 * 1024 ** 2)
+        ffrsam.archive_ffrsam(st, freq=freq, archive=archive, mode=options["mode"], cache=cache, overwrite=True,
+                              pyramid=options["pyramid"], precision=options["precision"])
+        cache.flush()
+
+    # Inputs (not timed)
+    st = fetch() if stage in ("rsam", "archive_ffrsam") else None
+    if stage == "get_ffrsam" and not os.path.isdir(archive):
+        raise RuntimeError(f"No RSAM archive to read (run archive_ffrsam first): {archive}")
+    if stage == "main":
+        sys.path.insert(0, root)
+        import run_tsdatacruncher
+
+    rss_before = peak_rss_mb()
+    reset = reset_peak_rss()
+    opens = count_file_opens([info["root"], workdir])
+    t0 = time.perf_counter()
+
+    if stage == "get_waveforms":
+        samples = sum(tr.stats.npts for tr in fetch())
+    elif stage == "rsam":
+        bank = ffrsam.spectral_rsam_bank if options["mode"] == "spectral" else ffrsam.rsam_bank
+        samples = sum(tr.stats.npts for tr in st)
+        for tr in st.merge():
+            for _ in bank(tr, freq=freq, dtype=options["precision"]):
+                pass
+    elif stage == "archive_ffrsam":
+        samples = sum(tr.stats.npts for tr in st)
+        archive_rsam(st)
+    elif stage == "get_ffrsam":
+        data = ffrsam.get_ffrsam(archive, info["ids"], t1, t2, freq=freq)
+        samples = sum(tr.stats.npts for st_f in data.values() for tr in st_f)
+    elif stage == "main":
+        errors = run_tsdatacruncher.main(datasource, info["ids"], t1, t2, freq=freq, tload=options["tload"],
+                                         tproc=options["tproc"], tstep=options["tstep"], mode=options["mode"],
+                                         workers=options["workers"], fetch_workers=options["fetch_workers"],
+                                         overwrite=True, pyramid=options["pyramid"], precision=options["precision"],
+                                         verbose=False, welcome=False,
+                                         config={"archive": os.path.join(workdir, "main")})
+        if errors:
+            raise RuntimeError(f"main() reported {errors} errors")
+        samples = info["samples"]
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    seconds = time.perf_counter() - t0
+    written = sum(os.path.getsize(path) for path in opens["written"] if os.path.exists(path))
+    station_days = info["stations"] * info["days"]
+    return {"seconds": seconds,
+            "station_days_per_s": station_days / seconds,
+            "samples": samples,
+            "samples_per_s": samples / seconds,
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_reset": reset,
+            "inputs_rss_mb": rss_before,
+            "files_read": opens["read"],
+            "files_written": opens["write"],
+            "read_mb": opens["read_bytes"] / 1024 ** 2,
+            "write_mb": written / 1024 ** 2}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(workdir, n_stations=4, days=1, rates=(100.0,), dtypes=("int32", "float32"), gaps=1, sentinels=1,
+                  seed=0, freq=default_freq, mode="filter", precision=None, tload="1D", tproc="1h", tstep="1h",
+                  workers=1, fetch_workers=4, pyramid=None, repeat=1, only=None, logger=None):
+    """
+    Generates a synthetic archive in workdir and benchmarks every stage (or only those in only); returns the report.
+
+    Every stage runs repeat times, each in a new process, and the fastest run is kept. If get_ffrsam runs without
+    archive_ffrsam, its input archive is written by an untimed archive_ffrsam run first.
+    """
+
+    from tsdatacruncher.utils.input import parse_time_delta
+
+    info = make_sds(os.path.join(workdir, "raw"), n_stations=n_stations, days=days, rates=rates, dtypes=dtypes,
+                    gaps=gaps, sentinels=sentinels, seed=seed)
+    options = {"freq": freq, "mode": mode, "precision": precision, "tload": parse_time_delta(tload),
+               "tproc": parse_time_delta(tproc), "tstep": parse_time_delta(tstep), "workers": workers,
+               "fetch_workers": fetch_workers, "pyramid": pyramid}
+
+    def run(stage):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return pool.submit(run_stage, stage, info, workdir, options).result()
+
+    results = dict()
+    for stage in stages:
+        if only and stage not in only:
+            continue
+        if stage == "get_ffrsam" and "archive_ffrsam" not in results:
+            run("archive_ffrsam")
+        runs = [run(stage) for _ in range(repeat)]
+        results[stage] = min(runs, key=lambda r: r["seconds"])
+        if logger:
+            logger.info(f"{stage}: {results[stage]['seconds']:.2f} s")
+
+    return {"created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "archive": {k: v for k, v in info.items() if k not in ("root", "ids")},
+            "options": options, "repeat": repeat, "stages": results}
+
+
+def comparable(report, previous):
+    """True if both runs used the same synthetic archive and options"""
+
+    return previous.get("archive") == report["archive"] and previous.get("options") == report["options"]
+
+
+def compare(report, previous, tolerance=1.25, min_seconds=0.1):
+    """
+    Returns the list of regressions of report vs. previous: stages more than tolerance x slower (and at least
+    min_seconds slower, so very short stages do not fail on noise) or with a larger peak RSS.
+    """
+
+    problems = []
+    for stage, now in report["stages"].items():
+        before = previous.get("stages", {}).get(stage)
+        if not before:
+            continue
+        if now["seconds"] > tolerance * before["seconds"] and now["seconds"] - before["seconds"] > min_seconds:
+            problems.append(f"{stage}: {now['seconds']:.2f} s > {tolerance} x {before['seconds']:.2f} s")
+        if now["peak_rss_mb"] > tolerance * before["peak_rss_mb"]:
+            problems.append(f"{stage}: peak RSS {now['peak_rss_mb']:.0f} MB > {tolerance} x "
+                            f"{before['peak_rss_mb']:.0f} MB")
+    return problems
+
+
+def print_report(report, previous=None):
+    a = report["archive"]
+    print(f"{a['stations']} stations x {a['days']} days, {a['samples']} samples "
+          f"({a['bytes'] / 1024 ** 2:.0f} MB), rates {a['rates']}, dtypes {a['dtypes']}")
+    print(f"{'stage':<15} {'seconds':>8} {'sta-days/s':>10} {'Msamples/s':>10} {'peak MB':>8} {'files r/w':>11} "
+          f"{'MB r/w':>13} {'vs. previous':>12}")
+    for stage, r in report["stages"].items():
+        before = (previous or {}).get("stages", {}).get(stage)
+        ratio = f"{r['seconds'] / before['seconds']:.2f}x" if before else ""
+        rw = f"{r['read_mb']:.1f}/{r['write_mb']:.1f}"
+        print(f"{stage:<15} {r['seconds']:>8.2f} {r['station_days_per_s']:>10.2f} {r['samples_per_s'] / 1e6:>10.2f} "
+              f"{r['peak_rss_mb']:>8.0f} {r['files_read']:>5}/{r['files_written']:<5} {rw:>13} {ratio:>12}")
+
+
+def main():
+
+    from tsdatacruncher.utils.input import parse_freq
+    from tsdatacruncher.utils.logs import setup_logger
+
+    parser = argparse.ArgumentParser(description="Benchmark the RSAM pipeline on a synthetic SDS archive")
+    parser.add_argument("--stations", type=int, default=4, help="Number of stations (default: 4)")
+    parser.add_argument("--days", type=int, default=1, help="Number of days (default: 1)")
+    parser.add_argument("--rates", type=str, default="100", help="Sampling rates, cycled over stations (e.g., 100,50)")
+    parser.add_argument("--dtypes", type=str, default="int32,float32", help="Sample types, cycled over stations")
+    parser.add_argument("--gaps", type=int, default=1, help="Gaps per station-day (default: 1)")
+    parser.add_argument("--sentinels", type=int, default=1, help="Runs of Winston gap values per station-day")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--freq", type=str, help="Frequency bands (default: None,0.1-1,1-5,5-10)")
+    parser.add_argument("--mode", choices=["filter", "spectral"], default="filter", help="RSAM processing mode")
+    parser.add_argument("--precision", choices=["float32", "float64"], help="Low-allocation numeric path")
+    parser.add_argument("--tproc", type=str, default="1h", help="main(): processing window (default: 1h)")
+    parser.add_argument("--tstep", type=str, default="1h", help="main(): processing step (default: 1h)")
+    parser.add_argument("--workers", type=int, default=1, help="main(): worker processes (default: 1)")
+    parser.add_argument("--stage", type=str, help=f"Only these stages (comma-separated: {','.join(stages)})")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is kept (default: 1)")
+    parser.add_argument("--workdir", type=str, help="Directory for the archives (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep the archives in workdir")
+    parser.add_argument("--output", type=str, help="Save the results to this JSON file")
+    parser.add_argument("--compare", type=str, help="Compare with the results of an earlier run (JSON file)")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="With --compare, fail if a stage is this many times slower or larger (default: 1.25)")
+    args = parser.parse_args()
+
+    logger = setup_logger("benchmark")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tsdc_benchmark_")
+    try:
+        report = run_benchmark(workdir, n_stations=args.stations, days=args.days,
+                               rates=[float(r) for r in args.rates.split(",")], dtypes=args.dtypes.split(","),
+                               gaps=args.gaps, sentinels=args.sentinels, seed=args.seed,
+                               freq=parse_freq(args.freq) if args.freq else default_freq, mode=args.mode,
+                               precision=args.precision, tproc=args.tproc, tstep=args.tstep, workers=args.workers,
+                               repeat=args.repeat, only=args.stage.split(",") if args.stage else None, logger=logger)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(report, previous)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+        logger.info(f"Saved results to {args.output}")
+
+    if previous and not comparable(report, previous):
+        print("NOTE: the archive or options differ from the previous run")
+    problems = compare(report, previous, tolerance=args.tolerance) if previous else []
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Measures how long tsdatacruncher takes to start (python -X importtime) and checks it against a tracked baseline.
+
+$ python -m tsdatacruncher.packages.benchmark.startup            # compare with startup_baseline.json
+$ python -m tsdatacruncher.packages.benchmark.startup --save     # record a new baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Repository root (holds run_tsdatacruncher.py)
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+
+baseline_file = os.path.join(os.path.dirname(__file__), "startup_baseline.json")
+
+# Modules that must not be imported just to start (loaded when a datasource, output or report needs them)
+lazy_modules = ["pandas", "obspy.clients.fdsn", "obspy.clients.seedlink", "psutil", "scipy.signal", "matplotlib",
+                "bokeh"]
+
+
+def parse_importtime(stderr):
+    """Returns {module: (self µs, cumulative µs)} from the output of python -X importtime"""
+
+    modules = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_python(args, importtime=False):
+    """Runs a fresh interpreter in the repository root; returns (wall time in ms, stderr)"""
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + args
+    t0 = time.perf_counter()
+    result = subprocess.run(command, cwd=root, env=env, capture_output=True, text=True)
+    wall = (time.perf_counter() - t0) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed: {result.stderr[-2000:]}")
+    return wall, result.stderr
+
+
+def measure(repeat=5, top=15):
+    """
+    Starts tsdatacruncher repeat times in fresh interpreters; returns a report (dict).
+
+    Measures the import of run_tsdatacruncher (-X importtime, ms), the wall time of run_tsdatacruncher.py --help
+    (ms), the slowest modules imported, and which lazy_modules were imported. The first run is reported separately
+    as 'first' (the closest to a cold start: file caches may still be cold).
+    """
+
+    imports, walls, modules = [], [], dict()
+    for _ in range(repeat):
+        _, stderr = run_python(["-c", "import run_tsdatacruncher"], importtime=True)
+        modules = parse_importtime(stderr)
+        imports.append(modules["run_tsdatacruncher"][1] / 1000)
+        walls.append(run_python(["run_tsdatacruncher.py", "--help"])[0])
+    _, baseline_stderr = run_python(["-c", "pass"], importtime=True)
+    interpreter = sum(s for s, _ in parse_importtime(baseline_stderr).values()) / 1000
+
+    slowest = sorted(((name, s / 1000) for name, (s, _) in modules.items()), key=lambda x: -x[1])[:top]
+    return {"python": platform.python_version(), "platform": platform.platform(), "repeat": repeat,
+            "import_ms": {"median": statistics.median(imports), "first": imports[0], "min": min(imports)},
+            "help_ms": {"median": statistics.median(walls), "first": walls[0], "min": min(walls)},
+            "interpreter_ms": interpreter,
+            "slowest_modules_ms": dict(slowest),
+            "lazy_modules_imported": [m for m in lazy_modules if m in modules]}
+
+
+def compare(report, baseline, tolerance=1.5):
+    """Returns the list of problems of report vs. baseline (times more than tolerance x the baseline, lazy imports)"""
+
+    problems = [f"{m} is imported at startup" for m in report["lazy_modules_imported"]]
+    for key in ("import_ms", "help_ms"):
+        if baseline and report[key]["median"] > tolerance * baseline[key]["median"]:
+            problems.append(f"{key}: {report[key]['median']:.0f} ms > {tolerance} x {baseline[key]['median']:.0f} ms "
+                            f"(baseline)")
+    return problems
+
+
+def print_report(report, baseline=None):
+    for key, label in (("import_ms", "import run_tsdatacruncher"), ("help_ms", "run_tsdatacruncher.py --help")):
+        was = f" (baseline {baseline[key]['median']:.0f} ms)" if baseline else ""
+        print(f"{label:<30} median {report[key]['median']:7.1f} ms, first {report[key]['first']:7.1f} ms{was}")
+    print(f"{'python startup':<30} {report['interpreter_ms']:7.1f} ms (imports of an empty script)")
+    print("Slowest modules (self time):")
+    for name, ms in report["slowest_modules_ms"].items():
+        print(f"  {ms:7.1f} ms  {name}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Measure tsdatacruncher startup time (python -X importtime)")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to start (default: 5)")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Fail if startup is slower than tolerance x the baseline (default: 1.5)")
+    parser.add_argument("--baseline", type=str, default=baseline_file, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = measure(repeat=args.repeat)
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = None
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print_report(report, baseline)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    problems = compare(report, baseline, tolerance=args.tolerance)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
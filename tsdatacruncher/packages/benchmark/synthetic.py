@@ -0,0 +1,128 @@
+"""
+Generates deterministic synthetic raw SDS archives for benchmarks.
+
+$ python -m tsdatacruncher.packages.benchmark.synthetic ./synthetic_sds --stations 8 --days 2 --rates 100,50
+"""
+
+import argparse
+import os
+
+import numpy as np
+from obspy import UTCDateTime, Stream, Trace
+
+from tsdatacruncher.packages.winston2sds.winston2sds import winston_gap
+
+# MiniSEED encoding of each sample type (Traces with Winston gap values are written as INT32: Steim cannot encode them)
+encodings = {"int32": "STEIM2", "float32": "FLOAT32", "float64": "FLOAT64"}
+
+sds_syntax = "{year}/{net}/{sta}/{cha}.D/{net}.{sta}.{loc}.{cha}.D.{year}.{jday:03d}"
+
+
+def station_ids(n_stations, network="SY", channel="HHZ"):
+    return [f"{network}.S{i:03d}..{channel}" for i in range(n_stations)]
+
+
+def synthetic_day(rng, day, sampling_rate=100.0, dtype="int32", gaps=1, sentinels=1):
+    """
+    Returns (Stream, number of samples) for one station-day: red noise, a tremor line and a few decaying events.
+
+    gaps intervals of 1-30 minutes are left out (the Stream holds the Traces between them), and integer data get
+    sentinels runs of 10-500 Winston gap values (-2**31).
+    """
+
+    from scipy.signal import lfilter
+
+    npts = int(round(86400 * sampling_rate))
+    t = np.arange(npts) / sampling_rate
+    data = lfilter([1.0], [1.0, -0.999], rng.normal(size=npts)) * 20  # red noise (AR(1), does not drift)
+    data += 200 * rng.normal(size=npts) + 300 * np.sin(2 * np.pi * rng.uniform(1, 5) * t)
+    for t0 in rng.uniform(0, 86400, size=5):
+        i0 = int(t0 * sampling_rate)
+        n = min(npts - i0, int(60 * sampling_rate))
+        data[i0:i0 + n] += rng.uniform(2e3, 2e4) * np.exp(-np.arange(n) / (10 * sampling_rate)) \
+            * np.sin(2 * np.pi * 3 * np.arange(n) / sampling_rate)
+    data = data.astype(dtype)
+
+    if dtype == "int32":
+        for _ in range(sentinels):
+            i0 = int(rng.integers(0, npts - 500))
+            data[i0:i0 + int(rng.integers(10, 500))] = winston_gap
+
+    keep = np.ones(npts, dtype=bool)
+    for _ in range(gaps):
+        i0 = int(rng.integers(0, npts))
+        keep[i0:i0 + int(rng.uniform(60, 1800) * sampling_rate)] = False
+
+    st = Stream()
+    tr = Trace(data=np.ma.masked_array(data, mask=~keep),
+               header=dict(sampling_rate=sampling_rate, starttime=UTCDateTime(day)))
+    for part in tr.split():
+        part.data = np.ascontiguousarray(part.data)
+        st.append(part)
+    return st, int(keep.sum())
+
+
+def make_sds(root, n_stations=4, days=1, t1="2025-01-01", rates=(100.0,), dtypes=("int32", "float32"), gaps=1,
+             sentinels=1, seed=0, network="SY", channel="HHZ"):
+    """
+    Writes a synthetic raw SDS archive below root; returns a description (dict) of what was written.
+
+    Station i has sampling rate rates[i % len(rates)] and sample type dtypes[i % len(dtypes)]. Every station-day is
+    generated from its own seed (seed, station, day), so archives are identical from run to run and any part of
+    one can be regenerated alone. Existing day files are overwritten.
+    """
+
+    t1 = UTCDateTime(UTCDateTime(t1).date)
+    ids = station_ids(n_stations, network=network, channel=channel)
+    samples = 0
+    nbytes = 0
+    for i, id in enumerate(ids):
+        net, sta, loc, cha = id.split(".")
+        rate = float(rates[i % len(rates)])
+        dtype = dtypes[i % len(dtypes)]
+        for d in range(days):
+            day = t1 + d * 86400
+            rng = np.random.default_rng([seed, i, d])
+            st, n = synthetic_day(rng, day, sampling_rate=rate, dtype=dtype, gaps=gaps, sentinels=sentinels)
+            for tr in st:
+                tr.stats.network, tr.stats.station, tr.stats.location, tr.stats.channel = net, sta, loc, cha
+            filename = os.path.join(root, sds_syntax.format(year=day.year, net=net, sta=sta, loc=loc, cha=cha,
+                                                            jday=day.julday))
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "wb") as f:
+                for tr in st:
+                    sentinel = tr.data.dtype.kind == "i" and (tr.data == winston_gap).any()
+                    tr.write(f, format="MSEED", encoding="INT32" if sentinel else encodings[dtype], reclen=4096)
+            samples += n
+            nbytes += os.path.getsize(filename)
+
+    return {"root": os.path.abspath(root), "ids": ids, "t1": str(t1), "t2": str(t1 + days * 86400),
+            "stations": n_stations, "days": days, "rates": [float(r) for r in rates], "dtypes": list(dtypes),
+            "gaps": gaps, "sentinels": sentinels, "seed": seed, "samples": samples, "bytes": nbytes}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic raw SDS archive")
+    parser.add_argument("sds", type=str, help="SDS archive to write")
+    parser.add_argument("--stations", type=int, default=4, help="Number of stations (default: 4)")
+    parser.add_argument("--days", type=int, default=1, help="Number of days (default: 1)")
+    parser.add_argument("--t1", type=str, default="2025-01-01", help="First day (default: 2025-01-01)")
+    parser.add_argument("--rates", type=str, default="100", help="Sampling rates, cycled over stations (e.g., 100,50)")
+    parser.add_argument("--dtypes", type=str, default="int32,float32",
+                        help="Sample types, cycled over stations (int32, float32, float64; default: int32,float32)")
+    parser.add_argument("--gaps", type=int, default=1, help="Gaps per station-day (default: 1)")
+    parser.add_argument("--sentinels", type=int, default=1,
+                        help="Runs of Winston gap values per station-day of int32 data (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    info = make_sds(args.sds, n_stations=args.stations, days=args.days, t1=args.t1,
+                    rates=[float(r) for r in args.rates.split(",")], dtypes=args.dtypes.split(","), gaps=args.gaps,
+                    sentinels=args.sentinels, seed=args.seed)
+    print(f"Wrote {info['stations']} stations x {info['days']} days ({info['samples']} samples, "
+          f"{info['bytes'] / 1024 ** 2:.1f} MB) to {info['root']}")
+
+
+if __name__ == "__main__":
+    main()
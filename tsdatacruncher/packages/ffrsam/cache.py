@@ -0,0 +1,131 @@
+import os
+from obspy import UTCDateTime, Stream, read
+
+from tsdatacruncher.utils import metrics
+from tsdatacruncher.utils.tsdata import write_atomic
+
+
+class DayFileCache:
+    """
+    In-process write cache for RSAM day files, keyed by SDS path.
+
+    RSAM Traces from successive processing windows are collected in memory and merged into their day file once,
+    instead of reading, merging and rewriting the whole file for every window. Day files are flushed:
+    - when flush() is called (e.g., at the end of a load chunk)
+    - at a day boundary, i.e., when a Trace for a later day is added, all earlier days are flushed
+    - when the cached samples exceed max_bytes
+    Every flush replaces the day file atomically (see write_atomic) and, if a coverage index (see coverage.py) was
+    given for the file, records the samples of the written file in it. An on_write callback given for the file is
+    called with the written Stream (e.g., to update the aggregate levels, see ffrsam.archive_pyramid). Day files
+    that could not be written are counted in failed (their RSAM is not recorded as covered), as are coverage
+    indexes that could not be saved.
+    Reading and writing day files are timed as stages "read" and "write" of their channel and band (the coverage
+    tree), with counts of files and bytes (see utils.metrics).
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, logger=None):
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.failed = 0  # day files and coverage indexes that could not be written, over every flush
+        self._entries = dict()  # outputfilename -> {"day", "stream", "coverage", "on_write"}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        """Number of bytes of sample data currently cached"""
+        return sum(tr.data.nbytes for entry in self._entries.values() for tr in entry["stream"])
+
+    def add(self, outputfilename, tr, coverage=None, on_write=None):
+        """Caches an RSAM Trace for outputfilename; may flush earlier days or everything (memory budget)"""
+
+        day = UTCDateTime(tr.stats.starttime.date)
+
+        # Processing is chronological, so a new day means every earlier day file is complete
+        for filename in [k for k, v in self._entries.items() if v["day"] < day]:
+            self.flush(filename)
+
+        entry = self._entries.setdefault(outputfilename,
+                                         {"day": day, "stream": Stream(), "coverage": None, "on_write": None})
+        entry["coverage"] = coverage or entry["coverage"]
+        entry["on_write"] = on_write or entry["on_write"]
+        entry["stream"] += tr
+        entry["stream"].merge(method=1, interpolation_samples=0)
+
+        if self.nbytes > self.max_bytes:
+            if self.logger:
+                self.logger.info(f"----Write cache exceeds {self.max_bytes / 1024 ** 2:.0f} MB. Flushing.")
+            self.flush()
+
+    def flush(self, outputfilename=None):
+        """
+        Merges cached Traces into their day files and writes them; flushes every file if outputfilename is None.
+        Returns the number of day files and coverage indexes that could not be written.
+        """
+
+        filenames = list(self._entries) if outputfilename is None else [outputfilename]
+        indexes = []  # coverage indexes to save (once)
+        written = 0
+        failed = 0
+        for filename in filenames:
+            entry = self._entries.pop(filename, None)
+            if entry is None:
+                continue
+
+            ffrsam_st = Stream()
+            station = entry["stream"][0].id if len(entry["stream"]) else ""
+            band = os.path.basename(entry["coverage"].tree) if entry["coverage"] is not None else ""
+
+            # try to load the existing miniseed file - cached data are merged on top of it
+            try:
+                if os.path.exists(filename):
+                    with metrics.timer("read", station=station, band=band):
+                        ffrsam_st += read(filename)
+                    if metrics.enabled():
+                        metrics.count("files_read", station=station, band=band)
+                        metrics.count("bytes_read", os.path.getsize(filename), station=station, band=band)
+                    if self.logger:
+                        self.logger.debug(f"----File loaded: {filename}")
+            except Exception as e:
+                pass
+
+            ffrsam_st += entry["stream"]
+            ffrsam_st.merge(method=1, interpolation_samples=0)
+
+            # Write file
+            try:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                ffrsam_st = ffrsam_st.split()
+                with metrics.timer("write", station=station, band=band):
+                    write_atomic(ffrsam_st, filename)
+                written += 1
+                if metrics.enabled():
+                    metrics.count("files_written", station=station, band=band)
+                    metrics.count("bytes_written", os.path.getsize(filename), station=station, band=band)
+                if self.logger:
+                    self.logger.debug(f"----File saved: {filename}")
+                if entry["coverage"] is not None:
+                    entry["coverage"].add_stream(ffrsam_st)
+                    if entry["coverage"] not in indexes:
+                        indexes.append(entry["coverage"])
+                if entry["on_write"] is not None:
+                    entry["on_write"](ffrsam_st)
+            except Exception as e:
+                failed += 1
+                if self.logger:
+                    self.logger.info(f"----File failed to save ({filename})\n{e}")
+
+        for index in indexes:
+            try:
+                index.save()
+            except Exception as e:
+                failed += 1  # (kept in memory, saved with the next flush)
+                if self.logger:
+                    self.logger.info(f"----Coverage index failed to save ({index.filename})\n{e}")
+
+        # One line per flush of the whole cache (each file is logged at DEBUG)
+        if outputfilename is None and written and self.logger:
+            self.logger.info(f"-- Day files written: {written}")
+        self.failed += failed
+        return failed
@@ -0,0 +1,156 @@
+import io
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from obspy import read
+from obspy.io.mseed.headers import ENCODINGS
+
+from tsdatacruncher.packages.print_stream_info.inventory import sds_filename, scan_file
+from tsdatacruncher.utils.tsdata import tmp_filename
+
+# Bytes before the data of a record written by ObsPy (fixed header, blockette 1000, padding)
+record_header_bytes = 64
+
+
+def day_files(archive):
+    """Yields every SDS day file below archive (all bands and aggregate levels of an SDS_ffrsam archive)"""
+
+    for dirpath, dirnames, filenames in os.walk(archive):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if sds_filename.match(filename):
+                yield os.path.join(dirpath, filename)
+
+
+def _encoding_code(encoding):
+    return next(code for code, values in ENCODINGS.items() if values[0] == encoding)
+
+
+def _record_lengths(npts, itemsize, reclen=4096):
+    """
+    Returns the record lengths that hold a contiguous segment of npts samples: records of reclen bytes, or a single
+    record of the smallest power of two (at least 256 bytes) if the segment fits into one
+    """
+
+    nbytes = record_header_bytes + npts * itemsize
+    if nbytes > reclen:
+        return [reclen] * math.ceil(npts / ((reclen - record_header_bytes) // itemsize))
+    return [max(256, 2 ** math.ceil(math.log2(nbytes)))]
+
+
+def fragmentation(filename, encoding="FLOAT64", reclen=4096):
+    """
+    Describes the layout of a day file from its record headers only (see print_stream_info.inventory.scan_file).
+
+    Returns a dict with the file size, number of records and (encoding, record length) formats, and the estimated
+    number of records and size after compaction (see compact_file). A file needs compaction when it has more
+    records or bytes than that, or records of another encoding.
+    """
+
+    entry = scan_file(filename)
+    itemsize = np.dtype(ENCODINGS[_encoding_code(encoding)][2]).itemsize
+    rate = entry["rate"][0] if entry["rate"] else 1.0
+    lengths = [n for a, b in entry["segments"] for n in _record_lengths(round((b - a) * rate), itemsize, reclen)]
+    size = os.path.getsize(filename)
+    return {"size": size, "records": entry["records"], "segments": len(entry["segments"]),
+            "formats": entry["formats"], "compact_records": len(lengths), "compact_size": sum(lengths),
+            "needs_compaction": (entry["records"] > len(lengths) or size > sum(lengths)
+                                 or set(e for e, _ in entry["formats"]) != {_encoding_code(encoding)})}
+
+
+def _samples(st):
+    """Returns {sample time (ns): value} of every unmasked sample in st and the number of conflicting overlaps"""
+
+    samples = dict()
+    conflicts = 0
+    for tr in st:
+        t0 = tr.stats.starttime.ns
+        step = int(round(tr.stats.delta * 1e9))
+        data = np.ma.getdata(tr.data)
+        valid = ~np.ma.getmaskarray(tr.data)
+        for i in np.flatnonzero(valid):
+            t = t0 + int(i) * step
+            value = data[i]
+            if t in samples and not (samples[t] == value or (np.isnan(samples[t]) and np.isnan(value))):
+                conflicts += 1
+            samples[t] = value
+    return samples, conflicts
+
+
+def compact_file(filename, encoding="FLOAT64", reclen=4096, dry_run=False):
+    """
+    Rewrites an RSAM day file as the minimum number of contiguous Traces, in fully packed records of one encoding.
+
+    Each Trace is written in records of reclen bytes, or in one smaller record if it fits (e.g., short segments
+    between gaps), so files with many gaps do not grow.
+
+    The rewritten file is read back and compared with the original sample for sample (time and value) before it
+    replaces the original (atomically). Files whose Traces overlap with different values, files that are already
+    compact, and files that change on disk while they are compacted (e.g., written by tsdatacruncher) are left
+    alone. Returns the fragmentation report of the file (see fragmentation) with a "status".
+    """
+
+    report = fragmentation(filename, encoding=encoding, reclen=reclen)
+    if dry_run or not report["needs_compaction"]:
+        return dict(report, status="dry run" if dry_run else "compact")
+
+    stat = os.stat(filename)
+    original = read(filename)
+    expected, conflicts = _samples(original)
+    if conflicts:
+        return dict(report, status=f"skipped: {conflicts} conflicting overlapping samples")
+
+    st = original.copy().merge(method=1, interpolation_samples=0).split()
+    dtype = ENCODINGS[_encoding_code(encoding)][2]
+    buffer = io.BytesIO()
+    for tr in st:
+        tr.data = tr.data.astype(dtype)
+        tr.stats.pop("mseed", None)  # drop the encoding and record length read from the file
+        tr.write(buffer, format="MSEED", encoding=encoding,
+                 reclen=_record_lengths(tr.stats.npts, tr.data.itemsize, reclen)[0])
+
+    tmpfilename = tmp_filename(filename)
+    try:
+        with open(tmpfilename, "wb") as f:
+            f.write(buffer.getvalue())
+        written, _ = _samples(read(tmpfilename))
+        if written.keys() != expected.keys() or any(
+                not (written[t] == v or (np.isnan(written[t]) and np.isnan(v))) for t, v in expected.items()):
+            return dict(report, status="skipped: verification failed")
+        now = os.stat(filename)
+        if (now.st_mtime_ns, now.st_size) != (stat.st_mtime_ns, stat.st_size):
+            return dict(report, status="skipped: changed on disk")
+        os.replace(tmpfilename, filename)
+    finally:
+        if os.path.exists(tmpfilename):
+            os.remove(tmpfilename)
+
+    return dict(report, status="compacted", size_after=os.path.getsize(filename))
+
+
+def _compact(args):
+    filename, encoding, reclen, dry_run = args
+    try:
+        return filename, compact_file(filename, encoding=encoding, reclen=reclen, dry_run=dry_run)
+    except Exception as e:
+        return filename, {"status": f"failed: {e}"}
+
+
+def compact_archive(archive, encoding="FLOAT64", reclen=4096, dry_run=False, max_workers=None, logger=None):
+    """
+    Compacts every day file of an SDS_ffrsam archive (see compact_file) in parallel processes.
+
+    Returns {filename: report}. With dry_run, files are only described (from their record headers).
+    """
+
+    files = list(day_files(archive))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        reports = dict(pool.map(_compact, [(f, encoding, reclen, dry_run) for f in files], chunksize=16))
+
+    if logger:
+        for filename, report in reports.items():
+            if report["status"] not in ("compact", "compacted", "dry run"):
+                logger.warning(f"{filename}: {report['status']}")
+    return reports
@@ -0,0 +1,100 @@
+import fcntl
+import json
+import os
+import threading
+
+from tsdatacruncher.packages.ffrsam.npystore import is_npy_archive, get_npy_archive
+from tsdatacruncher.utils.tsdata import write_json_atomic
+from tsdatacruncher.utils.wavecache import merge_intervals, subtract_intervals
+
+# Dictionary to store coverage indexes by file, so long-running processes keep them in memory
+coverage_indexes = {}
+
+
+class CoverageIndex:
+    """
+    Index of the RSAM samples that exist in one SDS output tree (one freq2str directory).
+
+    For every channel (net.sta.loc.cha), coverage.json in the tree holds the time intervals [start, end) of the RSAM
+    samples in its day files, where a sample at time t covers [t, t + delta). The index is updated whenever a day
+    file is written (see DayFileCache) from the whole merged file, so it always describes what is on disk.
+
+    The index is only used to skip work: save() merges the file on disk with the intervals in memory while holding
+    an exclusive lock on coverage.json.lock, so concurrent writers (e.g., worker processes) keep each other's
+    updates. An update that is lost anyway (e.g., storage without locks) only means that those samples are computed
+    again.
+    Archives written before the index existed are recomputed once and indexed from then on.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.filename = os.path.join(tree, "coverage.json")
+        self._lock = threading.Lock()
+        self._mtime = None  # of the file when it was last read
+        self._coverage = self._read()  # id -> [[start, end], ...] (timestamps)
+
+    def _read(self):
+        try:
+            self._mtime = os.stat(self.filename).st_mtime_ns
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def reload(self):
+        """Merges the index on disk into this one if the file changed since it was last read (e.g., by workers)"""
+
+        try:
+            if os.stat(self.filename).st_mtime_ns == self._mtime:
+                return
+        except OSError:
+            return
+        with self._lock:
+            for id, intervals in self._read().items():
+                self._coverage[id] = merge_intervals(self._coverage.get(id, []) + intervals)
+
+    def add(self, id, start, end):
+        """Records RSAM samples of channel id from start (first sample) to end (last sample + delta)"""
+
+        with self._lock:
+            self._coverage[id] = merge_intervals(self._coverage.get(id, []) + [[float(start), float(end)]])
+
+    def add_stream(self, st):
+        """Records the samples of every (gap-free) Trace in st"""
+
+        for tr in st:
+            if tr.stats.npts > 0:
+                self.add(tr.id, tr.stats.starttime.timestamp, tr.stats.endtime.timestamp + tr.stats.delta)
+
+    def missing(self, id, t1, t2):
+        """Returns the intervals [start, end] within t1-t2 (UTCDateTime) without RSAM samples for channel id"""
+
+        with self._lock:
+            intervals = list(self._coverage.get(id, []))
+        return subtract_intervals(t1.timestamp, t2.timestamp, intervals)
+
+    def covers(self, id, t1, t2):
+        return not self.missing(id, t1, t2)
+
+    def save(self):
+        """Merges the index on disk (e.g., updated by another process) with this one and writes it atomically"""
+
+        with self._lock:
+            os.makedirs(self.tree, exist_ok=True)
+            with open(f"{self.filename}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # (released when closed)
+                for id, intervals in self._read().items():
+                    self._coverage[id] = merge_intervals(self._coverage.get(id, []) + intervals)
+                write_json_atomic(self._coverage, self.filename)
+                self._mtime = os.stat(self.filename).st_mtime_ns
+
+
+def get_coverage_index(archive, freq_str):
+    """Returns the CoverageIndex of the SDS tree of band freq_str in archive (created on first use)"""
+
+    if is_npy_archive(archive):
+        return get_npy_archive(archive).coverage(freq_str)  # the arrays are their own index
+    tree = os.path.abspath(os.path.join(archive, freq_str))
+    if tree not in coverage_indexes:
+        coverage_indexes[tree] = CoverageIndex(tree)
+    return coverage_indexes[tree]
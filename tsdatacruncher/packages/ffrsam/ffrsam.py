@@ -1,5 +1,16 @@
 import os
-from obspy import UTCDateTime, Stream, read
+
+import numpy as np
+from obspy import UTCDateTime, Stream, Trace
+
+from tsdatacruncher.packages.ffrsam.cache import DayFileCache
+from tsdatacruncher.packages.ffrsam.coverage import get_coverage_index
+from tsdatacruncher.packages.ffrsam.npystore import is_npy_archive, get_npy_archive
+from tsdatacruncher.packages.ffrsam.pyramid import (pyramid_stats, pyramid_archive, pyramid_levels, choose_level,
+                                                    aggregate)
+from tsdatacruncher.utils import metrics
+from tsdatacruncher.utils.tsdata import write_atomic
+from tsdatacruncher.packages.ffrsam.utils import count_windows, window_rms, window_band_rms, bandpass_sos, sosfilt_into
 
 # https://www.seiscomp.de/seiscomp3/doc/applications/slarchive/SDS.html
 """
@@ -28,11 +39,22 @@ Additional data type flags may be used for extended structure definition.
 ffrsam_syntax = "{freq_str}/{year}/{net}/{sta}/{cha}.{dtype}/{net}.{sta}.{loc}.{cha}.{dtype}.{year}.{jday:03d}"
 freq_none = 0
 
-def rsam(tr, freq=None, period=60, taper_percentage=0.01, fill_value=0):
-    """Computes RSAM on a single Trace; returns another Trace object with correct sample rate"""
+# Working precisions of the low-allocation numeric path (see preprocess)
+precisions = ("float32", "float64")
+
+def preprocess(tr, taper_percentage=0.01, fill_value=0, dtype=None):
+    """
+    Removes Winston gaps, demeans, tapers and merges a single Trace; returns one (float) working Trace.
+
+    With dtype ("float32" or "float64"), the same steps run in place on a single working array of that type (see
+    preprocess_inplace) instead of on ObsPy copies.
+    """
 
     import numpy as np
-    from obspy import Stream, Trace
+    from obspy import Stream
+
+    if dtype:
+        return preprocess_inplace(tr, taper_percentage=taper_percentage, fill_value=fill_value, dtype=dtype)
 
     tmp = Stream(tr.copy().split())  # splits Trace (possibly masked) into Stream of multiple Traces
     for m in range(len(tmp)):
@@ -40,21 +62,144 @@ def rsam(tr, freq=None, period=60, taper_percentage=0.01, fill_value=0):
     tmp.detrend("demean")
     tmp.taper(max_percentage=taper_percentage)
     tmp.merge(fill_value=fill_value)
-    if freq:
-        tmp.filter("bandpass", freqmin=freq[0], freqmax=freq[1])
+    return tmp[0]
+
+def preprocess_inplace(tr, taper_percentage=0.01, fill_value=0, dtype="float32"):
+    """
+    Low-allocation counterpart of preprocess: one working array of dtype, modified in place.
+
+    The samples of tr (not modified) are copied once into the working array. Each contiguous segment (between
+    masked gaps) is demeaned (mean accumulated in float64) and tapered (Hann, as Trace.taper) in place; Winston gaps
+    count as zeros and masked gaps are filled with fill_value, as in preprocess. Leading and trailing gaps are
+    dropped. Returns a Trace that owns the working array.
+    """
+
+    import numpy as np
+    from obspy import Trace
+    from scipy.signal.windows import hann
+
+    data = np.ma.getdata(tr.data)
+    mask = np.ma.getmask(tr.data)
+    i0, i1 = 0, len(data)
+    if mask is not np.ma.nomask:
+        valid = np.flatnonzero(~mask)
+        if len(valid) == 0:
+            raise ValueError("No valid samples")
+        i0, i1 = valid[0], valid[-1] + 1
+        mask = mask[i0:i1]
+        segments = [(s.start, s.stop) for s in np.ma.clump_unmasked(np.ma.masked_array(data[i0:i1], mask=mask))]
+    else:
+        segments = [(0, i1)]
+
+    work = np.array(data[i0:i1], dtype=dtype)  # the only full-size copy
+    if data.dtype.kind == "i":
+        work[data[i0:i1] == -2 ** 31] = 0  # remove Winston gaps, if they exist
+
+    for a, b in segments:
+        segment = work[a:b]
+        segment -= segment.mean(dtype=np.float64)
+        wlen = min(int(taper_percentage * len(segment)), len(segment) // 2)
+        if wlen > 0:
+            sides = hann(2 * wlen if 2 * wlen == len(segment) else 2 * wlen + 1)
+            segment[:wlen] *= sides[:wlen]
+            segment[len(segment) - wlen:] *= sides[len(sides) - wlen:]
+    if mask is not np.ma.nomask:
+        work[mask] = fill_value
+
+    stats = tr.stats.copy()
+    stats.starttime = tr.stats.starttime + i0 * tr.stats.delta
+    stats.npts = len(work)
+    return Trace(data=work, header=stats)
+
+def band_rsam(tmp, freq=None, period=60, out=None):
+    """
+    Computes RSAM for one frequency band from a preprocessed Trace (see preprocess); tmp is not modified.
+
+    With out (a float array of tmp.stats.npts samples, e.g., reused for every band), the band is filtered into out,
+    which is then squared in place (see utils.sosfilt_into and utils.window_rms), so no full-size arrays are
+    allocated. Filtering and RMS are timed as stages "filter" and "rms" (see utils.metrics).
+    """
+
+    from obspy import Trace
+    from scipy.signal import sosfilt
+
+    data = tmp.data
+    samples_per_window = int(round(period * tmp.stats.sampling_rate))
+    station, band = tmp.id, freq2str(freq)
+    if out is not None:
+        with metrics.timer("filter", station=station, band=band):
+            if freq:
+                sosfilt_into(bandpass_sos(tmp.stats.sampling_rate, freq[0], freq[1]), data, out)
+            else:
+                out[:] = data
+        with metrics.timer("rms", station=station, band=band):
+            rsam = window_rms(out, samples_per_window, overwrite=True)
+    else:
+        if freq:
+            with metrics.timer("filter", station=station, band=band):
+                data = sosfilt(bandpass_sos(tmp.stats.sampling_rate, freq[0], freq[1]), data)  # the only band copy
 
-    rsam = []
-    for st_window in tmp.slide(window_length=period, step=period):
-        y = [np.sqrt(np.mean(np.square(tr.data))) for tr in st_window]
-        rsam.append(y[0])
-    rsam = np.array(rsam)
+        # one RMS value per period, computed on the whole sample array at once (see utils.window_rms)
+        with metrics.timer("rms", station=station, band=band):
+            rsam = window_rms(data, samples_per_window)
 
-    stats = tmp[0].stats
+    stats = tmp.stats.copy()
     stats["delta"] = period
     stats["npts"] = len(rsam)
     a = Trace(data=rsam, header=stats)
     return a
 
+def rsam(tr, freq=None, period=60, taper_percentage=0.01, fill_value=0, dtype=None):
+    """Computes RSAM on a single Trace; returns another Trace object with correct sample rate"""
+
+    tmp = preprocess(tr, taper_percentage=taper_percentage, fill_value=fill_value, dtype=dtype)
+    return band_rsam(tmp, freq=freq, period=period, out=tmp.data if dtype else None)
+
+def rsam_bank(tr, freq=[None], period=60, taper_percentage=0.01, fill_value=0, dtype=None):
+    """
+    Computes RSAM for every frequency band from a single preprocessing pass; yields (band, Trace) pairs.
+
+    The Trace is demeaned, tapered and merged once. Each band is then filtered with a cached filter design
+    (see utils.bandpass_sos) and reduced to RSAM before the next band is started, so at most one working copy and
+    one filtered band are in memory at a time. With dtype, both are arrays of that type and the band array is
+    reused for every band.
+    """
+
+    tmp = preprocess(tr, taper_percentage=taper_percentage, fill_value=fill_value, dtype=dtype)
+    out = np.empty_like(tmp.data) if dtype else None
+    for f in freq:
+        yield f, band_rsam(tmp, freq=f, period=period, out=out)
+
+def spectral_band_rsam(tmp, freq=[None], period=60):
+    """
+    Computes RSAM for every frequency band from one FFT per period of a preprocessed Trace (see preprocess).
+
+    Instead of filtering once per band, each period is transformed once and its power spectrum is integrated over
+    every band (see utils.window_band_rms). The unfiltered band (None) is the RMS of the samples themselves, as in
+    band_rsam (see utils.window_rms), so it is identical in both modes. Returns a list of Traces in the same order
+    as freq.
+    """
+
+    from obspy import Trace
+
+    samples_per_window = int(round(period * tmp.stats.sampling_rate))
+    rms = iter(window_band_rms(tmp.data, samples_per_window, tmp.stats.sampling_rate, bands=[f for f in freq if f]))
+
+    traces = []
+    for f in freq:
+        rsam = next(rms) if f else window_rms(tmp.data, samples_per_window)
+        stats = tmp.stats.copy()
+        stats["delta"] = period
+        stats["npts"] = len(rsam)
+        traces.append(Trace(data=rsam, header=stats))
+    return traces
+
+def spectral_rsam_bank(tr, freq=[None], period=60, taper_percentage=0.01, fill_value=0, dtype=None):
+    """Spectral counterpart of rsam_bank: one preprocessing pass, one FFT per period; yields (band, Trace) pairs"""
+
+    tmp = preprocess(tr, taper_percentage=taper_percentage, fill_value=fill_value, dtype=dtype)
+    yield from zip(freq, spectral_band_rsam(tmp, freq=freq, period=period))
+
 def freq2str(freq):
     if freq is None:
         f1 = 0
@@ -64,67 +209,190 @@ def freq2str(freq):
         f2 = int(freq[1] * 100)
     return "{:04d}-{:04d}".format(f1, f2)
 
+def ffrsam_path(tr, freq_str, archive="./", syntax=ffrsam_syntax):
+    """Returns the SDS day file for the RSAM of Trace tr (day of its starttime) in frequency band freq_str"""
+
+    sds_syntax = syntax.format(freq_str=freq_str, year=tr.stats.starttime.year,
+                               net=tr.stats.network, sta=tr.stats.station, loc=tr.stats.location,
+                               cha=tr.stats.channel,
+                               dtype='D', jday=tr.stats.starttime.julday)
+    return os.path.join(archive, sds_syntax)
+
 def archive_ffrsam(st, freq=None, period=60, taper_percentage=0.01, fill_value=0,
-                   archive="./", syntax=ffrsam_syntax,
-                   logger=None):
+                   archive="./", syntax=ffrsam_syntax, mode="filter", cache=None, overwrite=True,
+                   pyramid=None, precision=None, origin=None, logger=None):
+    """
+    Computes RSAM for every trace and frequency band and merges it into the SDS archive.
+
+    With an origin (UTCDateTime), RSAM samples start on origin + k * period: traces that start between two of these
+    times are trimmed to the next one, so that windows whose data start late stay on the grid of the others.
+
+    mode "filter" bandpass filters the data once per band (IIR Butterworth, like Trace.filter). mode "spectral"
+    integrates one FFT per period over all bands at once (see spectral_band_rsam). Both write the same
+    freq2str-named SDS trees.
+
+    Without a cache, each day file is read, merged and rewritten for every call. With a DayFileCache (see cache.py),
+    RSAM is collected in memory and day files are written when the cache is flushed.
+
+    Every SDS tree (archive/freq_str) keeps a coverage index of the RSAM samples it holds (see coverage.py). Unless
+    overwrite is True, traces whose RSAM samples are already in every tree are skipped.
+
+    pyramid is a list of coarser levels (seconds per sample, e.g., [600, 3600, 86400]) that are updated from every
+    day file that is written (see archive_pyramid).
+
+    precision ("float32" or "float64") selects the low-allocation numeric path: each trace is preprocessed in place
+    in one working array of that type, and every band is filtered into one reused array (see preprocess_inplace
+    and band_rsam). None uses ObsPy's float64 copies.
+
+    An archive "npy:///path" stores RSAM in memory-mapped fixed-grid arrays instead (see npystore.py): samples are
+    written in place, and neither the cache nor the pyramid are used.
+
+    Progress per channel and band is logged at DEBUG; failures at INFO. Returns counts for a summary: channels
+    processed, RSAM traces computed (channels x bands), channels already archived, and failures (preprocessing,
+    RSAM, and day files that could not be written without a cache; with a cache, see DayFileCache.failed).
+    """
+
+    if mode not in ("filter", "spectral"):
+        raise ValueError(f"Unrecognized processing mode: {mode}")
+    if precision is not None and precision not in precisions:
+        raise ValueError(f"Unrecognized precision: {precision}")
+
+    day_files = cache if cache is not None else DayFileCache(logger=logger)
+    store = get_npy_archive(archive, period=period) if is_npy_archive(archive) else None
 
     st = st.merge()  # combine by station id
+    indexes = {freq2str(f): get_coverage_index(archive, freq2str(f)) for f in freq}
+    counts = {"channels": 0, "computed": 0, "archived": 0, "failed": 0}
 
     # loop over streams available
     for tr in st:
+
+        # Start on the RSAM grid of the origin (within one sample, e.g., timing jitter)
+        if origin is not None:
+            offset = (tr.stats.starttime - origin) % period
+            if tr.stats.delta < offset < period - tr.stats.delta:
+                tr = tr.slice(tr.stats.starttime + period - offset)
+                if tr.stats.npts == 0:
+                    continue
+
+        # Skip traces whose RSAM samples are all archived already
+        if not overwrite:
+            n = count_windows(tr.stats.npts, int(round(period * tr.stats.sampling_rate)))
+            t_end = tr.stats.starttime + n * period  # end of the last RSAM sample
+            if n > 0 and all(index.covers(tr.id, tr.stats.starttime, t_end) for index in indexes.values()):
+                counts["archived"] += 1
+                if logger:
+                    logger.debug(f"--Already archived: {tr.id}")
+                continue
+
+        counts["channels"] += 1
         if logger:
-            logger.info(f"--Processing station: {tr.id}")
+            logger.debug(f"--Processing station: {tr.id}")
+
+        # Preprocess once (Winston gaps, demean, taper, merge); every band below is filtered from this working copy
+        try:
+            with metrics.timer("preprocess", station=tr.id):
+                tmp = preprocess(tr, taper_percentage=taper_percentage, fill_value=fill_value, dtype=precision)
+            out = np.empty_like(tmp.data) if precision and mode == "filter" else None  # reused for every band
+            if mode == "spectral":
+                with metrics.timer("spectral", station=tr.id):
+                    spectral = dict(zip([freq2str(f) for f in freq],
+                                        spectral_band_rsam(tmp, freq=freq, period=period)))
+        except Exception as e:
+            counts["failed"] += 1
+            if logger:
+                logger.info(f"---Preprocessing failed, RSAM NOT computed ({tr.id}): {e}")
+            continue
 
         # Loop over frequency bands
         for f in freq:
             if logger:
-                logger.info(f"---Processing frequency band: {f}")
+                logger.debug(f"---Processing frequency band: {f}")
 
             freq_str = freq2str(f)
 
             # Define outfile and make directories, if necessary
-            sds_syntax = syntax.format(freq_str=freq_str, year=tr.stats.starttime.year,
-                                    net=tr.stats.network, sta=tr.stats.station, loc=tr.stats.location,
-                                    cha=tr.stats.channel,
-                                    dtype='D', jday=tr.stats.starttime.julday)
-            fullpath = os.path.join(archive, os.path.dirname(sds_syntax))  # final directory in the SDS filestructure
-            outputfilename = os.path.join(archive, sds_syntax)
-            os.makedirs(fullpath, exist_ok=True)
-
-            ffrsam_st = Stream()
-
-            # try to load the existing miniseed file - append to existing Stream ffrsam_st
-            try:
-                existing_stream = read(outputfilename)
-                ffrsam_st += existing_stream
-                if logger:
-                    logger.info(f"----File loaded: {outputfilename}")
-            except Exception as e:
-                pass
+            if store is None:
+                outputfilename = ffrsam_path(tr, freq_str, archive=archive, syntax=syntax)
+                os.makedirs(os.path.dirname(outputfilename), exist_ok=True)  # final directory in the SDS filestructure
 
             # compute ffrsam - try
             try:
-                ffrsam_st += rsam(tr, freq=f, period=period, taper_percentage=taper_percentage,
-                                  fill_value=fill_value)
+                if mode == "spectral":
+                    rsam_tr = spectral[freq_str]
+                else:
+                    rsam_tr = band_rsam(tmp, freq=f, period=period, out=out)
+                counts["computed"] += 1
                 if logger:
-                    logger.info(f"----RSAM computed.")
+                    logger.debug(f"----RSAM computed.")
             except Exception as e:
+                counts["failed"] += 1
                 if logger:
-                    logger.info(f"----RSAM NOT computed: {e}")
+                    logger.info(f"----RSAM NOT computed ({tr.id}, {freq_str}): {e}")
+                continue
 
-            # merge ffrsam_st
-            ffrsam_st.merge(method=1, interpolation_samples=0)
+            # fixed-grid archive - write in place
+            if store is not None:
+                with metrics.timer("write", station=tr.id, band=freq_str):
+                    store.write(rsam_tr, freq_str)
+                continue
+
+            # merge into the day file - right away, or later when the write cache is flushed
+            day_files.add(outputfilename, rsam_tr, coverage=indexes[freq_str],
+                          on_write=pyramid_writer(freq_str, archive=archive, levels=pyramid, syntax=syntax,
+                                                  logger=logger))
+            if cache is None:
+                counts["failed"] += day_files.flush(outputfilename)
+
+    if store is not None:
+        store.flush()
+    return counts
+
+def archive_pyramid(st, freq_str, archive="./", levels=(600, 3600, 86400), syntax=ffrsam_syntax, logger=None):
+    """
+    Recomputes the aggregate levels of one RSAM day file and writes them to the pyramid archives.
+
+    st holds all samples of the day file. Every level divides a day, so each of its bins lies within that day and the
+    whole day is recomputed from st; late or corrected samples simply replace the affected bins.
+    Levels are stored as sibling SDS trees: <archive>/<seconds>/<stat>/<freq_str>/... (see pyramid.py).
+    """
+
+    with metrics.timer("pyramid", station=st[0].id if len(st) else "", band=freq_str):
+        for seconds in levels:
+            for stat in pyramid_stats:
+                try:
+                    agg = aggregate(st, seconds, stat)
+                    if len(agg) == 0:
+                        continue
+                    outputfilename = ffrsam_path(agg[0], freq_str, archive=pyramid_archive(archive, seconds, stat),
+                                                 syntax=syntax)
+                    os.makedirs(os.path.dirname(outputfilename), exist_ok=True)
+                    write_atomic(agg, outputfilename)
+                except Exception as e:
+                    if logger:
+                        logger.info(f"----Pyramid level {seconds} s ({stat}) failed to save: {e}")
 
-            # Write file
-            try:
-                ffrsam_st.split().write(outputfilename, format='MSEED')
-                if logger:
-                    logger.info(f"----File saved: {outputfilename}")
-            except Exception as e:
-                if logger:
-                    logger.info(f"----File failed to save ({outputfilename})\n{e}")
 
-def get_ffrsam(sds, station_id, t1, t2, period=60, freq=None):
+def pyramid_writer(freq_str, archive="./", levels=None, syntax=ffrsam_syntax, logger=None):
+    """Returns a DayFileCache on_write callback that updates the pyramid levels, or None if there are none"""
+
+    if not levels:
+        return None
+    return lambda st: archive_pyramid(st, freq_str, archive=archive, levels=levels, syntax=syntax, logger=logger)
+
+
+def get_ffrsam(sds, station_id, t1, t2, period=60, freq=None, resolution=None, max_points=None, stat="mean",
+               inventory=None):
+    """
+    Reads RSAM for station_id (list of net.sta.loc.cha) and frequency bands freq; returns {freq_str: Stream}.
+
+    By default, the base archive (one sample per period) is read. With resolution (seconds) or max_points (per
+    channel), the coarsest pyramid level that meets it is read instead (see pyramid.choose_level), using the
+    aggregate stat ("mean", "max" or "rms"). Levels that were never built are not considered.
+
+    With an inventory (print_stream_info.inventory.SDSInventory of sds or a parent directory), channels without
+    data in t1-t2 are skipped without opening any files.
+    """
     from obspy.clients.filesystem.sds import Client
 
     t1 = UTCDateTime(t1)
@@ -132,14 +400,37 @@ def get_ffrsam(sds, station_id, t1, t2, period=60, freq=None):
 
     data = dict()
 
+    if is_npy_archive(sds):
+        from tsdatacruncher.packages.ffrsam.query import get_ffrsam_array
+
+        times, values, columns = get_ffrsam_array(sds, station_id, t1, t2, period=period, freq=freq,
+                                                  resolution=resolution, max_points=max_points, stat=stat)
+        delta = (times[1] - times[0]) / np.timedelta64(1, "s") if len(times) > 1 else period
+        for j, (id, fstr) in enumerate(columns):
+            net, sta, loc, cha = id.split(".")
+            tr = Trace(data=np.ma.masked_invalid(values[:, j]),
+                       header=dict(network=net, station=sta, location=loc.replace("--", ""), channel=cha,
+                                   starttime=UTCDateTime(str(times[0])) if len(times) else t1, delta=delta))
+            data.setdefault(fstr, Stream())
+            data[fstr] += tr.split() if np.isfinite(values[:, j]).any() else Stream()
+        return data
+
+    seconds = choose_level(pyramid_levels(sds, stat), t1, t2, period=period, resolution=resolution,
+                           max_points=max_points)
+
     for f in freq:
         fstr = freq2str(f)
-        # freqsds = os.path.join(sds, str(period), fstr)
-        freqsds = os.path.join(sds, fstr)
+        if seconds == period:
+            freqsds = os.path.join(sds, fstr)
+        else:
+            freqsds = os.path.join(pyramid_archive(sds, seconds, stat), fstr)
         client = Client(freqsds)
+        tree = os.path.relpath(os.path.abspath(freqsds), inventory.root) if inventory is not None else None
 
         st = Stream()
         for id  in station_id:
+            if inventory is not None and not inventory.has_data(id, t1, t2, tree=tree):
+                continue
             net, sta, loc, cha = id.split(".")
             st += client.get_waveforms(net, sta, loc, cha, t1, t2)
 
@@ -0,0 +1,241 @@
+import os
+import threading
+import warnings
+
+import numpy as np
+from obspy import UTCDateTime, Stream, Trace
+
+from tsdatacruncher.utils.tsdata import tmp_filename
+from tsdatacruncher.utils.wavecache import merge_intervals
+
+# <root>/<freq_str>/Year/NET/STA/CHAN.TYPE/NET.STA.LOC.CHAN.TYPE.YEAR.npy
+npy_syntax = "{freq_str}/{year}/{net}/{sta}/{cha}.D/{net}.{sta}.{loc}.{cha}.D.{year}.npy"
+
+# Dictionary to store open archives by root directory, so memory maps are reused across calls
+npy_archives = {}
+
+
+def is_npy_archive(archive):
+    return str(archive).startswith("npy://")
+
+
+def get_npy_archive(archive, period=60):
+    """Returns the NpyArchive for an archive string (npy:///path/to/archive), reusing open ones"""
+
+    root = os.path.abspath(os.path.expanduser(str(archive)[len("npy://"):]))
+    if (root, period) not in npy_archives:
+        npy_archives[(root, period)] = NpyArchive(root, period=period)
+    return npy_archives[(root, period)]
+
+
+class NpyArchive:
+    """
+    RSAM storage as fixed-grid arrays: one float64 array per channel, band and year, memory-mapped from a .npy file.
+
+    Sample i of a year file is the RSAM sample at Jan 1 + i * period, so a year holds 366 days of samples whatever its
+    length. Files are created (NaN-initialized, i.e., no data) when first written. Writes are in-place slice
+    assignments and reads are slices of the memory map, without decoding or merging. Samples off the grid are placed
+    at the nearest grid time. Open memory maps are kept and reused.
+
+    Different processes can write different channels (files) at the same time. Concurrent writers of the same file
+    need a file system with coherent memory maps (i.e., not NFS).
+    """
+
+    def __init__(self, root, period=60):
+        self.root = root
+        self.period = period
+        self.npts = int(round(366 * 86400 / period))  # samples per year file
+        self._maps = dict()  # (path, writable) -> memmap
+        self._lock = threading.Lock()
+
+    def path(self, id, freq_str, year):
+        net, sta, loc, cha = id.split(".")
+        return os.path.join(self.root, npy_syntax.format(freq_str=freq_str, year=year, net=net, sta=sta,
+                                                         loc=loc.replace("--", ""), cha=cha))
+
+    def _open(self, path, write=False):
+        """Returns the memory map of path (None if it does not exist and write is False)"""
+
+        with self._lock:
+            if (path, write) in self._maps:
+                return self._maps[(path, write)]
+            if not os.path.exists(path):
+                if not write:
+                    return None
+                # Create the NaN-filled file under a temporary name; link it into place unless another process won
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmppath = tmp_filename(path)
+                arr = np.lib.format.open_memmap(tmppath, mode="w+", dtype=np.float64, shape=(self.npts,))
+                arr[:] = np.nan
+                arr.flush()
+                del arr
+                try:
+                    os.link(tmppath, path)
+                except FileExistsError:
+                    pass
+                os.remove(tmppath)
+            self._maps[(path, write)] = np.load(path, mmap_mode="r+" if write else "r")
+            return self._maps[(path, write)]
+
+    def _years(self, t1, t2):
+        """Yields (year, index of t1, index of t2 + 1) for every year file spanned by t1-t2 (grid indexes)"""
+
+        for year in range(t1.year, t2.year + 1):
+            year_start = UTCDateTime(year, 1, 1).timestamp
+            a = max(0, int(np.ceil((t1.timestamp - year_start) / self.period - 1e-9)))
+            b = min(self.npts, int(np.floor((t2.timestamp - year_start) / self.period + 1e-9)) + 1)
+            if a < b:
+                yield year, a, b
+
+    def write(self, tr, freq_str):
+        """Writes the samples of an RSAM Trace (masked samples are not written)"""
+
+        data = np.ma.getdata(tr.data).astype(np.float64)
+        mask = np.ma.getmaskarray(tr.data)
+        t0 = tr.stats.starttime.timestamp
+        for year in range(tr.stats.starttime.year, tr.stats.endtime.year + 1):
+            i0 = int(round((t0 - UTCDateTime(year, 1, 1).timestamp) / self.period))
+            a, b = max(0, i0), min(self.npts, i0 + len(data))
+            if a >= b:
+                continue
+            arr = self._open(self.path(tr.id, freq_str, year), write=True)
+            valid = ~mask[a - i0:b - i0]
+            if valid.all():
+                arr[a:b] = data[a - i0:b - i0]
+            else:
+                arr[a:b][valid] = data[a - i0:b - i0][valid]
+
+    def read(self, id, freq_str, t1, t2):
+        """
+        Returns (start timestamp, samples) on the grid from the first grid time at or after t1 up to t2.
+
+        Within one year file the samples are a read-only view of the memory map; missing samples are NaN.
+        """
+
+        t1 = UTCDateTime(t1)
+        t2 = UTCDateTime(t2)
+        parts = []
+        start = None
+        for year, a, b in self._years(t1, t2):
+            if start is None:
+                start = UTCDateTime(year, 1, 1).timestamp + a * self.period
+            arr = self._open(self.path(id, freq_str, year))
+            parts.append(np.full(b - a, np.nan) if arr is None else arr[a:b])
+        if not parts:
+            return t1.timestamp, np.zeros(0)
+        return start, parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def flush(self):
+        """Flushes all writable memory maps to disk"""
+
+        with self._lock:
+            for (path, write), arr in self._maps.items():
+                if write:
+                    arr.flush()
+
+    def files(self):
+        """Yields (freq_str, id, year, path) for every file in the archive"""
+
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in sorted(filenames):
+                if not filename.endswith(".npy"):
+                    continue
+                net, sta, loc, cha, dtype, year, ext = filename.split(".")
+                freq_str = os.path.relpath(dirpath, self.root).split(os.sep)[0]
+                yield freq_str, f"{net}.{sta}.{loc}.{cha}", int(year), os.path.join(dirpath, filename)
+
+    def to_stream(self, id, freq_str, t1, t2):
+        """Returns the samples of id between t1 and t2 as a Stream of gap-free RSAM Traces"""
+
+        start, values = self.read(id, freq_str, t1, t2)
+        if not np.isfinite(values).any():
+            return Stream()
+        net, sta, loc, cha = id.split(".")
+        tr = Trace(data=np.ma.masked_invalid(np.array(values)),
+                   header=dict(network=net, station=sta, location=loc.replace("--", ""), channel=cha,
+                               starttime=UTCDateTime(start), delta=self.period))
+        return tr.split()
+
+    def coverage(self, freq_str):
+        return NpyCoverage(self, freq_str)
+
+
+class NpyCoverage:
+    """Coverage index (same interface as coverage.CoverageIndex) of one band of an NpyArchive, read from the arrays"""
+
+    def __init__(self, archive, freq_str):
+        self.archive = archive
+        self.freq_str = freq_str
+
+    def missing(self, id, t1, t2):
+        """Returns the intervals [start, end] within t1-t2 without RSAM samples for channel id"""
+
+        t1 = UTCDateTime(t1)
+        t2 = UTCDateTime(t2)
+        start, values = self.archive.read(id, self.freq_str, t1, t2 - self.archive.period)
+        nan = np.isnan(values)
+        if not nan.any():
+            return []
+        # Runs of missing samples, each covering [t, t + period)
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], nan.astype(np.int8), [0]])))
+        missing = [[start + a * self.archive.period, start + b * self.archive.period]
+                   for a, b in zip(edges[::2], edges[1::2])]
+        return merge_intervals([[max(a, t1.timestamp), min(b, t2.timestamp)] for a, b in missing])
+
+    def covers(self, id, t1, t2):
+        return not self.missing(id, t1, t2)
+
+    def add_stream(self, st):
+        pass  # the arrays are the index
+
+    def save(self):
+        pass
+
+    def reload(self):
+        pass
+
+
+def aggregate_grid(values, factor, stat="mean"):
+    """Aggregates a fixed-grid array over consecutive bins of factor samples (NaN samples ignored)"""
+
+    n = len(values) // factor * factor
+    bins = np.asarray(values[:n]).reshape(-1, factor)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN bins
+        if stat == "mean":
+            return np.nanmean(bins, axis=1)
+        elif stat == "max":
+            return np.nanmax(bins, axis=1)
+        elif stat == "rms":
+            return np.sqrt(np.nanmean(bins ** 2, axis=1))
+    raise ValueError(f"Unrecognized statistic: {stat}")
+
+
+def export_sds(archive, sds, t1=None, t2=None, freq_str=None, pyramid=None, logger=None):
+    """
+    Exports an NpyArchive to the SDS MiniSEED layout of archive_ffrsam (merged into existing day files).
+
+    Exports the whole archive, or only t1-t2 and/or one band (freq_str). Coverage indexes and aggregate levels
+    (pyramid) of the SDS archive are updated as for processed data.
+    """
+
+    from tsdatacruncher.packages.ffrsam.cache import DayFileCache
+    from tsdatacruncher.packages.ffrsam.coverage import get_coverage_index
+    from tsdatacruncher.packages.ffrsam.ffrsam import ffrsam_path, pyramid_writer
+
+    store = archive if isinstance(archive, NpyArchive) else get_npy_archive(archive)
+    day_files = DayFileCache(logger=logger)
+    for fstr, id, year, path in store.files():
+        if freq_str is not None and fstr != freq_str:
+            continue
+        a = max(UTCDateTime(year, 1, 1), UTCDateTime(t1) if t1 else UTCDateTime(year, 1, 1))
+        b = min(UTCDateTime(year + 1, 1, 1) - store.period, UTCDateTime(t2) if t2 else UTCDateTime(year + 1, 1, 1))
+        day = UTCDateTime(a.date)
+        while day <= b:
+            for tr in store.to_stream(id, fstr, max(a, day), min(b, day + 86400 - store.period)):
+                day_files.add(ffrsam_path(tr, fstr, archive=sds), tr, coverage=get_coverage_index(sds, fstr),
+                              on_write=pyramid_writer(fstr, archive=sds, levels=pyramid, logger=logger))
+            day += 86400
+        day_files.flush()
+        if logger:
+            logger.info(f"Exported {path}")
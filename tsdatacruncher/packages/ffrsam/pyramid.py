@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+from obspy import UTCDateTime, Stream, Trace
+
+# Aggregates stored for every level: mean, maximum and RMS-combined (sqrt of the mean square) RSAM per bin
+pyramid_stats = ("mean", "max", "rms")
+
+
+def pyramid_archive(archive, seconds, stat):
+    """Returns the archive directory of a pyramid level (seconds per sample) and statistic"""
+    return os.path.join(archive, str(int(seconds)), stat)
+
+
+def pyramid_levels(archive, stat="mean"):
+    """Returns the pyramid levels (seconds per sample) that exist in archive for stat, finest first"""
+
+    try:
+        names = os.listdir(archive)
+    except OSError:
+        return []
+    return sorted(int(name) for name in names
+                  if name.isdigit() and os.path.isdir(pyramid_archive(archive, name, stat)))
+
+
+def choose_level(levels, t1, t2, period=60, resolution=None, max_points=None):
+    """
+    Picks the level (seconds per sample) to read t1-t2 from; period is the resolution of the base archive.
+
+    With resolution (seconds), the coarsest level that is at least as fine as resolution. With max_points, the
+    finest level that returns at most max_points samples per channel (the coarsest level if none does).
+    Without either, the base period.
+    """
+
+    levels = sorted(set([period] + list(levels)))
+    if resolution is not None:
+        return max([s for s in levels if s <= resolution] or [period])
+    if max_points is not None:
+        return min([s for s in levels if (t2 - t1) / s <= max_points] or [levels[-1]])
+    return period
+
+
+def aggregate(st, seconds, stat="mean"):
+    """
+    Aggregates RSAM samples into bins of 'seconds' (aligned to multiples of seconds since 1970).
+
+    Bins hold the mean, max or RMS (stat) of the samples that fall into them; bins without samples are gaps.
+    Returns a Stream of gap-free Traces at one sample per bin.
+    """
+
+    out = Stream()
+    for id in sorted(set(tr.id for tr in st)):
+        traces = [tr for tr in st.select(id=id) if tr.stats.npts > 0]
+        if not traces:
+            continue
+        times = np.concatenate([tr.stats.starttime.timestamp + np.arange(tr.stats.npts) * tr.stats.delta
+                                for tr in traces])
+        values = np.ma.concatenate([np.ma.asarray(tr.data, dtype=np.float64) for tr in traces])
+        valid = ~np.ma.getmaskarray(values)
+        times, values = times[valid], np.ma.getdata(values)[valid]
+        if len(values) == 0:
+            continue
+
+        order = np.argsort(times, kind="stable")
+        bins = np.floor(times[order] / seconds + 1e-9).astype(np.int64)
+        values = values[order]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(bins)) + 1])
+        counts = np.diff(np.concatenate([starts, [len(values)]]))
+        if stat == "mean":
+            result = np.add.reduceat(values, starts) / counts
+        elif stat == "max":
+            result = np.maximum.reduceat(values, starts)
+        elif stat == "rms":
+            result = np.sqrt(np.add.reduceat(values ** 2, starts) / counts)
+        else:
+            raise ValueError(f"Unrecognized statistic: {stat}")
+
+        # One sample per bin from the first to the last bin; empty bins are masked, then split into gap-free Traces
+        first = bins[starts[0]]
+        data = np.ma.masked_all(bins[-1] - first + 1, dtype=np.float64)
+        data[bins[starts] - first] = result
+        header = traces[0].stats.copy()
+        header.starttime = UTCDateTime(first * seconds)
+        header.delta = seconds
+        header.pop("mseed", None)
+        header.pop("processing", None)
+        out += Trace(data=data, header=header).split()
+    return out
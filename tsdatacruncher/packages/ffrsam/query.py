@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from obspy import UTCDateTime, read
+
+from tsdatacruncher.packages.ffrsam.ffrsam import ffrsam_syntax, freq2str
+from tsdatacruncher.packages.ffrsam.npystore import is_npy_archive, get_npy_archive, aggregate_grid
+from tsdatacruncher.packages.ffrsam.pyramid import pyramid_archive, pyramid_levels, choose_level
+
+# Levels computed on the fly for fixed-grid (npy://) archives
+npy_levels = (600, 3600, 86400)
+
+# Decoded day files, reused across queries while the file on disk is unchanged (path -> ((mtime, size), segments))
+day_files = OrderedDict()
+day_files_lock = threading.Lock()
+max_day_files = 4096  # ~50 MB of 1-minute RSAM
+
+
+def read_day(filename):
+    """
+    Returns the gap-free segments of an RSAM day file as a list of (start timestamp, data) pairs.
+
+    Decoded files are kept in memory (least recently used first out, see max_day_files) and reused as long as the
+    file's modification time and size are unchanged. Missing files have no segments.
+    """
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return []
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with day_files_lock:
+        cached = day_files.get(filename)
+        if cached is not None and cached[0] == key:
+            day_files.move_to_end(filename)
+            return cached[1]
+
+    segments = [(tr.stats.starttime.timestamp, np.asarray(tr.data, dtype=np.float64))
+                for tr in read(filename, format="MSEED")]
+
+    with day_files_lock:
+        day_files[filename] = (key, segments)
+        day_files.move_to_end(filename)
+        while len(day_files) > max_day_files:
+            day_files.popitem(last=False)
+    return segments
+
+
+def get_ffrsam_array(sds, station_id, t1, t2, period=60, freq=[None], resolution=None, max_points=None,
+                     stat="mean", syntax=ffrsam_syntax, max_workers=8):
+    """
+    Reads RSAM for many stations and bands at once onto a single, regular time grid.
+
+    Day files are read directly (no SDS Client or Stream merge) and concurrently, one task per station and band,
+    and samples are placed on the grid by time; missing samples are NaN. The level (base period or an aggregate
+    level) is chosen as in get_ffrsam (resolution, max_points, stat). For fixed-grid archives (npy://, see
+    npystore.py), samples are sliced from the memory-mapped arrays, and the levels in npy_levels are aggregated on
+    the fly.
+
+    Returns:
+        times: datetime64[ns] array of the n grid times (multiples of the level's sample interval within t1-t2)
+        data: float64 array of shape (n, len(columns))
+        columns: list of (station id, freq_str), stations varying fastest
+    """
+
+    t1 = UTCDateTime(t1)
+    t2 = UTCDateTime(t2)
+    store = get_npy_archive(sds, period=period) if is_npy_archive(sds) else None
+    levels = npy_levels if store is not None else pyramid_levels(sds, stat)
+    seconds = choose_level(levels, t1, t2, period=period, resolution=resolution, max_points=max_points)
+    base = sds if seconds == period else pyramid_archive(sds, seconds, stat)
+
+    start = np.ceil(t1.timestamp / seconds - 1e-9) * seconds
+    n = max(0, int(np.floor((t2.timestamp - start) / seconds + 1e-9)) + 1)
+    times = (np.int64(round(start * 1e9)) + np.arange(n, dtype=np.int64) * int(round(seconds * 1e9)))
+    times = times.astype("datetime64[ns]")
+
+    columns = [(id, freq2str(f)) for f in freq for id in station_id]
+    data = np.full((n, len(columns)), np.nan)
+
+    days = []
+    day = UTCDateTime(t1.date)
+    while day <= t2:
+        days.append(day)
+        day += 86400
+
+    def fill_npy(j):
+        id, freq_str = columns[j]
+        factor = int(round(seconds / period))
+        _, values = store.read(id, freq_str, UTCDateTime(start), UTCDateTime(start + (n * factor - 1) * period))
+        data[:len(values) // factor, j] = values if factor == 1 else aggregate_grid(values, factor, stat)
+
+    def fill(j):
+        id, freq_str = columns[j]
+        net, sta, loc, cha = id.split(".")
+        for day in days:
+            filename = os.path.join(base, syntax.format(freq_str=freq_str, year=day.year, net=net, sta=sta,
+                                                        loc=loc.replace("--", ""), cha=cha, dtype="D",
+                                                        jday=day.julday))
+            for seg_start, values in read_day(filename):
+                i0 = int(round((seg_start - start) / seconds))
+                a, b = max(0, i0), min(n, i0 + len(values))
+                if a < b:
+                    data[a:b, j] = values[a - i0:b - i0]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        list(pool.map(fill if store is None else fill_npy, range(len(columns))))
+
+    return times, data, columns
+
+
+def get_ffrsam_dataframe(sds, station_id, t1, t2, period=60, freq=[None], resolution=None, max_points=None,
+                         stat="mean", syntax=ffrsam_syntax, max_workers=8):
+    """Same as get_ffrsam_array, as a pandas DataFrame with a DatetimeIndex and (id, freq) columns"""
+
+    import pandas as pd
+
+    times, data, columns = get_ffrsam_array(sds, station_id, t1, t2, period=period, freq=freq,
+                                            resolution=resolution, max_points=max_points, stat=stat, syntax=syntax,
+                                            max_workers=max_workers)
+    return pd.DataFrame(data, index=pd.DatetimeIndex(times, name="time"),
+                        columns=pd.MultiIndex.from_tuples(columns, names=["id", "freq"]))
@@ -0,0 +1,333 @@
+import json
+import os
+import time
+
+import numpy as np
+from obspy import UTCDateTime, Trace
+
+from tsdatacruncher.packages.ffrsam.cache import DayFileCache
+from tsdatacruncher.packages.ffrsam.coverage import get_coverage_index
+from tsdatacruncher.packages.ffrsam.ffrsam import ffrsam_path, ffrsam_syntax, freq2str, pyramid_writer
+from tsdatacruncher.packages.ffrsam.npystore import is_npy_archive, get_npy_archive
+from tsdatacruncher.packages.ffrsam.utils import bandpass_sos
+from tsdatacruncher.utils import metrics
+from tsdatacruncher.utils.tsdata import write_json_atomic
+
+
+class IncrementalRSAM:
+    """
+    Stateful RSAM for one channel and several frequency bands, fed with consecutive pieces of data.
+
+    IIR filter states (initial conditions) and the partial RSAM window of every band are carried from one call of
+    process() to the next, so data can arrive in packets of any length without tapering or edge effects at the
+    joins. RSAM windows are aligned to multiples of period (e.g., every full minute), and an RSAM sample is returned
+    as soon as the last sample of its window arrives.
+    - Samples that were already processed (overlapping packets) are skipped
+    - A gap ends the current window (it is still returned if it holds at least 99.9% of its samples) and restarts
+      the filters
+    - Filters start in their steady state for the first sample, so a DC offset does not cause a transient
+    - Unfiltered RSAM (band None) is computed on the demeaned window, from sums of the samples minus the first sample
+      of the window, so a large DC offset does not cost precision
+    Filtering (per band) and RMS (all bands) are timed as stages "filter" and "rms" (see utils.metrics).
+    """
+
+    def __init__(self, network, station, location, channel, sampling_rate, freq=[None], period=60):
+        self.header = dict(network=network, station=station, location=location, channel=channel)
+        self.sampling_rate = float(sampling_rate)
+        self.freq = list(freq)
+        self.period = period
+
+        self._dt_ns = int(round(1e9 / self.sampling_rate))
+        self._period_ns = int(round(period * 1e9))
+        self._npts = int(round(period * self.sampling_rate))  # samples per RSAM window
+        self._sos = [bandpass_sos(self.sampling_rate, f[0], f[1]) if f else None for f in self.freq]
+        self._unfiltered = [i for i, f in enumerate(self.freq) if not f]
+        self.reset()
+
+    def reset(self):
+        """Forgets filter states, the expected time of the next sample and the current window"""
+
+        self.zi = [None] * len(self.freq)
+        self.next_ns = None  # time (ns) of the next expected sample
+        self.window = None  # index of the current RSAM window (window start = window * period)
+        self.sumsq = np.zeros(len(self.freq))
+        self.sum = np.zeros(len(self.freq))
+        self.shift = np.zeros(len(self.freq))  # value subtracted from the samples of the current window (band None)
+        self.count = 0
+
+    def get_state(self):
+        """Returns filter states, the next expected sample and the current window as a JSON-serializable dict"""
+
+        return dict(sampling_rate=self.sampling_rate, freq=self.freq, period=self.period,
+                    zi=[None if zi is None else zi.tolist() for zi in self.zi],
+                    next_ns=self.next_ns, window=None if self.window is None else int(self.window),
+                    sumsq=self.sumsq.tolist(), sum=self.sum.tolist(), shift=self.shift.tolist(),
+                    count=int(self.count))
+
+    def set_state(self, state):
+        """Restores a state returned by get_state; raises ValueError if it was saved with other parameters"""
+
+        saved = (float(state["sampling_rate"]), json.dumps(state["freq"]), state["period"])
+        if saved != (self.sampling_rate, json.dumps(self.freq), self.period):
+            raise ValueError(f"State was saved for other parameters (sampling rate, freq, period): {saved}")
+        self.zi = [None if zi is None else np.array(zi) for zi in state["zi"]]
+        self.next_ns = state["next_ns"]
+        self.window = state["window"]
+        self.sumsq = np.array(state["sumsq"], dtype=np.float64)
+        self.sum = np.array(state["sum"], dtype=np.float64)
+        self.shift = np.array(state.get("shift", [0.0] * len(self.freq)), dtype=np.float64)  # (older states: none)
+        self.count = state["count"]
+
+    def process(self, tr):
+        """Processes the next piece of data (a gap-free Trace); returns a list of (band, RSAM Trace) pairs"""
+
+        from scipy.signal import sosfilt, sosfilt_zi
+
+        data = np.asarray(tr.data, dtype=np.float64)
+        t0 = tr.stats.starttime.ns
+        emitted = []
+
+        # Skip samples that were already processed; restart after a gap
+        if self.next_ns is not None:
+            offset = (self.next_ns - t0) / self._dt_ns
+            if offset > 0.5:
+                skip = int(round(offset))
+                data = data[skip:]
+                t0 += skip * self._dt_ns
+            elif offset < -0.5:
+                self._close_window(emitted)
+                self.reset()
+            if self.next_ns is not None:
+                t0 = self.next_ns  # contiguous - stay on the sample grid of the previous data
+        if len(data) == 0:
+            return self._to_traces(emitted)
+
+        # Filter every band, continuing from the previous filter state
+        station = tr.id
+        filtered = []
+        for i, sos in enumerate(self._sos):
+            if sos is None:
+                filtered.append(data)
+                continue
+            with metrics.timer("filter", station=station, band=freq2str(self.freq[i])):
+                if self.zi[i] is None:
+                    self.zi[i] = sosfilt_zi(sos) * data[0]  # steady state for the first sample
+                y, self.zi[i] = sosfilt(sos, data, zi=self.zi[i])
+            filtered.append(y)
+
+        # Sum squares (and samples, for demeaning) per RSAM window in one pass
+        with metrics.timer("rms", station=station):
+            filtered = np.vstack(filtered)
+            times = t0 + np.arange(len(data), dtype=np.int64) * self._dt_ns
+            windows = (times + self._dt_ns // 2) // self._period_ns
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(windows)) + 1])
+            counts = np.diff(np.concatenate([starts, [len(data)]]))
+            # Band None: samples minus the first sample of their window (the window continued from earlier data
+            # keeps its shift)
+            shifts = np.zeros((len(self.freq), len(starts)))
+            if self._unfiltered:
+                shifts[self._unfiltered] = data[starts]
+                if windows[0] == self.window and self.count > 0:
+                    shifts[self._unfiltered, 0] = self.shift[self._unfiltered]
+                filtered[self._unfiltered] -= np.repeat(shifts[self._unfiltered], counts, axis=1)
+            sumsq = np.add.reduceat(filtered ** 2, starts, axis=1)
+            sums = np.add.reduceat(filtered, starts, axis=1)
+
+        for j, window in enumerate(windows[starts]):
+            if window != self.window:
+                self._close_window(emitted)
+                self.window = window
+            if self.count == 0:
+                self.shift = shifts[:, j]
+            self.sumsq += sumsq[:, j]
+            self.sum += sums[:, j]
+            self.count += counts[j]
+            if self.count >= self._npts:  # window complete
+                self._emit(emitted)
+
+        self.next_ns = int(times[-1]) + self._dt_ns
+        return self._to_traces(emitted)
+
+    def _close_window(self, emitted):
+        """Ends the current window early (gap or window change); keeps it if it is at least 99.9% complete"""
+
+        if self.count >= 0.999 * self._npts:
+            self._emit(emitted)
+        self.sumsq[:] = 0
+        self.sum[:] = 0
+        self.count = 0
+
+    def _emit(self, emitted):
+        mean_square = self.sumsq / self.count
+        for i, f in enumerate(self.freq):
+            if not f:
+                mean_square[i] = max(0.0, mean_square[i] - (self.sum[i] / self.count) ** 2)  # demeaned
+        emitted.append((self.window, np.sqrt(mean_square)))
+        self.sumsq[:] = 0
+        self.sum[:] = 0
+        self.count = 0
+
+    def _to_traces(self, emitted):
+        """Turns emitted (window, values) pairs into one Trace per band and run of consecutive windows (per day)"""
+
+        result = []
+        runs = []
+        for window, values in emitted:
+            day = window * self._period_ns // (86400 * 10 ** 9)
+            if runs and window == runs[-1][-1][0] + 1 and day == runs[-1][-1][2]:
+                runs[-1].append((window, values, day))
+            else:
+                runs.append([(window, values, day)])
+        for run in runs:
+            starttime = UTCDateTime(ns=int(run[0][0]) * self._period_ns)
+            values = np.array([v for _, v, _ in run])
+            for i, f in enumerate(self.freq):
+                header = dict(self.header, starttime=starttime, delta=self.period)
+                result.append((f, Trace(data=values[:, i].copy(), header=header)))
+        return result
+
+
+class RealtimeRSAM:
+    """
+    Computes RSAM incrementally for a stream of data packets and merges it into the SDS archive.
+
+    Every channel gets its own IncrementalRSAM. RSAM samples are collected in a DayFileCache, which is written every
+    flush_interval seconds (never if None; and at day boundaries). Data come from a SeedLink server (run_seedlink),
+    from Traces or MiniSEED files replayed in packets (replay), or from whole load chunks of a batch run (on_data).
+    Channel states can be saved and restored between runs (get_states, set_states, save_state, load_state).
+    """
+
+    def __init__(self, freq=[None], period=60, archive="./", syntax=ffrsam_syntax, flush_interval=600, cache=None,
+                 pyramid=None, logger=None):
+        self.freq = list(freq)
+        self.period = period
+        self.archive = archive
+        self.syntax = syntax
+        self.flush_interval = flush_interval
+        self.pyramid = pyramid  # aggregate levels (seconds) updated when day files are written
+        self.logger = logger
+        self.channels = dict()  # id -> IncrementalRSAM
+        self.cache = cache if cache is not None else DayFileCache(logger=logger)
+        self.store = get_npy_archive(archive, period=period) if is_npy_archive(archive) else None  # fixed-grid archive
+        self._last_flush = time.monotonic()
+
+    def on_data(self, tr):
+        """Callback for every data packet (Trace)"""
+
+        # Winston gap values and masked samples are gaps
+        data = np.ma.masked_equal(tr.data, -2 ** 31) if tr.data.dtype.kind == "i" else np.ma.asarray(tr.data)
+        pieces = Trace(data=data, header=tr.stats).split() if np.ma.is_masked(data) else [tr]
+
+        for piece in pieces:
+            state = self.channels.get(piece.id)
+            if state is None or state.sampling_rate != piece.stats.sampling_rate:
+                state = IncrementalRSAM(piece.stats.network, piece.stats.station, piece.stats.location,
+                                        piece.stats.channel, piece.stats.sampling_rate,
+                                        freq=self.freq, period=self.period)
+                self.channels[piece.id] = state
+            for f, rsam_tr in state.process(piece):
+                freq_str = freq2str(f)
+                if self.store is not None:
+                    with metrics.timer("write", station=piece.id, band=freq_str):
+                        self.store.write(rsam_tr, freq_str)
+                else:
+                    self.cache.add(ffrsam_path(rsam_tr, freq_str, archive=self.archive, syntax=self.syntax), rsam_tr,
+                                   coverage=get_coverage_index(self.archive, freq_str),
+                                   on_write=pyramid_writer(freq_str, archive=self.archive, levels=self.pyramid,
+                                                           syntax=self.syntax, logger=self.logger))
+                if self.logger:
+                    self.logger.debug(f"--RSAM {rsam_tr.id} {freq2str(f)}: {rsam_tr.stats.starttime} "
+                                      f"({rsam_tr.stats.npts} samples)")
+
+        if self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes all cached RSAM to the archive"""
+
+        self.cache.flush()
+        if self.store is not None:
+            self.store.flush()
+        self._last_flush = time.monotonic()
+
+    def get_states(self):
+        """Returns the state of every channel (id -> IncrementalRSAM.get_state())"""
+
+        return {id: state.get_state() for id, state in self.channels.items()}
+
+    def set_states(self, states, t1=None, t2=None):
+        """
+        Restores channel states returned by get_states; returns the number of channels restored.
+
+        States saved with other processing parameters are ignored. If t1 and t2 are given, a state is only restored if
+        its next expected sample is within t1-t2, i.e., if it continues the data about to be processed; otherwise
+        (e.g., when reprocessing an earlier time range) the channel starts from scratch.
+        """
+
+        restored = 0
+        for id, saved in states.items():
+            net, sta, loc, cha = id.split(".")
+            state = IncrementalRSAM(net, sta, loc, cha, saved["sampling_rate"], freq=self.freq, period=self.period)
+            if saved["next_ns"] is not None and t1 is not None and t2 is not None:
+                if not t1.ns <= saved["next_ns"] <= t2.ns:
+                    continue
+            try:
+                state.set_state(saved)
+            except ValueError as e:
+                if self.logger:
+                    self.logger.info(f"-- {id}: filter state not restored ({e})")
+                continue
+            self.channels[id] = state
+            restored += 1
+        return restored
+
+    def replay(self, st, packet_length=512):
+        """Feeds a Stream (or MiniSEED file(s), see obspy.read) to on_data in packets, in time order"""
+
+        from obspy import read
+
+        if isinstance(st, str):
+            st = read(st)
+        for tr in sorted(st, key=lambda x: x.stats.starttime):
+            for i in range(0, tr.stats.npts, packet_length):
+                header = tr.stats.copy()
+                header.starttime = tr.stats.starttime + i * tr.stats.delta
+                self.on_data(Trace(data=tr.data[i:i + packet_length], header=header))
+        self.flush()
+
+    def run_seedlink(self, server, station_ids, timeout=30):
+        """Streams station_ids (net.sta.loc.cha) from a SeedLink server (host:port) until interrupted"""
+
+        from obspy.clients.seedlink.easyseedlink import EasySeedLinkClient
+
+        client = EasySeedLinkClient(server, autoconnect=False)
+        client.on_data = self.on_data
+        client.conn.timeout = timeout  # connection time-out (s); must be set explicitly in some ObsPy versions
+        client.connect()
+        for id in station_ids:
+            net, sta, loc, cha = id.split(".")
+            client.select_stream(net, sta, f"{loc.replace('--', '')}{cha}")
+        if self.logger:
+            self.logger.info(f"Streaming {len(station_ids)} channels from SeedLink server {server}")
+        try:
+            client.run()
+        finally:
+            self.flush()
+            client.close()
+
+
+def save_state(states, filename):
+    """Writes channel states (see RealtimeRSAM.get_states) to a JSON file, replacing it atomically"""
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    write_json_atomic(states, filename)
+
+
+def load_state(filename):
+    """Reads channel states written by save_state; returns an empty dict if the file does not exist"""
+
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
@@ -1 +1,204 @@
-# DELETEME
\ No newline at end of file
+import warnings
+from functools import lru_cache
+
+import numpy as np
+
+
+def count_windows(npts, samples_per_window):
+    """
+    Number of windows Stream.slide(window_length=period, step=period) yields for npts samples.
+
+    Only windows spanning at least 99.9% of the window length are counted (same rule as obspy's get_window_times,
+    in integer arithmetic so that the boundary case is not subject to floating point noise).
+    """
+    span = 1000 * (npts - 1) - 999 * samples_per_window
+    if span < 0:
+        return 0
+    return span // (1000 * samples_per_window) + 1
+
+
+def window_rms(data, samples_per_window, include_endpoint=True, overwrite=False):
+    """
+    Computes RMS over consecutive, non-overlapping windows of a 1-D array in one vectorized pass.
+
+    The array is reshaped to (n_windows, samples_per_window) and squared/summed along the second axis, so no
+    Stream or Trace objects are created per window. Windowing mirrors Stream.slide(window_length=period,
+    step=period) followed by slice():
+    - Each window also includes the first sample of the next window (slice() end times are inclusive) unless
+      include_endpoint is False
+    - A trailing partial window is only kept if it spans at least 99.9% of the window length
+
+    Gaps are handled explicitly: masked samples are excluded from the mean, and any window without valid samples
+    is masked in the output.
+
+    With overwrite, a float array without a mask is squared in place and summed window by window in float64, so
+    no full-size temporaries are allocated (the low-allocation path of ffrsam.band_rsam).
+
+    Args:
+        data: 1-D numpy array or masked array of samples
+        samples_per_window: Number of samples per window (period * sampling_rate)
+        include_endpoint: Whether each window includes the first sample of the next window
+        overwrite: Whether data may be overwritten (with its squares)
+
+    Returns:
+        1-D float64 array of RMS values (a masked array if any window had no valid samples)
+    """
+
+    n = int(samples_per_window)
+    if n < 1:
+        raise ValueError(f"samples_per_window must be >= 1 ({samples_per_window})")
+
+    mask = np.ma.getmaskarray(data)
+    values = np.ma.getdata(data)
+    npts = len(values)
+
+    n_windows = count_windows(npts, n)
+    if n_windows == 0:
+        return np.array([], dtype=np.float64)
+
+    if overwrite and not np.ma.isMaskedArray(data) and values.dtype.kind == "f":
+        sq = np.square(values, out=values)
+        full = min(n_windows, (npts - 1) // n)  # windows whose samples (and endpoint) are all in data
+        sums = np.empty(n_windows, dtype=np.float64)
+        counts = np.full(n_windows, n + int(include_endpoint), dtype=np.float64)
+        sums[:full] = sq[:full * n].reshape(full, n).sum(axis=1, dtype=np.float64)
+        if include_endpoint:
+            sums[:full] += sq[n:full * n + 1:n]
+        for w in range(full, n_windows):  # the last window may be short
+            a, b = w * n, min(npts, (w + 1) * n + int(include_endpoint))
+            sums[w] = sq[a:b].sum(dtype=np.float64)
+            counts[w] = b - a
+        return np.sqrt(sums / counts)
+
+    # Squared samples on a grid of exactly n_windows * n (+1 endpoint) samples; the last window may be short
+    # by a few samples, which are zero-padded and excluded from the sample count
+    total = n_windows * n + 1
+    m = min(total, npts)
+    sq = np.zeros(total, dtype=np.float64)
+    np.square(values[:m], out=sq[:m], casting="unsafe")
+    valid = np.zeros(total, dtype=bool)
+    valid[:m] = ~mask[:m]
+    sq[~valid] = 0.0
+
+    sums = sq[:-1].reshape(n_windows, n).sum(axis=1)
+    counts = valid[:-1].reshape(n_windows, n).sum(axis=1)
+    if include_endpoint:
+        sums += sq[n::n]
+        counts += valid[n::n]
+
+    empty = counts == 0
+    rms = np.sqrt(sums / np.where(empty, 1, counts))
+    if empty.any():
+        return np.ma.masked_array(rms, mask=empty)
+    return rms
+
+
+@lru_cache(maxsize=None)
+def bandpass_sos(sampling_rate, freqmin, freqmax, corners=4):
+    """
+    Designs the Butterworth bandpass used by Trace.filter("bandpass") as second-order sections.
+
+    Designs are cached per (sampling_rate, freqmin, freqmax, corners), so a filter bank is only designed once per
+    run no matter how many traces and windows are processed. As in obspy, a high corner at or above Nyquist falls
+    back to a highpass at freqmin. The returned array is shared between callers and must not be modified.
+
+    Returns:
+        Array of second-order sections for scipy.signal.sosfilt
+    """
+    from scipy.signal import iirfilter
+
+    fe = 0.5 * sampling_rate
+    low = freqmin / fe
+    high = freqmax / fe
+    if high - 1.0 > -1e-6:
+        warnings.warn(f"Selected high corner frequency ({freqmax}) of bandpass is at or above Nyquist ({fe}). "
+                      f"Applying a high-pass instead.")
+        if low > 1:
+            raise ValueError("Selected corner frequency is above Nyquist.")
+        sos = iirfilter(corners, low, btype="highpass", ftype="butter", output="sos")
+    else:
+        if low > 1:
+            raise ValueError("Selected low corner frequency is above Nyquist.")
+        sos = iirfilter(corners, [low, high], btype="band", ftype="butter", output="sos")
+    return sos
+
+
+def sosfilt_into(sos, data, out, block_size=65536):
+    """
+    Filters data with second-order sections (scipy.signal.sosfilt from rest) into the preallocated array out.
+
+    The data are filtered block_size samples at a time, carrying the filter state across blocks, so only
+    block-sized temporaries are allocated. The filter itself always runs in float64 (narrow low-frequency bands
+    are not stable enough in float32); only the output is stored in the type of out.
+
+    Returns:
+        out
+    """
+    from scipy.signal import sosfilt
+
+    zi = np.zeros((len(sos), 2), dtype=np.float64)
+    for i in range(0, len(data), block_size):
+        out[i:i + block_size], zi = sosfilt(sos, data[i:i + block_size], zi=zi)
+    return out
+
+
+def window_band_rms(data, samples_per_window, sampling_rate, bands=[None], block_size=256):
+    """
+    Computes RMS per frequency band over consecutive, non-overlapping windows from one FFT per window.
+
+    Each window is transformed once with a real FFT, and its one-sided power spectrum is summed over the bins of
+    every band. By Parseval's theorem the sum over all bins is the mean square of the window, so band None is
+    exactly the RMS of the window (without the shared endpoint sample used by window_rms). A band whose high
+    corner is at or above Nyquist is integrated up to Nyquist, like the highpass fallback of bandpass_sos.
+    Windows are counted as in count_windows; a short trailing window is zero-padded and rescaled to its own length.
+    Windows are transformed block_size at a time to bound memory.
+
+    Args:
+        data: 1-D numpy array of (preprocessed, gap-free) samples
+        samples_per_window: Number of samples per window (period * sampling_rate)
+        sampling_rate: Sampling rate of data (Hz)
+        bands: List of [freqmin, freqmax] pairs or None (no filter)
+        block_size: Number of windows transformed at once
+
+    Returns:
+        2-D float64 array of RMS values with shape (len(bands), n_windows)
+    """
+
+    n = int(samples_per_window)
+    npts = len(data)
+    n_windows = count_windows(npts, n)
+    if n_windows == 0:
+        return np.zeros((len(bands), 0), dtype=np.float64)
+
+    # One-sided spectrum weights: every bin but DC (and Nyquist, for even n) stands for two two-sided bins
+    freqs = np.fft.rfftfreq(n, d=1.0 / sampling_rate)
+    weights = np.full(len(freqs), 2.0)
+    weights[0] = 1.0
+    if n % 2 == 0:
+        weights[-1] = 1.0
+
+    # Bin selection matrix (n_bins, n_bands), so all bands are integrated with a single matrix product
+    selection = np.zeros((len(freqs), len(bands)), dtype=np.float64)
+    for i, band in enumerate(bands):
+        if band:
+            inband = (freqs >= band[0]) & (freqs <= band[1])
+        else:
+            inband = np.ones(len(freqs), dtype=bool)
+        selection[inband, i] = weights[inband]
+    selection /= float(n) ** 2
+
+    # Number of real samples in each window (only the last one can be short)
+    counts = np.full(n_windows, n, dtype=np.float64)
+    counts[-1] = min(n, npts - (n_windows - 1) * n)
+
+    rms = np.empty((len(bands), n_windows), dtype=np.float64)
+    for w0 in range(0, n_windows, block_size):
+        w1 = min(n_windows, w0 + block_size)
+        block = np.zeros((w1 - w0, n), dtype=np.float64)
+        chunk = data[w0 * n:w1 * n]
+        block.reshape(-1)[:len(chunk)] = chunk
+        spectrum = np.fft.rfft(block, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        mean_square = power @ selection * (n / counts[w0:w1])[:, None]
+        rms[:, w0:w1] = np.sqrt(mean_square).T
+    return rms
@@ -0,0 +1,292 @@
+import json
+import os
+import re
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from obspy import UTCDateTime
+
+from tsdatacruncher.utils.tsdata import write_json_atomic
+from tsdatacruncher.utils.wavecache import merge_intervals, subtract_intervals
+
+# NET.STA.LOC.CHAN.TYPE.YEAR.DAY
+sds_filename = re.compile(r"^[^.]*\.[^.]*\.[^.]*\.[^.]*\.[A-Z]\.\d{4}\.\d{3}$")
+
+# Dictionary to store inventories by archive directory, so long-running processes keep them in memory
+inventories = {}
+
+
+def _sampling_rate(factor, multiplier):
+    """Sampling rate from the rate factor and multiplier of a fixed section of data header"""
+
+    if factor == 0 or multiplier == 0:
+        return 0.0
+    if factor > 0:
+        return factor * multiplier if multiplier > 0 else -factor / multiplier
+    return -multiplier / factor if multiplier > 0 else 1.0 / (factor * multiplier)
+
+
+def read_record_header(header):
+    """
+    Parses the fixed header and blockettes 100/1000 of a MiniSEED (2) record.
+
+    Returns (id, start timestamp, number of samples, sampling rate, record length, encoding); record length and
+    encoding (SEED data encoding code, e.g., 5 for FLOAT64) are None without blockette 1000.
+    """
+
+    # Byte order: the year of the start time is plausible in only one of them
+    for bo in (">", "<"):
+        year, jday = struct.unpack(bo + "HH", header[20:24])
+        if 1900 <= year <= 2100 and 1 <= jday <= 366:
+            break
+    else:
+        raise ValueError("Not a MiniSEED record")
+
+    station, location, channel, network = (header[8:13], header[13:15], header[15:18], header[18:20])
+    hour, minute, second, _, tenth_ms = struct.unpack(bo + "BBBBH", header[24:30])
+    npts, factor, multiplier = struct.unpack(bo + "Hhh", header[30:36])
+    activity, _, _, n_blockettes, correction, _, next_blockette = struct.unpack(bo + "BBBBiHH", header[36:48])
+
+    start = UTCDateTime(year=year, julday=jday, hour=hour, minute=minute, second=second).timestamp + tenth_ms * 1e-4
+    if correction and not activity & 0x02:  # time correction not applied yet
+        start += correction * 1e-4
+    rate = _sampling_rate(factor, multiplier)
+    record_length = None
+    encoding = None
+
+    for _ in range(n_blockettes):
+        if not 48 <= next_blockette <= len(header) - 8:
+            break
+        kind, following = struct.unpack(bo + "HH", header[next_blockette:next_blockette + 4])
+        if kind == 1000:
+            encoding = header[next_blockette + 4]
+            record_length = 2 ** header[next_blockette + 6]
+        elif kind == 100:
+            rate = struct.unpack(bo + "f", header[next_blockette + 4:next_blockette + 8])[0]
+        next_blockette = following
+
+    id = ".".join(part.decode("ascii", "replace").strip() for part in (network, station, location, channel))
+    return id, start, npts, rate, record_length, encoding
+
+
+def scan_file(filename, header_bytes=256):
+    """
+    Reads only the record headers of a MiniSEED file; returns the entry of the file in an SDSInventory.
+
+    Records are followed with their record length (blockette 1000), so data are never read or decoded. Consecutive
+    records within half a sample of each other form one segment [start, end), where end is the time after the last
+    sample.
+    """
+
+    segments = []
+    ids = set()
+    npts_total = 0
+    rates = set()
+    records = 0
+    formats = set()  # (encoding, record length)
+    with open(filename, "rb") as f:
+        offset = 0
+        while True:
+            f.seek(offset)
+            header = f.read(header_bytes)
+            if len(header) < 48:
+                break
+            id, start, npts, rate, record_length, encoding = read_record_header(header)
+            if record_length is None:
+                raise ValueError(f"No blockette 1000 in record at byte {offset}")
+            offset += record_length
+            records += 1
+            formats.add((encoding, record_length))
+            if npts == 0 or rate <= 0:
+                continue  # e.g., log records
+            ids.add(id)
+            rates.add(rate)
+            npts_total += npts
+            end = start + npts / rate
+            if segments and abs(start - segments[-1][1]) <= 0.5 / rate:
+                segments[-1][1] = max(segments[-1][1], end)
+            else:
+                segments.append([start, end])
+
+    return {"id": sorted(ids), "rate": sorted(rates), "npts": npts_total, "records": records,
+            "formats": sorted(formats), "segments": merge_intervals(segments) if len(segments) > 1 else segments}
+
+
+def _scan(filename):
+    """scan_file for process pools; errors are returned as an entry (unreadable files are indexed as such)"""
+
+    try:
+        return scan_file(filename)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+class SDSInventory:
+    """
+    Persistent index of the MiniSEED day files in an SDS archive (raw, or SDS_ffrsam with all its bands and levels).
+
+    For every day file, the index (root/inventory.json, or index_file, e.g., for a read-only archive) holds its
+    channel, sampling rate, number of samples and the segments [start, end) of continuous data, read from the record
+    headers only (see scan_file). update() walks the archive and only scans files that are new or whose modification
+    time or size changed, in parallel processes. Queries (channels, segments, missing, has_data) use the index and
+    never open data files; they reflect the archive as of the last update().
+
+    A file belongs to a 'tree': the directory below root that holds its Year/NET/STA/CHAN.TYPE directories, e.g.,
+    "" in a raw SDS archive, "0100-0500" or "600/mean/0100-0500" in an SDS_ffrsam archive.
+    """
+
+    def __init__(self, root, index_file=None, logger=None):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.logger = logger
+        self.filename = index_file or os.path.join(self.root, "inventory.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self.filename, "r") as f:
+                self._files = json.load(f)  # relpath -> {"mtime", "size", "id", "rate", "npts", "segments", ...}
+        except (OSError, ValueError):
+            self._files = dict()
+        self._by_channel = None  # (tree, id) -> [(day timestamp, relpath), ...], built on first query
+
+    def _walk(self):
+        """Yields (relpath, os.stat_result) of every SDS day file below root"""
+
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if sds_filename.match(filename):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        yield os.path.relpath(path, self.root), os.stat(path)
+                    except OSError:
+                        pass  # removed while walking
+
+    def update(self, max_workers=None, batch=5000):
+        """
+        Scans new and changed files and drops removed ones; returns (number of files scanned, number removed).
+
+        The index is saved after every batch of scanned files, so an interrupted first scan of a large archive is
+        continued by the next update().
+        """
+
+        seen = set()
+        todo = []
+        for relpath, stat in self._walk():
+            seen.add(relpath)
+            entry = self._files.get(relpath)
+            if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                todo.append((relpath, stat))
+
+        with self._lock:
+            removed = [relpath for relpath in self._files if relpath not in seen]
+            for relpath in removed:
+                del self._files[relpath]
+
+        for i in range(0, len(todo), batch):
+            part = todo[i:i + batch]
+            paths = [os.path.join(self.root, relpath) for relpath, _ in part]
+            if max_workers == 1 or len(part) < 64:
+                entries = [_scan(path) for path in paths]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    entries = list(pool.map(_scan, paths, chunksize=32))
+            with self._lock:
+                for (relpath, stat), entry in zip(part, entries):
+                    entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+                    self._files[relpath] = entry
+            self.save()
+            if self.logger:
+                self.logger.debug(f"Inventory {self.root}: scanned {i + len(part)}/{len(todo)} files")
+
+        if removed and not todo:
+            self.save()
+        self._by_channel = None
+        if self.logger:
+            self.logger.info(f"Inventory {self.root}: {len(self._files)} files, {len(todo)} scanned, "
+                             f"{len(removed)} removed")
+        return len(todo), len(removed)
+
+    def save(self):
+        with self._lock:
+            write_json_atomic(self._files, self.filename)
+
+    def _channel_index(self):
+        with self._lock:
+            if self._by_channel is None:
+                self._by_channel = dict()
+                for relpath, entry in self._files.items():
+                    parts = relpath.split(os.sep)
+                    tree = os.sep.join(parts[:-5])
+                    net, sta, loc, cha, _, year, jday = parts[-1].split(".")
+                    day = UTCDateTime(year=int(year), julday=int(jday)).timestamp
+                    self._by_channel.setdefault((tree, f"{net}.{sta}.{loc}.{cha}"), []).append((day, relpath))
+                for files in self._by_channel.values():
+                    files.sort()
+            return self._by_channel
+
+    def trees(self):
+        return sorted(set(tree for tree, _ in self._channel_index()))
+
+    def channels(self, tree=""):
+        """Returns the channels (net.sta.loc.cha) with day files in tree"""
+        return sorted(id for t, id in self._channel_index() if t == tree)
+
+    def files(self, id, tree=""):
+        """Returns [(day timestamp, index entry), ...] of the day files of channel id in tree, in time order"""
+
+        net, sta, loc, cha = id.split(".")
+        files = self._channel_index().get((tree, f"{net}.{sta}.{loc.replace('--', '')}.{cha}"), [])
+        with self._lock:
+            return [(day, self._files[relpath]) for day, relpath in files if relpath in self._files]
+
+    def segments(self, id, t1=None, t2=None, tree=""):
+        """Returns the merged segments [start, end) of channel id in tree, clipped to t1-t2 (timestamps)"""
+
+        t1 = UTCDateTime(t1).timestamp if t1 is not None else float("-inf")
+        t2 = UTCDateTime(t2).timestamp if t2 is not None else float("inf")
+        segments = []
+        for day, entry in self.files(id, tree):
+            if day + 2 * 86400 <= t1 or day - 86400 >= t2:
+                continue  # (day files can hold a few samples of the neighbouring days)
+            segments += [[max(a, t1), min(b, t2)] for a, b in entry.get("segments", []) if a < t2 and b > t1]
+        return merge_intervals(segments)
+
+    def missing(self, id, t1, t2, tree=""):
+        """Returns the intervals [start, end] within t1-t2 without data for channel id in tree"""
+
+        return subtract_intervals(UTCDateTime(t1).timestamp, UTCDateTime(t2).timestamp,
+                                  self.segments(id, t1, t2, tree=tree))
+
+    def has_data(self, id, t1, t2, tree=""):
+        return bool(self.segments(id, t1, t2, tree=tree))
+
+    def summary(self, tree="", t1=None, t2=None):
+        """
+        Returns one dict per channel in tree: first and last sample time, number of day files, seconds of data,
+        number of gaps (between segments), sampling rates and unreadable files, for data within t1-t2 (all if None).
+        """
+
+        rows = []
+        for id in self.channels(tree):
+            segments = self.segments(id, t1, t2, tree=tree)
+            if not segments:
+                continue
+            files = [entry for day, entry in self.files(id, tree)
+                     if day + 86400 > segments[0][0] and day < segments[-1][1]]
+            rows.append({"tree": tree, "id": id,
+                         "first": UTCDateTime(segments[0][0]), "last": UTCDateTime(segments[-1][1]),
+                         "days": len(files),
+                         "seconds": sum(b - a for a, b in segments),
+                         "gaps": len(segments) - 1,
+                         "rate": sorted(set(r for entry in files for r in entry.get("rate", []))),
+                         "errors": sum("error" in entry for entry in files)})
+        return rows
+
+
+def get_inventory(root, index_file=None, logger=None):
+    """Returns the SDSInventory of an archive directory (loaded on first use; call update() to refresh it)"""
+
+    key = (os.path.abspath(os.path.expanduser(root)), index_file)
+    if key not in inventories:
+        inventories[key] = SDSInventory(root, index_file=index_file, logger=logger)
+    return inventories[key]
@@ -0,0 +1,55 @@
+"""
+Prints what is in an SDS archive (raw data or SDS_ffrsam), from the index kept by inventory.SDSInventory.
+
+$ python -m tsdatacruncher.packages.print_stream_info.print_stream_info ./results/SDS_ffrsam --tree 0100-0500
+"""
+
+import argparse
+import json
+from fnmatch import fnmatch
+
+from tsdatacruncher.packages.print_stream_info.inventory import get_inventory
+
+
+def print_summary(rows):
+    """Prints summary rows (see SDSInventory.summary) as a table"""
+
+    print(f"{'tree':<20} {'id':<18} {'first':<20} {'last':<20} {'days':>5} {'hours':>9} {'cover':>6} {'gaps':>5} "
+          f"{'rate':>8}")
+    for row in rows:
+        span = row["last"] - row["first"]
+        cover = 100 * row["seconds"] / span if span > 0 else 100
+        rate = ",".join(f"{r:g}" for r in row["rate"])
+        errors = f"  ({row['errors']} unreadable files)" if row["errors"] else ""
+        print(f"{row['tree'] or '.':<20} {row['id']:<18} {row['first'].strftime('%Y-%m-%dT%H:%M:%S'):<20} "
+              f"{row['last'].strftime('%Y-%m-%dT%H:%M:%S'):<20} {row['days']:>5} {row['seconds'] / 3600:>9.1f} "
+              f"{cover:>5.1f}% {row['gaps']:>5} {rate:>8}{errors}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Summarize the channels, time spans and gaps of an SDS archive")
+    parser.add_argument("sds", type=str, help="SDS archive (raw data or SDS_ffrsam)")
+    parser.add_argument("--tree", type=str, help="Only this tree (e.g., 0100-0500 or 600/mean/0100-0500)")
+    parser.add_argument("--id", type=str, default="*", help="Only channels matching this pattern (e.g., AV.GA*)")
+    parser.add_argument("--t1", type=str, help="Only data after t1")
+    parser.add_argument("--t2", type=str, help="Only data before t2")
+    parser.add_argument("--workers", type=int, help="Processes scanning changed files (default: all CPUs)")
+    parser.add_argument("--no-update", action="store_true", help="Use the index as is (do not scan for changes)")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    args = parser.parse_args()
+
+    inventory = get_inventory(args.sds)
+    if not args.no_update:
+        inventory.update(max_workers=args.workers)
+
+    rows = [row for tree in ([args.tree] if args.tree is not None else inventory.trees())
+            for row in inventory.summary(tree, t1=args.t1, t2=args.t2) if fnmatch(row["id"], args.id)]
+    if args.json:
+        print(json.dumps([dict(row, first=str(row["first"]), last=str(row["last"])) for row in rows], indent=1))
+    else:
+        print_summary(rows)
+
+
+if __name__ == "__main__":
+    main()
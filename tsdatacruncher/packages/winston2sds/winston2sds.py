@@ -0,0 +1,172 @@
+"""
+Mirrors waveforms from a Winston wave server (or any ObsPy Client) to a local SDS archive.
+
+$ python -m tsdatacruncher.packages.winston2sds.winston2sds wws://pubavo1.wr.usgs.gov:16022 ./raw_mirror \\
+      --id AV.GAEA..BHZ,AV.GALA..BHZ --t1 2025-01-01 --t2 2025-02-01 --workers 8 --rate 20
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from obspy import UTCDateTime, Stream
+
+from tsdatacruncher.utils.tsdata import get_client, request_with_retry
+from tsdatacruncher.utils.wavecache import CachedClient
+
+# Winston fills gaps inside a tracebuf with this value
+winston_gap = -2 ** 31
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads (rate None or 0: no limit)"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+def remove_gap_sentinels(st):
+    """Converts Winston gap values (-2**31) in integer Traces into real gaps; returns a Stream of gap-free Traces"""
+
+    out = Stream()
+    for tr in st:
+        if tr.data.dtype.kind == "i" and (tr.data == winston_gap).any():
+            tr.data = np.ma.masked_equal(tr.data, winston_gap)
+            out += tr.split()
+        else:
+            out.append(tr)
+    return out
+
+
+def chunk_intervals(intervals, chunk):
+    """Splits [start, end] intervals (timestamps) into requests of at most chunk seconds"""
+
+    for a, b in intervals:
+        while a < b:
+            yield a, min(b, a + chunk)
+            a += chunk
+
+
+def mirror_day(client, cache, id, day, t1, t2, chunk=3600, limiter=None, retries=2, logger=None):
+    """
+    Fetches the parts of one station-day (within t1-t2) that are not in the mirror yet, in requests of chunk seconds.
+
+    Chunks that fail or come back empty are not recorded, so they are fetched again on the next run (the Earthworm
+    client returns no data, rather than an error, for a dropped connection). Returns (number of requests, number of
+    failed requests, number of empty requests).
+    """
+
+    net, sta, loc, cha = id.split(".")
+    a = max(t1, day)
+    b = min(t2, day + 86400)
+    requests, failed, empty = 0, 0, 0
+    for start, end in chunk_intervals(cache.missing(net, sta, loc, cha, a, b), chunk):
+        if limiter:
+            limiter.wait()
+        requests += 1
+        try:
+            st = request_with_retry(client.get_waveforms, net, sta, loc, cha, UTCDateTime(start), UTCDateTime(end),
+                                    retries=retries)
+        except Exception as e:
+            failed += 1
+            if logger:
+                logger.warning(f"-- {id} {UTCDateTime(start)} to {UTCDateTime(end)}: {e}")
+            continue
+        if len(st) == 0:
+            empty += 1
+            continue
+        cache.add_waveforms(remove_gap_sentinels(st), net, sta, loc, cha, start, end)
+    return requests, failed, empty
+
+
+def mirror(client, station_ids, t1, t2, sds_dir, chunk=3600, max_workers=4, rate=None, retries=2, settle=3600,
+           save_interval=30, logger=None):
+    """
+    Copies t1-t2 of every station from client to day files in an SDS archive (sds_dir).
+
+    Station-days are fetched concurrently (max_workers), each in requests of at most chunk seconds, with at most
+    'rate' requests per second in total. Winston gap values become gaps. The mirror keeps the coverage index of a
+    raw cache (see wavecache.CachedClient), saved every save_interval seconds, so an interrupted or repeated run
+    only fetches what is missing, and the mirror can be used as 'raw_cache' or directly as an SDS 'client'.
+    Data less than settle seconds old are fetched again on the next run.
+
+    Returns the number of failed requests.
+    """
+
+    t1 = UTCDateTime(t1)
+    t2 = UTCDateTime(t2)
+    cache = CachedClient(client, sds_dir, settle=settle, logger=logger)
+    limiter = RateLimiter(rate)
+
+    units = []
+    day = UTCDateTime(t1.date)
+    while day < t2:
+        units += [(id, day) for id in station_ids]
+        day += 86400
+
+    requests, failed, empty, done = 0, 0, 0, 0
+    t0 = last_save = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(mirror_day, client, cache, id, day, t1, t2, chunk=chunk, limiter=limiter,
+                               retries=retries, logger=logger) for id, day in units]
+        for future in futures:
+            n, f, e = future.result()
+            requests += n
+            failed += f
+            empty += e
+            done += 1
+            if time.time() - last_save > save_interval:
+                cache.save()
+                last_save = time.time()
+                if logger:
+                    logger.info(f"{done}/{len(units)} station-days, {requests} requests "
+                                f"({requests / (last_save - t0):.1f}/s), {failed} failed, {empty} empty")
+    cache.save()
+
+    if logger:
+        logger.info(f"Mirrored {len(units)} station-days to {cache.cache_dir}: {requests} requests in "
+                    f"{time.time() - t0:.1f} s, {failed} failed, {empty} empty (requested again on the next run)")
+    return failed
+
+
+def main():
+
+    from tsdatacruncher.utils.input import parse_ids, parse_time_delta
+    from tsdatacruncher.utils.logs import setup_logger
+
+    parser = argparse.ArgumentParser(description="Mirror a Winston wave server (or any client) to an SDS archive")
+    parser.add_argument("datasource", type=str, help="Data source (e.g., wws://pubavo1.wr.usgs.gov:16022)")
+    parser.add_argument("sds", type=str, help="SDS archive to write to")
+    parser.add_argument("--id", type=str, required=True, help="Station IDs (comma-separated or file)")
+    parser.add_argument("--t1", type=str, required=True, help="Start time")
+    parser.add_argument("--t2", type=str, required=True, help="End time")
+    parser.add_argument("--chunk", type=str, default="1h",
+                        help="Length of each request (Timedelta string or minutes; default: 1h)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests (default: 4)")
+    parser.add_argument("--rate", type=float, help="Maximum requests per second (default: no limit)")
+    parser.add_argument("--timeout", type=float, default=60, help="Timeout (s) of each request (default: 60)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries of failed requests (default: 2)")
+    args = parser.parse_args()
+
+    logger = setup_logger("winston2sds")
+    failed = mirror(get_client(args.datasource, timeout=args.timeout), parse_ids(args.id), args.t1, args.t2,
+                    args.sds, chunk=parse_time_delta(args.chunk) * 60, max_workers=args.workers, rate=args.rate,
+                    retries=args.retries, logger=logger)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Probes how far the data of each channel reach in a datasource, without downloading them:
+- SDS archives: the record headers of the day files (see print_stream_info.inventory.scan_file), scanned again only
+  when the mtime or size of a file changed
+- Winston wave servers: one menu request for all channels
+- FDSN web services: one request to the availability service (fdsnws/availability, extent)
+Other clients (e.g., SeedLink) cannot be probed.
+"""
+
+import json
+import os
+from fnmatch import fnmatch
+
+from obspy import UTCDateTime
+
+from tsdatacruncher.utils.tsdata import loaded_instance
+from tsdatacruncher.utils.wavecache import CachedClient
+
+# Dictionary to store the segments of scanned SDS day files by filename: (mtime_ns, size, segments)
+sds_scans = {}
+
+
+def _split(id):
+    net, sta, loc, cha = id.split(".")
+    return net, sta, loc.replace("--", ""), cha
+
+
+def sds_ends(client, station_ids, t1, t2):
+    """Returns {id: end of the data between t1 and t2} from the day files of an SDS client (see data_ends)"""
+
+    from tsdatacruncher.packages.print_stream_info.inventory import scan_file
+
+    ends = dict()
+    for id in station_ids:
+        if any(c in id for c in "*?["):
+            continue  # wildcards: the files cannot be named
+        net, sta, loc, cha = _split(id)
+        end = None
+        day = UTCDateTime(t1.date)
+        while day < t2:
+            filename = client._get_filename(net, sta, loc, cha, day)
+            try:
+                stat = os.stat(filename)
+                scan = sds_scans.get(filename)
+                if scan is None or scan[:2] != (stat.st_mtime_ns, stat.st_size):
+                    scan = (stat.st_mtime_ns, stat.st_size, scan_file(filename)["segments"])
+                    sds_scans[filename] = scan
+                for a, b in scan[2]:
+                    if a < t2.timestamp and b > t1.timestamp:
+                        end = max(end or b, b)
+            except (OSError, ValueError):
+                pass  # no (readable) file for this day
+            day += 86400
+        ends[id] = UTCDateTime(end) if end is not None else None
+    return ends
+
+
+def winston_ends(client, station_ids, t1, t2):
+    """Returns {id: time of the last sample} from the menu of a Winston wave server (see data_ends)"""
+
+    menu = client.get_availability()
+    ends = dict()
+    for id in station_ids:
+        net, sta, loc, cha = _split(id)
+        matches = [end for n, s, l, c, start, end in menu
+                   if fnmatch(n, net) and fnmatch(s, sta) and fnmatch(l.replace("--", ""), loc) and fnmatch(c, cha)
+                   and start < t2 and end > t1]
+        ends[id] = max(matches) if matches else None
+    return ends
+
+
+def fdsn_ends(client, station_ids, t1, t2):
+    """Returns {id: time of the latest data} from the FDSN availability service of client (see data_ends)"""
+
+    import urllib.parse
+    import urllib.request
+
+    parts = [_split(id) for id in station_ids]
+    query = {"net": ",".join(sorted(set(p[0] for p in parts))), "sta": ",".join(sorted(set(p[1] for p in parts))),
+             "loc": ",".join(sorted(set(p[2] or "--" for p in parts))),
+             "cha": ",".join(sorted(set(p[3] for p in parts))),
+             "starttime": t1.strftime("%Y-%m-%dT%H:%M:%S"), "endtime": t2.strftime("%Y-%m-%dT%H:%M:%S"),
+             "format": "json"}
+    url = f"{client.base_url}/fdsnws/availability/1/extent?{urllib.parse.urlencode(query)}"
+    with urllib.request.urlopen(url, timeout=getattr(client, "timeout", None) or 30) as response:
+        body = response.read()
+    sources = json.loads(body)["datasources"] if body.strip() else []  # (204: no data)
+
+    ends = dict()
+    for id, (net, sta, loc, cha) in zip(station_ids, parts):
+        matches = [UTCDateTime(s["latest"]) for s in sources
+                   if fnmatch(s["network"], net) and fnmatch(s["station"], sta)
+                   and fnmatch(s.get("location", "").replace("--", ""), loc) and fnmatch(s["channel"], cha)]
+        ends[id] = max(matches) if matches else None
+    return ends
+
+
+def data_ends(client, station_ids, t1, t2, logger=None):
+    """
+    Returns {id: end of the data of the channel between t1 and t2 (UTCDateTime), or None if there are none} for
+    every station ID the client can be probed for. IDs missing from the result could not be probed (e.g., SeedLink
+    clients, failed requests, wildcards in SDS IDs).
+
+    For SDS archives, the end is the time after the last sample. Winston menus and FDSN availability give the time
+    of the last sample, so data reach t2 there only once a sample at or after t2 has arrived.
+    """
+
+    if isinstance(client, CachedClient):
+        client = client.client  # probe the datasource behind the raw cache
+    try:
+        if loaded_instance(client, "obspy.clients.filesystem.sds", "Client"):
+            return sds_ends(client, station_ids, t1, t2)
+        if loaded_instance(client, "obspy.clients.earthworm.client", "Client"):
+            return winston_ends(client, station_ids, t1, t2)
+        if loaded_instance(client, "obspy.clients.fdsn.client", "Client"):
+            return fdsn_ends(client, station_ids, t1, t2)
+    except Exception as e:
+        if logger:
+            logger.info(f"-- Data availability could not be probed: {e}")
+    return dict()
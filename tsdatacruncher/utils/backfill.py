@@ -0,0 +1,169 @@
+import json
+import os
+import socket
+import time
+
+from obspy import UTCDateTime
+
+from tsdatacruncher.utils.tsdata import write_json_atomic
+
+
+def plan_units(station_ids, t1, t2, available=None):
+    """
+    Splits t1-t2 into one work unit per station and (UTC) day; returns a list of unit dicts in time order.
+
+    With available (a function of station id, start and end), station-days for which it returns False (e.g., no raw
+    data, see SDSInventory.has_data) are left out.
+    """
+
+    units = []
+    day = UTCDateTime(t1.date)
+    while day < t2:
+        for id in station_ids:
+            if available is not None and not available(id, max(t1, day), min(t2, day + 86400)):
+                continue
+            units.append({"key": f"{id}.{day.year}.{day.julday:03d}",
+                          "id": id,
+                          "t1": str(max(t1, day)),
+                          "t2": str(min(t2, day + 86400))})
+        day += 86400
+    return units
+
+
+class BackfillManifest:
+    """
+    Persistent work manifest for a resumable backfill, shared by any number of processes or hosts.
+
+    The manifest directory (on storage shared by all workers) holds:
+    - manifest.json: the parameters of the backfill and its work units (one per station and day)
+    - claims/<key>: a lock file per unit being processed, created exclusively (O_CREAT | O_EXCL), so only one worker
+      processes a unit. A claim older than lock_timeout seconds is considered abandoned (e.g., a crashed worker) and
+      can be claimed again.
+    - done/<key>: a completion record per finished unit, written atomically
+    Units with a completion record are skipped, so a restarted backfill continues where it stopped. The completion
+    records are listed once per claim (one directory listing), and claims start at the first unit that was not done
+    at the previous claim, so claiming does not touch every unit on the shared storage.
+    """
+
+    def __init__(self, directory, lock_timeout=6 * 3600, logger=None):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.lock_timeout = lock_timeout
+        self.logger = logger
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.units = []
+        self.parameters = dict()
+        self._done = None  # keys of completed units, as of the last listing (see _list_done)
+        self._first_pending = 0  # index of the first unit that was not done at the last claim
+
+        self._manifest_file = os.path.join(self.directory, "manifest.json")
+        self._claims_dir = os.path.join(self.directory, "claims")
+        self._done_dir = os.path.join(self.directory, "done")
+
+    def exists(self):
+        return os.path.exists(self._manifest_file)
+
+    def create(self, station_ids, t1, t2, parameters=dict(), available=None):
+        """
+        Writes a new manifest, or loads the existing one; returns True if a new manifest was created.
+
+        available is passed to plan_units.
+        """
+
+        os.makedirs(self._claims_dir, exist_ok=True)
+        os.makedirs(self._done_dir, exist_ok=True)
+        if self.exists():
+            self.load()
+            if (self.parameters.get("t1"), self.parameters.get("t2"), self.parameters.get("id")) != \
+                    (str(t1), str(t2), list(station_ids)):
+                if self.logger:
+                    self.logger.info(f"Backfill manifest {self._manifest_file} exists with other stations or times. "
+                                     f"Resuming the existing manifest.")
+            return False
+
+        self.parameters = dict(parameters, id=list(station_ids), t1=str(t1), t2=str(t2))
+        self.units = plan_units(station_ids, t1, t2, available=available)
+        write_json_atomic({"parameters": self.parameters, "units": self.units}, self._manifest_file, indent=1)
+        return True
+
+    def load(self):
+        """Reads the manifest written by create"""
+
+        with open(self._manifest_file, "r") as f:
+            manifest = json.load(f)
+        self.parameters = manifest["parameters"]
+        self.units = manifest["units"]
+
+    def is_done(self, key):
+        return os.path.exists(os.path.join(self._done_dir, key))
+
+    def n_done(self):
+        """Number of completed units (by any worker, as of the last claim; and by this one)"""
+
+        if self._done is None:
+            self._list_done()
+        return len(self._done)
+
+    def _list_done(self):
+        self._done = {f for f in os.listdir(self._done_dir) if ".tmp" not in f}
+
+    def claim(self, max_units=1, skip=()):
+        """
+        Claims up to max_units pending units of the same day (so their stations can be fetched together).
+
+        Units in skip (keys) are not claimed. Returns the list of claimed units (empty when nothing is left).
+        """
+
+        self._list_done()
+        while self._first_pending < len(self.units) and self.units[self._first_pending]["key"] in self._done:
+            self._first_pending += 1
+
+        claimed = []
+        for unit in self.units[self._first_pending:]:
+            if len(claimed) >= max_units:
+                break
+            if unit["key"] in skip or unit["key"] in self._done:
+                continue
+            if claimed and unit["t1"] != claimed[0]["t1"]:
+                break  # only units of the same day
+            if self._lock(unit["key"]):
+                claimed.append(unit)
+        return claimed
+
+    def _lock(self, key):
+        lockfile = os.path.join(self._claims_dir, key)
+        try:
+            if time.time() - os.path.getmtime(lockfile) > self.lock_timeout:
+                os.remove(lockfile)  # abandoned claim
+                if self.logger:
+                    self.logger.info(f"-- Backfill: removed abandoned claim {key}")
+        except OSError:
+            pass
+        try:
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{self.owner} {UTCDateTime()}\n")
+        if self.is_done(key):  # completed by another worker between checking and claiming
+            os.remove(lockfile)
+            return False
+        return True
+
+    def release(self, units):
+        """Gives up the claims on units (e.g., after an error), so they are processed again later"""
+
+        for unit in units:
+            try:
+                os.remove(os.path.join(self._claims_dir, unit["key"]))
+            except OSError:
+                pass
+
+    def complete(self, units, elapsed=None):
+        """Records units as done (atomically) and releases their claims"""
+
+        for unit in units:
+            write_json_atomic({"owner": self.owner, "finished": str(UTCDateTime()), "elapsed": elapsed},
+                              os.path.join(self._done_dir, unit["key"]), indent=1)
+            if self._done is not None:
+                self._done.add(unit["key"])
+        self.release(units)
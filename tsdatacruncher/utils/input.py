@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import re
 import sys
 import yaml
 from typing import Dict, Any, List
 
-import pandas as pd
 import datetime
-import time
 from obspy import UTCDateTime
 
+from tsdatacruncher.utils.logs import parse_rotation
+
+# Seconds per unit of the Timedelta strings parse_time_delta reads without pandas (e.g., "10min", "1h30min", "1 day");
+# anything else is passed to pandas.Timedelta
+time_units = {
+    **dict.fromkeys(["W", "w", "week", "weeks"], 604800),
+    **dict.fromkeys(["D", "d", "day", "days"], 86400),
+    **dict.fromkeys(["H", "h", "hr", "hour", "hours"], 3600),
+    **dict.fromkeys(["m", "min", "minute", "minutes"], 60),
+    **dict.fromkeys(["S", "s", "sec", "second", "seconds"], 1),
+}
+time_delta_syntax = re.compile(r"(?:\s*\d+(?:\.\d*)?\s*[a-zA-Z]+)+\s*")
+time_delta_part = re.compile(r"(\d+(?:\.\d*)?)\s*([a-zA-Z]+)")
+
 
 def deep_update(original, update):
     """
@@ -170,21 +183,44 @@ def parse_time_delta(value):
         return float(value)
 
     if isinstance(value, str):
+        # Minutes
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+        # Common Timedelta strings, without importing pandas
+        if time_delta_syntax.fullmatch(value):
+            parts = time_delta_part.findall(value)
+            if all(unit in time_units for _, unit in parts):
+                return sum(float(n) * time_units[unit] for n, unit in parts) / 60
+
         try:
             # Try to parse as pandas Timedelta
+            import pandas as pd
             td = pd.Timedelta(value)
             return td.total_seconds() / 60  # Convert to minutes
         except ValueError:
-            # If it's not a valid Timedelta string, try direct conversion
-            try:
-                return float(value)
-            except ValueError:
-                print(f"Warning: Could not parse time value '{value}' - using default")
-                return None
+            print(f"Warning: Could not parse time value '{value}' - using default")
+            return None
 
     return None  # Is this line necessary; should only get here if not str, int, float
 
 
+def parse_pyramid(levels):
+    """Converts pyramid levels (list or comma-separated string of Timedelta strings or minutes) to seconds"""
+
+    if levels in (None, "None", ""):
+        return []
+    if isinstance(levels, str):
+        levels = levels.split(",")
+    seconds = sorted(int(round(parse_time_delta(level) * 60)) for level in levels)
+    for s in seconds:
+        if s <= 0 or 86400 % s:
+            raise ValueError(f"Pyramid levels must divide a day: {s} s")
+    return seconds
+
+
 def load_config_and_cli():
 
     # Parse command line arguments
@@ -199,6 +235,23 @@ def load_config_and_cli():
     return config
 
 
+def reload_config(config):
+    """
+    Parses the configuration file and command line arguments of config again (e.g., after the file changed).
+    """
+    return parse_all_input(config["config_file"], config["cli_args"])
+
+
+def config_mtimes(config):
+    """Returns the modification times of the configuration file and station ID file (if any) of config"""
+
+    mtimes = dict()
+    for filepath in [config["config_file"], config["id_file"]]:
+        if filepath and os.path.isfile(filepath):
+            mtimes[filepath] = os.path.getmtime(filepath)
+    return mtimes
+
+
 def parse_cli():
     """
     Parse command line arguments
@@ -219,10 +272,33 @@ def parse_cli():
                         help='End time in format YYYY-MM-DDTHH:MM:SS')
     parser.add_argument('--id', type=str,
                         help='List of Station IDs (comma separated or file path with one ID per line)')
+    parser.add_argument('--fetch-workers', type=int,
+                        help='Number of concurrent waveform requests')
+    parser.add_argument('--timeout', type=float,
+                        help='Timeout (in seconds) for each waveform request')
+    parser.add_argument('--retries', type=int,
+                        help='Number of times a failed waveform request is retried (with backoff)')
+    parser.add_argument('--raw-cache', type=str,
+                        help='Directory for a local cache of downloaded raw waveforms (SDS)')
+    parser.add_argument('--raw-cache-mb', type=float,
+                        help='Size limit (MB) of the raw cache: least recently used day files are removed beyond it')
+    parser.add_argument('--raw-cache-days', type=float,
+                        help='Day files of the raw cache not used for this many days are removed')
 
     # Add options - Processing options
     parser.add_argument('--freq', type=str,
                         help='Frequency bands (e.g., "None,1-5,1-10,2.5-5" (Use None for no filter')
+    parser.add_argument('--mode', choices=['filter', 'spectral', 'incremental'],
+                        help='RSAM processing mode: bandpass filter per band (filter), one FFT per period (spectral) '
+                             'or filters that carry their state from window to window and run to run (incremental)')
+    parser.add_argument('--precision', choices=['float32', 'float64'],
+                        help='Low-allocation numeric path: preprocess and filter in place in one working array of '
+                             'this type (filter and spectral modes; default: ObsPy float64 copies)')
+    parser.add_argument('--pyramid', type=str,
+                        help='Aggregate levels to maintain (e.g., "10min,1h,1D"; default: no levels)')
+    parser.add_argument('--state-file', type=str,
+                        help='Incremental mode: file for filter states between runs '
+                             '(default: <archive>/ffrsam_state.json)')
     # - add option for rsam period (1') hard-coded default right now
 
     # Add options - Processing Timedeltas
@@ -232,14 +308,42 @@ def parse_cli():
                         help='Processing time window length (minutes or pandas Timedelta string)')
     parser.add_argument('--tstep', type=str,
                         help='Time between processing chunks (minutes or pandas Timedelta string)')
+    parser.add_argument('--workers', type=int,
+                        help='Number of worker processes; stations of each load chunk are split across them')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Stay resident and process new data every tstep (instead of running once, e.g. from cron)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream from a SeedLink client and compute RSAM as packets arrive (runs until stopped)')
+    parser.add_argument('--backfill', type=str,
+                        help='Run t1-t2 as a resumable backfill with its work manifest in this (shared) directory')
+    parser.add_argument('--catchup', type=str,
+                        help='Daemon mode: maximum time to catch up after a stall (minutes or pandas Timedelta string)')
     parser.add_argument('--latency', type=str,
-                        help='Amount of time (in seconds) to pause before executing code (useful in crontab situations)')
+                        help='Maximum time (in seconds) to wait after t2 for data; stations are processed as soon as '
+                             'their data are in')
+    parser.add_argument('--late-window', type=str,
+                        help='Time after latency during which stations with incomplete data are processed again when '
+                             'their data arrive (minutes or pandas Timedelta string)')
+    parser.add_argument('--poll', type=float,
+                        help='Seconds between data availability probes while waiting for data')
 
     # App options - Overwrite and logging
     parser.add_argument('--log-file', type=str,
                         help='Path to log file (if not specified, logs only to console)')
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='Logging level')
+    parser.add_argument('--log-async', action='store_true',
+                        help='Write log records from a background thread (logging never waits for disk I/O)')
+    parser.add_argument('--log-rotate', type=str,
+                        help='Rotate the log file by size (e.g., 100MB) or time (e.g., midnight, 1D, 6h)')
+    parser.add_argument('--log-backups', type=int,
+                        help='Number of rotated log files to keep')
+    parser.add_argument('--log-format', choices=['text', 'json'],
+                        help='Format of the log file: text or json (one JSON object per line)')
+    parser.add_argument('--metrics-file', type=str,
+                        help='Write a JSON report of stage times and counters (per station and band) after every run')
+    parser.add_argument('--prometheus-file', type=str,
+                        help='Write the run report as a Prometheus textfile (node_exporter textfile collector)')
     parser.add_argument(
         "--no-console-log",
         action="store_true",
@@ -247,7 +351,12 @@ def parse_cli():
     )
     parser.add_argument('--archive', type=str,
                         help='Results output directory (SDS Archive)')
-    # parser.add_argument('--overwrite', type=bool, help='Whether to overwrite existing output files')
+    parser.add_argument('--cache-mb', type=float,
+                        help='Memory budget (MB) for caching RSAM before day files are written (0 writes every window)')
+    parser.add_argument('--memory-mb', type=float,
+                        help='Memory budget (MB) for raw data: load chunks are fetched and processed in parts that fit')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Recompute RSAM that is already in the archive (default: only compute missing samples)')
 
     return parser.parse_args()
 
@@ -265,20 +374,46 @@ def parse_all_input(config_file: str, cli_args: Dict[str, Any]) -> Dict[str, Any
         "t1": None,
         "t2": None,
         "id": [],  # Default empty list of stations
+        "fetch_workers": 8,
+        "timeout": 120,
+        "retries": 2,
+        "raw_cache": None,
+        "raw_cache_mb": None,
+        "raw_cache_days": None,
 
         "freq": [None, [0.1, 1], [1, 3], [1, 5], [1, 10], [5, 10], [10, 15], [15, 20]],
+        "mode": "filter",
+        "state_file": None,
+        "precision": None,
+        "pyramid": None,
 
         "tload": "1D",
         "tproc": "10min",
         "tstep": "10min",
         "latency": 0,
+        "late_window": 0,
+        "poll": 10,
+        "daemon": False,
+        "stream": False,
+        "catchup": "1D",
+        "backfill": None,
+        "backfill_batch": 10,
+        "workers": 1,
 
         "archive": "./results/SDS_ffrsam",
+        "cache_mb": 256,
+        "memory_mb": None,
 
         "overwrite": False,
         "no-console-log": False,
         "log_level": "INFO",
         "log_file": "./tsdatacruncher.log",
+        "log_async": False,
+        "log_rotate": None,
+        "log_backups": 7,
+        "log_format": "text",
+        "metrics_file": None,
+        "prometheus_file": None,
     }
 
     # Load configuration from file if it exists
@@ -305,9 +440,29 @@ def parse_all_input(config_file: str, cli_args: Dict[str, Any]) -> Dict[str, Any
         config['t2'] = cli_args['t2']
     if cli_args.get('id'):
         config['id'] = cli_args['id']
+    if cli_args.get('fetch_workers'):
+        config['fetch_workers'] = cli_args['fetch_workers']
+    if cli_args.get('timeout'):
+        config['timeout'] = cli_args['timeout']
+    if cli_args.get('retries') is not None:
+        config['retries'] = cli_args['retries']
+    if cli_args.get('raw_cache'):
+        config['raw_cache'] = cli_args['raw_cache']
+    if cli_args.get('raw_cache_mb'):
+        config['raw_cache_mb'] = cli_args['raw_cache_mb']
+    if cli_args.get('raw_cache_days'):
+        config['raw_cache_days'] = cli_args['raw_cache_days']
 
     if cli_args.get('freq'):
         config['freq'] = cli_args['freq']
+    if cli_args.get('mode'):
+        config['mode'] = cli_args['mode']
+    if cli_args.get('precision'):
+        config['precision'] = cli_args['precision']
+    if cli_args.get('pyramid'):
+        config['pyramid'] = cli_args['pyramid']
+    if cli_args.get('state_file'):
+        config['state_file'] = cli_args['state_file']
 
     if cli_args.get('tload'):
         config['tload'] = cli_args['tload']
@@ -317,31 +472,91 @@ def parse_all_input(config_file: str, cli_args: Dict[str, Any]) -> Dict[str, Any
         config['tstep'] = cli_args['tstep']
     if cli_args.get('latency'):
         config['latency'] = cli_args['latency']
+    if cli_args.get('late_window'):
+        config['late_window'] = cli_args['late_window']
+    if cli_args.get('poll'):
+        config['poll'] = cli_args['poll']
+    if cli_args.get('daemon'):
+        config['daemon'] = cli_args['daemon']
+    if cli_args.get('stream'):
+        config['stream'] = cli_args['stream']
+    if cli_args.get('backfill'):
+        config['backfill'] = cli_args['backfill']
+    if cli_args.get('catchup'):
+        config['catchup'] = cli_args['catchup']
+    if cli_args.get('workers'):
+        config['workers'] = cli_args['workers']
 
     if cli_args.get('overwrite'):
         config['overwrite'] = cli_args['overwrite']
     if cli_args.get('archive'):
         config['archive'] = cli_args['archive']
+    if cli_args.get('cache_mb') is not None:
+        config['cache_mb'] = cli_args['cache_mb']
+    if cli_args.get('memory_mb'):
+        config['memory_mb'] = cli_args['memory_mb']
     if cli_args.get('log_file'):
         config['log_file'] = cli_args['log_file']
     if cli_args.get('log_level'):
         config['log_level'] = cli_args['log_level']
+    if cli_args.get('log_async'):
+        config['log_async'] = cli_args['log_async']
+    if cli_args.get('log_rotate'):
+        config['log_rotate'] = cli_args['log_rotate']
+    if cli_args.get('log_backups') is not None:
+        config['log_backups'] = cli_args['log_backups']
+    if cli_args.get('log_format'):
+        config['log_format'] = cli_args['log_format']
+    if cli_args.get('metrics_file'):
+        config['metrics_file'] = cli_args['metrics_file']
+    if cli_args.get('prometheus_file'):
+        config['prometheus_file'] = cli_args['prometheus_file']
     if cli_args.get('no-consolue-log'):
         config['no-console-log'] = cli_args['no-console-log']
 
     # Validate and parse all inputs
     config["latency"] = int(config["latency"])
-    if config["latency"] > 0:
-        print("Waiting for data. Pausing program for {} seconds.".format(config["latency"]))
-        time.sleep(config["latency"])
+    config["late_window"] = parse_time_delta(config["late_window"])
+    config["poll"] = max(0.1, float(config["poll"]))
 
     config["tload"] = parse_time_delta(config["tload"])
     config["tproc"] = parse_time_delta(config["tproc"])
     config["tstep"] = parse_time_delta(config["tstep"])
+    config["catchup"] = parse_time_delta(config["catchup"])
+    config["cache_mb"] = float(config["cache_mb"])
+    config["memory_mb"] = None if config["memory_mb"] in (None, "None") else float(config["memory_mb"])
+    config["precision"] = None if config["precision"] in (None, "None") else str(config["precision"])
+    config["workers"] = max(1, int(config["workers"]))
+    config["fetch_workers"] = max(1, int(config["fetch_workers"]))
+    config["timeout"] = float(config["timeout"])
+    config["retries"] = max(0, int(config["retries"]))
+    config["raw_cache"] = None if config["raw_cache"] in (None, "None") else config["raw_cache"]
+    config["raw_cache_mb"] = None if config["raw_cache_mb"] in (None, "None") else float(config["raw_cache_mb"])
+    config["raw_cache_days"] = None if config["raw_cache_days"] in (None, "None") else float(config["raw_cache_days"])
+    config["log_async"] = config["log_async"] in (True, "True", "true")
+    config["log_rotate"] = None if config["log_rotate"] in (None, "None") else str(config["log_rotate"])
+    parse_rotation(config["log_rotate"])  # fails early on an unrecognized rotation
+    config["log_backups"] = max(0, int(config["log_backups"]))
+    if config["log_format"] not in ("text", "json"):
+        raise ValueError(f"Unrecognized log format: {config['log_format']} (text or json)")
+    config["metrics_file"] = None if config["metrics_file"] in (None, "None") else config["metrics_file"]
+    config["prometheus_file"] = None if config["prometheus_file"] in (None, "None") else config["prometheus_file"]
+    config["pyramid"] = parse_pyramid(config["pyramid"])
+    config["overwrite"] = config["overwrite"] in (True, "True", "true")
+    config["backfill"] = None if config["backfill"] in (None, "None") else config["backfill"]
+    config["backfill_batch"] = max(1, int(config["backfill_batch"]))
+    if config["state_file"] in (None, "None"):
+        archive_dir = config["archive"][len("npy://"):] if config["archive"].startswith("npy://") else config["archive"]
+        config["state_file"] = os.path.join(archive_dir, "ffrsam_state.json")
     config["t1"], config["t2"] = verify_t1_t2(config["t1"], config["t2"], config["tproc"])
 
+    config["id_file"] = config["id"] if isinstance(config["id"], str) and os.path.isfile(config["id"]) else None
     config["id"] = parse_ids(config["id"])
 
+    # Keep track of where the configuration came from (daemon mode reloads it when it changes)
+    config["config_file"] = config_file
+    config["cli_args"] = cli_args
+
     config["freq"] = parse_freq(config["freq"])
 
     return config
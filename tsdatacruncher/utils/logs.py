@@ -1,33 +1,109 @@
 # tsdatacruncher/utils/logging_utils.py
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import re
 from typing import Optional
 
 # Dictionary to store loggers by name
 loggers = {}
 
+# Dictionary to store the listeners of asynchronous loggers by name (see setup_logger)
+listeners = {}
+
+# Dictionary to store the settings each logger was set up with, by name (see setup_logger)
+logger_settings = {}
+
+# Log rotation: a size (e.g., "100MB") or a time interval (e.g., "midnight", "1D", "6h")
+rotate_size = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$", re.IGNORECASE)
+rotate_time = re.compile(r"^\s*(\d+)\s*(s|min|h|d)\s*$", re.IGNORECASE)
+rotate_time_units = {"s": "S", "min": "M", "h": "H", "d": "D"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as one JSON object per line (time, logger, level, process, message)"""
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "logger": record.name, "level": record.levelname,
+                 "process": record.processName, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def parse_rotation(rotate):
+    """
+    Parses a log rotation setting; returns None, ("size", bytes) or ("time", when, interval) (see
+    logging.handlers.TimedRotatingFileHandler). Raises ValueError for anything else.
+    """
+
+    if rotate in (None, "None", ""):
+        return None
+    if str(rotate).lower() == "midnight":
+        return "time", "midnight", 1
+    match = rotate_size.match(str(rotate))
+    if match:
+        return "size", int(float(match.group(1)) * 1024 ** "_kmg".index(match.group(2).lower() or "_"))
+    match = rotate_time.match(str(rotate))
+    if match:
+        return "time", rotate_time_units[match.group(2).lower()], int(match.group(1))
+    raise ValueError(f"Unrecognized log rotation: {rotate} (e.g., 100MB, midnight, 1D, 6h)")
+
+
+def file_handler(log_file: str, rotate: Optional[str] = None, backups: int = 7) -> logging.Handler:
+    """Returns a handler that writes to log_file, rotated by size or time (see parse_rotation), keeping backups"""
+
+    rotation = parse_rotation(rotate)
+    if rotation is None:
+        return logging.FileHandler(log_file)
+    if rotation[0] == "size":
+        return logging.handlers.RotatingFileHandler(log_file, maxBytes=rotation[1], backupCount=backups)
+    return logging.handlers.TimedRotatingFileHandler(log_file, when=rotation[1], interval=rotation[2],
+                                                     backupCount=backups)
+
 
 def setup_logger(
         logger_name: str,
         log_level: str = "INFO",
         log_file: Optional[str] = None,
-        console_output: bool = True
+        console_output: bool = True,
+        async_logging: bool = False,
+        rotate: Optional[str] = None,
+        backups: int = 7,
+        log_format: str = "text"
 ) -> logging.Logger:
     """
     Set up and return a logger with the specified configuration.
 
+    With async_logging, the logger only puts records on an in-memory queue, and a background thread (QueueListener)
+    writes them to the file and console, so logging never waits for disk I/O. Records left in the queue are written
+    when the process exits (or with stop_logging). Records from worker processes reach the same handlers through
+    start_queue_listener, so only this process writes (and rotates) the log file.
+
+    A logger that exists with the same settings is returned as it is. With other settings (e.g., a configuration
+    reloaded by the daemon), its handlers are closed and it is set up again.
+
     Args:
         logger_name: Unique name for the logger
         log_level: Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_file: Path to log file; if None, no file logging
         console_output: Whether to output logs to console
+        async_logging: Whether to write records from a background thread
+        rotate: Rotate the log file by size (e.g., "100MB") or time (e.g., "midnight", "1D"); None: no rotation
+        backups: Number of rotated log files to keep
+        log_format: Format of the log file: "text" or "json" (one JSON object per line); the console is always text
 
     Returns:
         Configured logger instance
     """
-    # If logger already exists with this name, return it
-    if logger_name in loggers:
+    # If logger already exists with this name and these settings, return it
+    settings = (log_level, log_file, console_output, async_logging, rotate, backups, log_format)
+    if logger_name in loggers and logger_settings.get(logger_name) == settings:
         return loggers[logger_name]
+    logger_settings[logger_name] = settings
 
     # Create new logger
     logger = logging.getLogger(logger_name)
@@ -41,24 +117,38 @@ def setup_logger(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
-    # Clear any existing handlers to avoid duplicates
-    if logger.hasHandlers():
-        logger.handlers.clear()
+    # Close and clear any existing handlers (e.g., of earlier settings) to avoid duplicates
+    stop_logging(logger_name)
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers.clear()
+
+    handlers = []
 
     # Add file handler if log file is specified
     if log_file:
         # Ensure directory exists
         os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
 
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        log_file_handler = file_handler(log_file, rotate=rotate, backups=backups)
+        log_file_handler.setFormatter(JsonFormatter() if log_format == "json" else formatter)
+        handlers.append(log_file_handler)
 
     # Add console handler if specified
     if console_output:
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
+
+    # Asynchronous: the logger only enqueues records; the listener thread passes them to the handlers
+    if async_logging and handlers:
+        log_queue = queue.SimpleQueue()
+        listeners[logger_name] = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listeners[logger_name].start()
+        handlers = [logging.handlers.QueueHandler(log_queue)]
+
+    for handler in handlers:
+        logger.addHandler(handler)
 
     # Store logger in dictionary
     loggers[logger_name] = logger
@@ -80,4 +170,70 @@ def get_logger(logger_name: str) -> logging.Logger:
         return loggers[logger_name]
     else:
         # Create a basic logger if one doesn't exist yet
-        return setup_logger(logger_name)
\ No newline at end of file
+        return setup_logger(logger_name)
+
+def setup_worker_logger(logger_name: str, log_level: str, queue) -> logging.Logger:
+    """
+    Set up a logger in a worker process that forwards every record to the parent process.
+
+    Intended as a process pool initializer. The parent process drains the queue with start_queue_listener, so
+    records from all workers end up in the handlers configured by setup_logger.
+
+    Args:
+        logger_name: Name of the logger (same as in the parent process)
+        log_level: Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+        queue: multiprocessing Queue shared with the parent process
+
+    Returns:
+        Configured logger instance
+    """
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(getattr(logging, log_level.upper(), logging.INFO))
+
+    # Handlers inherited from the parent (fork) would write to the same files/streams; only use the queue
+    if logger.hasHandlers():
+        logger.handlers.clear()
+    logger.addHandler(logging.handlers.QueueHandler(queue))
+    logger.propagate = False
+
+    loggers[logger_name] = logger
+
+    return logger
+
+
+def start_queue_listener(logger: logging.Logger, queue) -> logging.handlers.QueueListener:
+    """
+    Start a listener that passes records from worker processes to the handlers of logger.
+
+    Args:
+        logger: Logger set up with setup_logger in the parent process
+        queue: multiprocessing Queue passed to setup_worker_logger in the workers
+
+    Returns:
+        Running QueueListener; call stop() to flush remaining records
+    """
+    listener = logging.handlers.QueueListener(queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging(logger_name: Optional[str] = None):
+    """
+    Write the records still queued by asynchronous loggers (see setup_logger) and stop their listener threads.
+    The loggers keep logging, synchronously.
+
+    Args:
+        logger_name: Logger to stop; if None, every asynchronous logger
+    """
+    for name in [logger_name] if logger_name else list(listeners):
+        listener = listeners.pop(name, None)
+        if listener is not None:
+            listener.stop()
+            logger = logging.getLogger(name)
+            logger.handlers.clear()
+            for handler in listener.handlers:
+                logger.addHandler(handler)
+
+
+# Queued records are written before logging shuts down its handlers (atexit runs in reverse order of registration)
+atexit.register(stop_logging)
@@ -0,0 +1,210 @@
+"""
+Timers and counters for one run: time spent per stage (fetch, preprocess, filter, rms, spectral, read, write,
+pyramid), per station and frequency band, and counts of samples, files and bytes.
+
+Instrumentation is off until start() is called: timer() then returns a shared no-op context manager and count()
+returns right away, so instrumented code costs one function call per request, trace, band or file. Worker processes
+call start() and stop() around their task and return the snapshot, which the parent process merges (see merge).
+At the end of a run, summary() is written as JSON (write_json) and, optionally, as a Prometheus textfile for the
+node_exporter textfile collector (write_prometheus).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Timers and counters of the current run (None: instrumentation is off)
+_metrics = None
+_noop = nullcontext()
+
+# Order of the stages in reports
+stages = ["fetch", "preprocess", "filter", "rms", "spectral", "read", "write", "pyramid"]
+
+
+class Metrics:
+    """Thread-safe timers ([calls, seconds]) and counters keyed by (name, station, band)"""
+
+    def __init__(self):
+        self.timers = dict()
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds, station="", band="", calls=1):
+        with self._lock:
+            entry = self.timers.setdefault((stage, station, band), [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    def add_count(self, name, value=1, station="", band=""):
+        with self._lock:
+            key = (name, station, band)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        """Returns the timers and counters as plain lists (JSON-serializable and picklable)"""
+
+        with self._lock:
+            return {"timers": [[*key, calls, seconds] for key, (calls, seconds) in self.timers.items()],
+                    "counters": [[*key, value] for key, value in self.counters.items()]}
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "station", "band", "t0")
+
+    def __init__(self, metrics, stage, station, band):
+        self.metrics, self.stage, self.station, self.band = metrics, stage, station, band
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.stage, time.perf_counter() - self.t0, station=self.station, band=self.band)
+        return False
+
+
+def start():
+    """Turns instrumentation on with empty timers and counters (e.g., at the start of a run or worker task)"""
+
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def stop():
+    """Turns instrumentation off; returns the snapshot of the timers and counters (None if it was off)"""
+
+    global _metrics
+    metrics, _metrics = _metrics, None
+    return metrics.snapshot() if metrics is not None else None
+
+
+def enabled():
+    return _metrics is not None
+
+
+def timer(stage, station="", band=""):
+    """Context manager that adds the time spent in its block to stage (for station and band)"""
+
+    if _metrics is None:
+        return _noop
+    return _Timer(_metrics, stage, station, band)
+
+
+def count(name, value=1, station="", band=""):
+    """Adds value to counter name (for station and band)"""
+
+    if _metrics is not None:
+        _metrics.add_count(name, value, station=station, band=band)
+
+
+def merge(snapshot):
+    """Adds a snapshot (e.g., returned by a worker process, see stop) to the current timers and counters"""
+
+    if _metrics is None or not snapshot:
+        return
+    for stage, station, band, calls, seconds in snapshot["timers"]:
+        _metrics.add_time(stage, seconds, station=station, band=band, calls=calls)
+    for name, station, band, value in snapshot["counters"]:
+        _metrics.add_count(name, value, station=station, band=band)
+
+
+def summary(snapshot, **run):
+    """
+    Returns the report of a run (dict): run information (keyword arguments, e.g., t1, t2, seconds, errors), totals
+    per stage and counter, per station and per band, and every timer and counter.
+
+    Stage times are summed over threads and worker processes, so concurrent stages (e.g., fetch with several
+    fetch_workers) can add up to more than the run took.
+    """
+
+    def totals(key):
+        out = dict()
+        for stage, station, band, calls, seconds in snapshot["timers"]:
+            label = {"stage": stage, "station": station, "band": band}[key]
+            entry = out.setdefault(label, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+        return out
+
+    def per(key):
+        out = dict()
+        for stage, station, band, calls, seconds in snapshot["timers"]:
+            label = station if key == "station" else band
+            if label:
+                out.setdefault(label, dict())
+                out[label][stage] = out[label].get(stage, 0.0) + seconds
+        return {label: out[label] for label in sorted(out)}
+
+    counters = dict()
+    for name, station, band, value in snapshot["counters"]:
+        counters[name] = counters.get(name, 0) + value
+
+    stage_totals = totals("stage")
+    return {"run": run,
+            "stages": {stage: stage_totals[stage] for stage in sorted(stage_totals, key=_stage_order)},
+            "counters": counters,
+            "stations": per("station"),
+            "bands": per("band"),
+            "timers": [dict(stage=s, station=st, band=b, calls=c, seconds=t) for s, st, b, c, t in snapshot["timers"]],
+            "counters_detail": [dict(name=n, station=st, band=b, value=v) for n, st, b, v in snapshot["counters"]]}
+
+
+def _stage_order(stage):
+    return (stages.index(stage) if stage in stages else len(stages), stage)
+
+
+def format_stages(report):
+    """Returns a one-line description of the stage totals of a report (see summary)"""
+
+    return ", ".join(f"{stage} {entry['seconds']:.2f} s" for stage, entry in report["stages"].items())
+
+
+def _write(text, filename):
+    """Writes text to filename atomically (readers never see partial files)"""
+
+    from tsdatacruncher.utils.tsdata import write_text_atomic  # (tsdata imports this module)
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    write_text_atomic(text, filename)
+
+
+def write_json(report, filename):
+    _write(json.dumps(report, indent=1, default=str), filename)
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    labels = ",".join(f'{key}="{escape(value)}"' for key, value in labels.items() if value != "")
+    return "{" + labels + "}" if labels else ""
+
+
+def write_prometheus(report, filename, prefix="tsdatacruncher"):
+    """
+    Writes a report (see summary) in the Prometheus text format, for the node_exporter textfile collector.
+
+    Every metric is a gauge that describes the last run: stage seconds and calls per stage, station and band,
+    counters per station and band, and the run information that is numeric (e.g., seconds, errors).
+    """
+
+    lines = [f"# HELP {prefix}_stage_seconds Time spent in each stage during the last run",
+             f"# TYPE {prefix}_stage_seconds gauge"]
+    lines += [f"{prefix}_stage_seconds{_labels(stage=t['stage'], station=t['station'], band=t['band'])} "
+              f"{t['seconds']:.6f}" for t in report["timers"]]
+    lines += [f"# HELP {prefix}_stage_calls Number of times each stage ran during the last run",
+              f"# TYPE {prefix}_stage_calls gauge"]
+    lines += [f"{prefix}_stage_calls{_labels(stage=t['stage'], station=t['station'], band=t['band'])} {t['calls']}"
+              for t in report["timers"]]
+    for name in sorted(set(c["name"] for c in report["counters_detail"])):
+        lines += [f"# HELP {prefix}_{name} Total {name.replace('_', ' ')} during the last run",
+                  f"# TYPE {prefix}_{name} gauge"]
+        lines += [f"{prefix}_{name}{_labels(station=c['station'], band=c['band'])} {c['value']}"
+                  for c in report["counters_detail"] if c["name"] == name]
+    for key, value in report["run"].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines += [f"# HELP {prefix}_run_{key} Run {key} (last run)", f"# TYPE {prefix}_run_{key} gauge",
+                      f"{prefix}_run_{key} {value}"]
+    _write("\n".join(lines) + "\n", filename)
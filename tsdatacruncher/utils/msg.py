@@ -1,5 +1,35 @@
 
 
+def system_memory():
+    """
+    Returns (available, total) physical memory in bytes, or None where unknown.
+
+    Reads /proc/meminfo or sysconf, so psutil (slow to import) is only loaded on systems that have neither.
+    """
+    import os
+
+    try:
+        with open("/proc/meminfo") as f:
+            info = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f if line.split()[1].isdigit()}
+        return info.get("MemAvailable", info.get("MemFree")), info.get("MemTotal")
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        try:
+            import psutil
+        except ImportError:
+            return None, None
+        mem = psutil.virtual_memory()
+        return mem.available, mem.total
+    try:
+        available = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError):
+        available = None
+    return available, total
+
+
 def welcome(logger=None):
     """
     Display welcome message with system information and runtime environment.
@@ -10,7 +40,6 @@ def welcome(logger=None):
     import os
     import sys
     import platform
-    import psutil
     import getpass
     import datetime
 
@@ -22,9 +51,8 @@ def welcome(logger=None):
     python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
 
     # Memory information
-    mem = psutil.virtual_memory()
-    total_memory_gb = mem.total / (1024 ** 3)
-    available_memory_gb = mem.available / (1024 ** 3)
+    available, total = system_memory()
+    gb = lambda n: f"{n / 1024 ** 3:.2f} GB" if n is not None else "unknown"
 
     # User and directory information
     current_user = getpass.getuser()
@@ -44,8 +72,8 @@ Runtime Information:
 System Information:
   - OS           : {os_info}
   - Python       : {python_version}
-  - Memory       : {available_memory_gb:.2f} GB available / {total_memory_gb:.2f} GB total
-  - CPU Cores    : {psutil.cpu_count(logical=False)} physical, {psutil.cpu_count()} logical
+  - Memory       : {gb(available)} available / {gb(total)} total
+  - CPU Cores    : {os.cpu_count()} logical
 
 {'=' * 80}
 """
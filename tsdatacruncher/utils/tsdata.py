@@ -1,23 +1,112 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
 from obspy import Stream
 from obspy.clients.earthworm import Client as EWClient
-from obspy.clients.fdsn import Client as FDSNClient
-from obspy.clients.fdsn.header import URL_MAPPINGS as FDSN_URL_MAPPINGS
-from obspy.clients.seedlink import Client as SeedLinkClient
 from obspy.clients.filesystem.sds import Client as SDSClient
+# The FDSN (requests, lxml) and SeedLink clients are slow to import; they are imported when a datasource needs them
 
 from numpy import dtype
 
-def create_client(datasource):
+from tsdatacruncher.utils import metrics
+
+# Dictionary to store clients by datasource, so long-running processes reuse them
+clients = {}
+
+def tmp_filename(filename):
+    """
+    Name of a temporary file next to filename. The name holds the host, process and thread, because hosts that share
+    storage (e.g., containers) can have the same process ids.
+    """
+
+    return f"{filename}.tmp.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}"
+
+def replace_atomic(filename, write):
+    """
+    Calls write(tmpfilename) to write a temporary file next to filename, then renames it into place.
+
+    The rename is atomic on POSIX filesystems, so a crash or kill during the write never leaves a truncated file
+    behind; readers see either the old or the new file. The temporary file is removed if the write fails.
+    """
+
+    tmpfilename = tmp_filename(filename)
+    try:
+        write(tmpfilename)
+        os.replace(tmpfilename, filename)
+    finally:
+        if os.path.exists(tmpfilename):
+            os.remove(tmpfilename)
+
+def write_atomic(st, outputfilename, format="MSEED", **kwargs):
+    """Writes a Stream to outputfilename atomically (see replace_atomic), e.g., a day file"""
+
+    replace_atomic(outputfilename, lambda tmpfilename: st.write(tmpfilename, format=format, **kwargs))
+
+def write_text_atomic(text, filename):
+    """Writes text to filename atomically (see replace_atomic)"""
+
+    def write(tmpfilename):
+        with open(tmpfilename, "w") as f:
+            f.write(text)
+
+    replace_atomic(filename, write)
+
+def write_json_atomic(obj, filename, **kwargs):
+    """Writes obj as JSON (json.dump kwargs, e.g., indent) to filename atomically (see replace_atomic)"""
+
+    def write(tmpfilename):
+        with open(tmpfilename, "w") as f:
+            json.dump(obj, f, **kwargs)
+
+    replace_atomic(filename, write)
+
+def loaded_instance(obj, module, name):
+    """isinstance(obj, module.name) without importing module (obj cannot be an instance of a class never imported)"""
+
+    return module in sys.modules and isinstance(obj, getattr(sys.modules[module], name))
+
+def is_no_data(e):
+    """True if exception e is an FDSN 'no data' answer (HTTP 204, or 404 from servers that use nodata=404)"""
+
+    if loaded_instance(e, "obspy.clients.fdsn.header", "FDSNNoDataException"):
+        return True
+    return loaded_instance(e, "obspy.clients.fdsn.header", "FDSNException") \
+        and str(e.args[0] if e.args else "").startswith("Unknown HTTP code: 404")  # (ObsPy has no class for 404)
+
+def is_named_fdsn(datasource):
+    """True if datasource is the name of an FDSN data center known to ObsPy (e.g., IRIS)"""
+
+    if '://' in datasource or os.sep in datasource or datasource.startswith(("~", ".")):
+        return False  # URLs and paths (names are single words)
+    from obspy.clients.fdsn.header import URL_MAPPINGS as FDSN_URL_MAPPINGS
+    return datasource in FDSN_URL_MAPPINGS
+
+def fdsn_client(*args, **kwargs):
+    """Creates an obspy.clients.fdsn.Client (imported on first use)"""
+
+    from obspy.clients.fdsn import Client as FDSNClient
+    return FDSNClient(*args, **kwargs)
 
-    fdsn_named_clients = [key for key in sorted(FDSN_URL_MAPPINGS.keys())]
-    # print(fdsn_named_clients)
-    # print(datasource)
-    # print(True) if datasource in fdsn_named_clients else print(False)
+def create_client(datasource, timeout=None):
+    """
+    Creates an ObsPy Client from a datasource string; timeout (s) applies to each FDSN/Winston request.
+
+    Client modules other than SDS and Winston are imported on first use.
+    """
+
+    fdsn_kwargs = {"timeout": timeout} if timeout else {}
 
     # First check if it's a named client
-    if datasource in fdsn_named_clients:
+    if is_named_fdsn(datasource):
+        from obspy.clients.fdsn.header import URL_MAPPINGS as FDSN_URL_MAPPINGS
         server = FDSN_URL_MAPPINGS[datasource]
-        return FDSNClient(server)
+        return fdsn_client(server, **fdsn_kwargs)
 
     # Handle URLs and other formats
     if '://' not in datasource:
@@ -33,16 +122,18 @@ def create_client(datasource):
 
         # Simple host without protocol
         elif '.' not in datasource:
-            return FDSNClient(datasource)
+            return fdsn_client(datasource, **fdsn_kwargs)
         else:
-            return EWClient(datasource, datasource)
+            return EWClient(datasource, datasource, timeout=timeout)
     else:
         # Extract protocol and server part
         protocol, server_str = datasource.split('://', 1)
 
         # Handle FDSN protocols
-        if protocol in ['fdsn', 'http', 'fdsnws']:
-            return FDSNClient(server_str)
+        if protocol in ['http', 'https']:
+            return fdsn_client(datasource, **fdsn_kwargs)  # full URL, e.g. a local FDSN web service
+        elif protocol in ['fdsn', 'fdsnws']:
+            return fdsn_client(server_str, **fdsn_kwargs)
 
         # Handle waveserver protocols
         elif protocol in ['wws', 'waveserver']:
@@ -51,7 +142,7 @@ def create_client(datasource):
             else:
                 server = server_str
                 port = '16022'
-            return EWClient(server, int(port))
+            return EWClient(server, int(port), timeout=timeout)
 
         # Handle seedlink protocol
         elif protocol == 'seedlink':
@@ -60,6 +151,7 @@ def create_client(datasource):
             else:
                 server = server_str
                 port = '18000'
+            from obspy.clients.seedlink import Client as SeedLinkClient
             return SeedLinkClient(server, port=int(port), timeout=1)
 
         # Handle SDS protocol
@@ -70,16 +162,99 @@ def create_client(datasource):
         else:
             raise ValueError(f'Unrecognized protocol in server: {datasource}')
 
-def get_waveforms(client, station_id_list, t1, t2, logger=None):
+def sds_root(datasource):
+    """Returns the directory of a datasource that create_client opens as a local SDS archive, otherwise None"""
 
-    st = Stream()
+    if is_named_fdsn(datasource):
+        return None
+    if datasource.startswith("sds://"):
+        return os.path.expanduser(datasource[len("sds://"):])
+    if '://' not in datasource:
+        expanded_path = os.path.expanduser(datasource)
+        if os.path.isabs(expanded_path) or os.path.exists(expanded_path):
+            return expanded_path
+    return None
+
+def get_client(datasource, timeout=None):
+    """Returns the client for datasource created by an earlier call, or creates one (see create_client)"""
+
+    key = (datasource, timeout)
+    if key not in clients:
+        clients[key] = create_client(datasource, timeout=timeout)
+    return clients[key]
+
+def request_with_retry(func, *args, retries=2, backoff=1.0, **kwargs):
+    """Calls func(*args, **kwargs); retries failed requests with exponential backoff (no retry for 'no data')"""
+
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if is_no_data(e) or attempt == retries:
+                raise  # (no data: the server answered; asking again will not produce data)
+            time.sleep(backoff * 2 ** attempt)
+
+
+def get_waveforms(client, station_id_list, t1, t2, logger=None, max_workers=8, retries=2, backoff=1.0,
+                  bulk_size=50, failed=None):
+    """
+    Downloads waveforms for a list of station IDs (net.sta.loc.cha) concurrently; returns one Stream.
+
+    Requests run in a bounded thread pool that shares the client, so one slow station does not hold up the others.
+    FDSN clients (also behind a raw cache, see wavecache) use get_waveforms_bulk with up to bulk_size channels per
+    request; all other clients (SDS, Winston) make one request per channel. Request timeouts are set on the client
+    (see create_client). Failed requests are retried with exponential backoff (backoff, 2*backoff, ...). SeedLink
+    clients are always queried serially.
+    If a list is passed as failed, the IDs of requests that failed (other than for lack of data) are appended to it.
+    Each request is timed as stage "fetch" of its channel (bulk requests: of no channel; see utils.metrics).
+    """
+
+    # Valid requests in the order of station_id_list
+    requests = []
     for id in station_id_list:
         try:
             net, sta, loc, cha = id.split(".")  # id needs to be expanded to separate arguments
-            st += client.get_waveforms(net, sta, loc, cha, t1, t2)
+            requests.append((net, sta, loc, cha))
         except Exception as e:
-            logger.info(f"-- No data: {id}")
-            continue
+            if logger:
+                logger.info(f"-- No data: {id}")
+
+    if loaded_instance(client, "obspy.clients.seedlink.basic_client", "Client"):
+        max_workers = 1  # one connection, not thread-safe
+
+    remote = client.client if loaded_instance(client, "tsdatacruncher.utils.wavecache", "CachedClient") else client
+    if loaded_instance(remote, "obspy.clients.fdsn.client", "Client") and bulk_size:
+        # One bulk request per group of channels
+        groups = [requests[i:i + bulk_size] for i in range(0, len(requests), bulk_size)]
+        tasks = [(client.get_waveforms_bulk, ([(*r, t1, t2) for r in group],)) for group in groups]
+    else:
+        groups = [[r] for r in requests]
+        tasks = [(client.get_waveforms, (*r, t1, t2)) for r in requests]
+
+    def fetch(func, args, group):
+        with metrics.timer("fetch", station=".".join(group[0]) if len(group) == 1 else ""):
+            return request_with_retry(func, *args, retries=retries, backoff=backoff)
+
+    st = Stream()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(fetch, func, args, group) for (func, args), group in zip(tasks, groups)]
+        for group, future in zip(groups, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = Stream()
+                if failed is not None and not is_no_data(e):
+                    failed.extend(".".join(r) for r in group)
+            st += result
+            for tr in result:
+                metrics.count("samples_fetched", tr.stats.npts, station=tr.id)
+
+            # Report channels without data (bulk requests silently omit them)
+            found = [tr.id.replace("--", "") for tr in result]
+            for net, sta, loc, cha in group:
+                pattern = f"{net}.{sta}.{loc.replace('--', '')}.{cha}"
+                if not any(fnmatch(tr_id, pattern) for tr_id in found) and logger:
+                    logger.info(f"-- No data: {net}.{sta}.{loc}.{cha}")
 
     for tr in st:
         # deal with error when sub-traces have different dtypes
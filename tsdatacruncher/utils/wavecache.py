@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+import time
+
+from obspy import UTCDateTime, Stream, read
+from obspy.clients.filesystem.sds import Client as SDSClient
+
+from tsdatacruncher.utils.tsdata import write_atomic, write_json_atomic, is_no_data
+
+# <SDSdir>/Year/NET/STA/CHAN.TYPE/NET.STA.LOC.CHAN.TYPE.YEAR.DAY
+sds_syntax = "{year}/{net}/{sta}/{cha}.D/{net}.{sta}.{loc}.{cha}.D.{year}.{jday:03d}"
+
+# Dictionary to store cached clients by cache directory, so long-running processes keep their index in memory
+cached_clients = {}
+
+
+def merge_intervals(intervals):
+    """Sorts and merges overlapping or touching [start, end] intervals"""
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_intervals(start, end, intervals):
+    """Returns the parts of [start, end] that are not covered by intervals"""
+
+    missing = []
+    for a, b in merge_intervals(intervals):
+        if b <= start or a >= end:
+            continue
+        if a > start:
+            missing.append([start, a])
+        start = max(start, b)
+    if start < end:
+        missing.append([start, end])
+    return missing
+
+
+class CachedClient:
+    """
+    Persistent local cache of raw waveforms around any ObsPy Client.
+
+    Data fetched from the remote client are stored in an SDS archive below cache_dir, together with a coverage
+    index (cache_dir/coverage.json) of the time intervals each day file holds. get_waveforms serves the covered
+    parts of a request from the local archive and only fetches the missing intervals from the remote client.
+    Intervals that end less than 'settle' seconds before now are only marked as covered up to the last sample
+    received, so late-arriving real-time data are fetched again on the next request.
+
+    Day files are evicted least-recently-used first when the cache exceeds max_bytes, and when they have not been
+    used for max_age seconds. All other attributes are passed through to the remote client.
+    """
+
+    def __init__(self, client, cache_dir, max_bytes=None, max_age=None, settle=3600, logger=None):
+        self.client = client
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.settle = settle
+        self.logger = logger
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index_file = os.path.join(self.cache_dir, "coverage.json")
+        self._lock = threading.Lock()
+        self._local = SDSClient(self.cache_dir)
+        try:
+            with open(self._index_file, "r") as f:
+                self._index = json.load(f)  # relpath -> {"access": timestamp, "coverage": [[start, end], ...],
+                                            #             "size": bytes}
+        except (OSError, ValueError):
+            self._index = dict()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _day_files(self, net, sta, loc, cha, t1, t2):
+        """Yields (relpath, day start, day end) for every day file touched by t1-t2"""
+
+        day = UTCDateTime(t1.date)
+        while day <= t2:
+            relpath = sds_syntax.format(year=day.year, net=net, sta=sta, loc=loc, cha=cha, jday=day.julday)
+            yield relpath, day, day + 86400
+            day += 86400
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime, **kwargs):
+        """Same as Client.get_waveforms; reads covered intervals locally and fetches only missing ones"""
+
+        t1 = UTCDateTime(starttime)
+        t2 = UTCDateTime(endtime)
+        loc = location.replace("--", "")
+        day_files = list(self._day_files(network, station, loc, channel, t1, t2))
+
+        # Fetch and store missing intervals
+        for a, b in self.missing(network, station, location, channel, t1, t2):
+            try:
+                st = self.client.get_waveforms(network, station, location, channel, UTCDateTime(a), UTCDateTime(b),
+                                               **kwargs)
+            except Exception as e:
+                if not is_no_data(e):
+                    raise
+                st = Stream()
+            self._store(st, day_files, a, b)
+            if self.logger:
+                self.logger.debug(f"-- Raw cache: fetched {network}.{station}.{location}.{channel} "
+                                  f"{UTCDateTime(a)} to {UTCDateTime(b)} ({len(st)} traces)")
+
+        st = self._local.get_waveforms(network, station, loc, channel, t1, t2)
+        self._accessed(day_files)
+        return st
+
+    def get_waveforms_bulk(self, bulk, **kwargs):
+        """
+        Same as Client.get_waveforms_bulk (FDSN); the missing intervals of all requests are fetched from the remote
+        client in one bulk request
+        """
+
+        fetch = [(net, sta, loc, cha, UTCDateTime(a), UTCDateTime(b)) for net, sta, loc, cha, t1, t2 in bulk
+                 for a, b in self.missing(net, sta, loc, cha, t1, t2)]
+        if fetch:
+            try:
+                st = self.client.get_waveforms_bulk(fetch, **kwargs)
+            except Exception as e:
+                if not is_no_data(e):
+                    raise
+                st = Stream()
+            for net, sta, loc, cha, a, b in fetch:
+                loc = loc.replace("--", "")
+                st_fetched = st.select(network=net, station=sta, location=loc, channel=cha).slice(a, b)
+                self._store(st_fetched, list(self._day_files(net, sta, loc, cha, a, b)), a.timestamp, b.timestamp)
+            if self.logger:
+                self.logger.debug(f"-- Raw cache: fetched {len(fetch)} intervals in one bulk request "
+                                  f"({len(st)} traces)")
+
+        st = Stream()
+        day_files = []
+        for net, sta, loc, cha, t1, t2 in bulk:
+            t1 = UTCDateTime(t1)
+            t2 = UTCDateTime(t2)
+            loc = loc.replace("--", "")
+            st += self._local.get_waveforms(net, sta, loc, cha, t1, t2)
+            day_files += self._day_files(net, sta, loc, cha, t1, t2)
+        self._accessed(day_files)
+        return st
+
+    def _accessed(self, day_files):
+        """Records the access time of day files, evicts old files and saves the index"""
+
+        with self._lock:
+            now = time.time()
+            for relpath, _, _ in day_files:
+                if relpath in self._index:
+                    self._index[relpath]["access"] = now
+            self._evict()
+            self._save_index()
+
+    def missing(self, network, station, location, channel, starttime, endtime):
+        """Returns the intervals [start, end] (timestamps) of starttime-endtime that are not in the cache"""
+
+        t1 = UTCDateTime(starttime)
+        t2 = UTCDateTime(endtime)
+        day_files = self._day_files(network, station, location.replace("--", ""), channel, t1, t2)
+        with self._lock:
+            covered = [iv for relpath, _, _ in day_files for iv in self._index.get(relpath, {}).get("coverage", [])]
+        return subtract_intervals(t1.timestamp, t2.timestamp, covered)
+
+    def add_waveforms(self, st, network, station, location, channel, starttime, endtime):
+        """
+        Stores data fetched elsewhere (e.g., by winston2sds) and records starttime-endtime as covered.
+
+        Only the day files of [starttime, endtime) are written, so requests that end at midnight do not touch the
+        next day's file (which another thread may be writing).
+        """
+
+        t1 = UTCDateTime(starttime)
+        t2 = UTCDateTime(endtime)
+        day_files = list(self._day_files(network, station, location.replace("--", ""), channel, t1,
+                                         max(t1, t2 - 1e-6)))
+        self._store(st, day_files, t1.timestamp, t2.timestamp)
+
+    def save(self):
+        """Writes the coverage index (get_waveforms does this after every request)"""
+
+        with self._lock:
+            self._save_index()
+
+    def _store(self, st, day_files, a, b):
+        """Merges fetched data into the local day files and records the fetched interval as covered"""
+
+        # Only mark intervals as fully covered once real-time data have had time to arrive
+        if b > time.time() - self.settle:
+            b = min(b, max([tr.stats.endtime.timestamp for tr in st], default=a))
+
+        for relpath, day_start, day_end in day_files:
+            day_st = Stream([tr.slice(day_start, day_end - 1e-6, nearest_sample=False) for tr in st])
+            day_st = Stream([tr for tr in day_st if tr.stats.npts > 0])
+            filename = os.path.join(self.cache_dir, relpath)
+
+            size = None  # of the day file, if written
+            if len(day_st) > 0:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                if os.path.exists(filename):
+                    day_st += read(filename)
+                day_st.merge(method=1, interpolation_samples=0)
+                day_st = day_st.split()
+                try:
+                    write_atomic(day_st, filename)
+                except Exception as e:
+                    write_atomic(day_st, filename, encoding="INT32")  # e.g., differences too large for STEIM2
+                size = os.path.getsize(filename)
+
+            start = max(a, day_start.timestamp)
+            end = min(b, day_end.timestamp)
+            if start < end or size is not None:
+                with self._lock:
+                    entry = self._index.setdefault(relpath, {"access": time.time(), "coverage": []})
+                    if start < end:
+                        entry["coverage"] = merge_intervals(entry["coverage"] + [[start, end]])
+                    if size is not None:
+                        entry["size"] = size
+
+    def _evict(self):
+        """
+        Removes day files unused for max_age seconds, then least recently used files beyond max_bytes (by the sizes
+        recorded in the index when the files were written)
+        """
+
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            for relpath in [k for k, v in self._index.items() if v["access"] < cutoff]:
+                self._remove(relpath)
+
+        if self.max_bytes is not None:
+            sizes = {relpath: self._size(relpath) for relpath in self._index}
+            total = sum(sizes.values())
+            for relpath in sorted(self._index, key=lambda k: self._index[k]["access"]):
+                if total <= self.max_bytes:
+                    break
+                total -= sizes[relpath]
+                self._remove(relpath)
+
+    def _size(self, relpath):
+        entry = self._index[relpath]
+        if "size" not in entry:  # (indexes written before sizes were recorded: once per file)
+            try:
+                entry["size"] = os.path.getsize(os.path.join(self.cache_dir, relpath))
+            except OSError:
+                entry["size"] = 0
+        return entry["size"]
+
+    def _remove(self, relpath):
+        self._index.pop(relpath, None)
+        try:
+            os.remove(os.path.join(self.cache_dir, relpath))
+        except OSError:
+            pass
+        if self.logger:
+            self.logger.debug(f"-- Raw cache: evicted {relpath}")
+
+    def _save_index(self):
+        write_json_atomic(self._index, self._index_file)
+
+
+def get_cached_client(client, cache_dir, **kwargs):
+    """Returns the CachedClient for client and cache_dir created by an earlier call, or creates one"""
+
+    key = (id(client), os.path.abspath(os.path.expanduser(cache_dir)))
+    if key not in cached_clients:
+        cached_clients[key] = CachedClient(client, cache_dir, **kwargs)
+    else:
+        for name, value in kwargs.items():
+            setattr(cached_clients[key], name, value)  # e.g., eviction limits changed in a reloaded config
+    return cached_clients[key]